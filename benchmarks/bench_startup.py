@@ -0,0 +1,172 @@
+#! /usr/bin/env python3
+
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+Measure how long a single invocation of the zettels command takes, as
+editor integrations run it on every keystroke or buffer switch.
+
+A small synthetic Zettelkasten (see zettelgen.py) is indexed in each index
+format once. Then each command runs in a new interpreter, several times,
+and the fastest and the median run are reported, next to the time the
+interpreter itself needs to start. The query of a single Zettel should
+take less than the target (50 ms by default).
+
+With --importtime, the modules taking longest to import for that query
+are listed (python3 -X importtime).
+
+Usage: python3 benchmarks/bench_startup.py [-n 1000] [--runs 20]
+"""
+
+import argparse
+import compileall
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+_PACKAGE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            os.pardir))
+sys.path.insert(0, _PACKAGE_DIR)
+sys.path.insert(0, os.path.dirname(__file__))
+from zettels.sqliteindex import SQLiteIndex
+from zettels.zettelparser import Zettelparser
+import zettelgen
+
+# How the zettels command runs, without depending on an installed script
+_ZETTELS = [sys.executable, '-c',
+            'import sys; sys.path.insert(0, ' + repr(_PACKAGE_DIR) + '); '
+            'from zettels.zettels import main; main()']
+
+def _write_settings(filename, rootdir, indexfile, indexformat):
+    with open(filename, 'w') as f:
+        f.write('rootdir: ' + rootdir + '\n')
+        f.write('indexfile: ' + indexfile + '\n')
+        f.write('indexformat: ' + indexformat + '\n')
+        f.write("outputformat: '{0[1]}'\n")
+        f.write("prettyformat: '{0[0]:<40}| {0[1]}'\n")
+        f.write('ignore: [' + ', '.join(repr(p) for p in zettelgen.IGNORE)
+                + ']\n')
+
+def _build_index(rootdir, indexfile, indexformat):
+    if indexformat == 'sqlite':
+        store = SQLiteIndex(indexfile)
+        Zettelparser.update_store(rootdir, store, zettelgen.IGNORE)
+        store.close()
+    else:
+        index = Zettelparser.update_index(rootdir, None, zettelgen.IGNORE)
+        Zettelparser.write_index(index, indexfile, indexformat)
+
+def _run(command, cwd):
+    start = time.perf_counter()
+    subprocess.check_call(command, cwd=cwd, stdin=subprocess.DEVNULL,
+                          stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def _measure(command, cwd, runs):
+    # The first run warms up the file system cache and writes bytecode.
+    _run(command, cwd)
+    times = [_run(command, cwd) for _ in range(runs)]
+    return min(times), statistics.median(times)
+
+def _importtime(command, cwd, top):
+    output = subprocess.run(command[:1] + ['-X', 'importtime'] + command[1:],
+                            cwd=cwd, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True).stderr
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Modules imported at the top level or by those, the nested ones
+        # are included.
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            modules.append((int(cumulative), name.rstrip()))
+    modules.sort(reverse=True)
+    print("Slowest imports (cumulative):")
+    for cumulative, name in modules[:top]:
+        print("{0:>10.1f} ms {1}".format(cumulative / 1000, name))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup of \
+        the zettels command.')
+    parser.add_argument('-n', type=int, default=1000,
+        help='number of Zettels (default: 1000)')
+    parser.add_argument('--runs', type=int, default=20,
+        help='runs per command (default: 20)')
+    parser.add_argument('--formats', nargs='+',
+        default=['yaml', 'binary', 'mmap', 'sqlite'],
+        help='index formats to query (default: yaml binary mmap sqlite)')
+    parser.add_argument('--target', type=float, default=50,
+        help='target for querying a single Zettel, in ms (default: 50)')
+    parser.add_argument('--importtime', type=int, metavar='N', default=0,
+        help='list the N slowest imports of the query')
+    args = parser.parse_args()
+
+    # Installed packages come with bytecode. Without it, each run would 
+    # compile the modules again if bytecode isn't written (e.g. with 
+    # PYTHONDONTWRITEBYTECODE).
+    compileall.compile_dir(os.path.join(_PACKAGE_DIR, 'zettels'), quiet=1)
+    workdir = tempfile.mkdtemp(prefix='zettels-startup-')
+    try:
+        rootdir = os.path.join(workdir, 'Zettelkasten')
+        os.makedirs(rootdir)
+        paths = zettelgen.generate(rootdir, args.n, ignored=0.05)
+        zettel = os.path.join(rootdir, paths[len(paths) // 2])
+
+        baseline = _measure([sys.executable, '-c', 'pass'], workdir,
+                            args.runs)
+        print("{0:<40}{1:>10}{2:>10}".format('', 'min', 'median'))
+        print("{0:<40}{1:>8.1f}ms{2:>8.1f}ms".format(
+              'python3 -c pass', baseline[0] * 1000, baseline[1] * 1000))
+        missed = False
+        for indexformat in args.formats:
+            settings = os.path.join(workdir, indexformat + '.cfg.yaml')
+            indexfile = os.path.join(workdir, 'index.' + indexformat)
+            _write_settings(settings, rootdir, indexfile, indexformat)
+            _build_index(rootdir, indexfile, indexformat)
+            zettels = _ZETTELS + ['-s', settings]
+            for name, command in [
+                    ('query one Zettel', zettels + [zettel]),
+                    ('followups of one Zettel', zettels + ['-f', zettel]),
+                    ('list all Zettels', zettels),
+                    ('list 10 Zettels, unsorted',
+                     zettels + ['--limit', '10', '--unsorted'])]:
+                fastest, median = _measure(command, workdir, args.runs)
+                print("{0:<40}{1:>8.1f}ms{2:>8.1f}ms".format(
+                      indexformat + ': ' + name, fastest * 1000,
+                      median * 1000))
+                if name == 'query one Zettel' and median * 1000 > args.target:
+                    missed = True
+        print("Target for querying one Zettel: {0:.0f} ms, {1}".format(
+              args.target, 'missed' if missed else 'met'))
+        if args.importtime:
+            _importtime(_ZETTELS + ['-s', settings, zettel], workdir,
+                        args.importtime)
+    finally:
+        shutil.rmtree(workdir)
+    return 1 if missed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
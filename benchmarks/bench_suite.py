@@ -0,0 +1,376 @@
+#! /usr/bin/env python3
+
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+Measure how Zettels scales.
+
+For each size, a synthetic Zettelkasten is generated (see zettelgen.py) in
+a temporary directory. Then the suite times
+- a full rebuild of the index, an update without changes, an incremental
+  update after modifying some Zettels and pruning after deleting some
+- write_index() and read_index() in each index format, and the SQLite store
+- each query of Zettelkasten, per call, for a sample of Zettels, on the
+  index dictionary, the CompactIndex and the SQLite store
+- the memory taken by the index dictionary and by the CompactIndex
+
+The results are written as JSON, so runs can be compared:
+
+Usage: python3 benchmarks/bench_suite.py [--sizes 1000 10000] [-o FILE]
+       python3 benchmarks/bench_suite.py --compare OLD.json NEW.json
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.dirname(__file__))
+from zettels import indexformats, journal
+from zettels.compactindex import CompactIndex, CompactZettelkasten
+from zettels.fulltext import FulltextIndex
+from zettels.sqliteindex import SQLiteIndex, SQLiteZettelkasten
+from zettels.zettelkasten import Zettelkasten
+from zettels.zettelparser import Zettelparser
+import zettelgen
+
+def _timed(function, *args, **kwargs):
+    # Returns the result and the elapsed time in seconds. Garbage
+    # collection is kept out of the measurement.
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        return result, time.perf_counter() - start
+    finally:
+        gc.enable()
+
+def _export(zk, graphformat):
+    with open(os.devnull, 'w') as out:
+        zk.export_graph(out, graphformat)
+
+def _touch_content(rootdir, paths):
+    # Change the content (and size) of some Zettels
+    for path in paths:
+        with open(os.path.join(rootdir, path), 'at') as f:
+            f.write("Edited for the benchmark.\n")
+
+class Suite:
+
+    def __init__(self, generator_params, sample, repeat):
+        self.generator_params = generator_params
+        self.sample = sample
+        self.repeat = repeat
+        self.results = []
+
+    def record(self, size, group, name, seconds, calls=1):
+        self.results.append(dict(size=size, group=group, name=name,
+                                 seconds=seconds, calls=calls,
+                                 per_call=seconds / calls))
+        print("{0:>9} {1:<14}{2:<28}{3:>12.6f} s{4}".format(
+              size, group, name, seconds / calls,
+              " per call" if calls > 1 else ""))
+
+    def best_of(self, function, *args, **kwargs):
+        # The fastest of self.repeat runs
+        best = None
+        for _ in range(self.repeat):
+            result, elapsed = _timed(function, *args, **kwargs)
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
+
+    def run(self, size):
+        workdir = tempfile.mkdtemp(prefix='zettels-bench-')
+        rootdir = os.path.join(workdir, 'Zettelkasten')
+        os.makedirs(rootdir)
+        try:
+            paths, elapsed = _timed(zettelgen.generate, rootdir, size,
+                                    **self.generator_params)
+            self.record(size, 'generate', 'zettelgen', elapsed)
+            index = self.run_updates(size, rootdir, paths)
+            self.run_serialization(size, workdir, index)
+            self.run_journal(size, workdir, rootdir, index, paths)
+            self.run_memory(size, workdir, index)
+            self.run_queries(size, rootdir, index, paths)
+            self.run_store(size, workdir, rootdir, paths)
+        finally:
+            shutil.rmtree(workdir)
+
+    def run_updates(self, size, rootdir, paths):
+        ignore = zettelgen.IGNORE
+        index, elapsed = _timed(Zettelparser.update_index, rootdir, None,
+                                ignore)
+        self.record(size, 'update', 'full rebuild', elapsed)
+
+        index, elapsed = self.best_of(Zettelparser.update_index, rootdir,
+                                      index, ignore)
+        self.record(size, 'update', 'no changes', elapsed)
+
+        rng = random.Random(1)
+        changed = rng.sample(paths, max(1, len(paths) // 100))
+        _touch_content(rootdir, changed)
+        index, elapsed = _timed(Zettelparser.update_index, rootdir, index,
+                                ignore)
+        self.record(size, 'update', '1% modified', elapsed)
+
+        # What the watcher does for a batch of changes
+        _touch_content(rootdir, changed[:10])
+        _, elapsed = _timed(Zettelparser.update_paths, rootdir, index,
+                            changed[:10], ignore)
+        self.record(size, 'update', 'update_paths, 10 files', elapsed)
+
+        # Deleted Zettels are restored afterwards. Otherwise, followups 
+        # pointing to them would break the queries.
+        removed = {}
+        for path in rng.sample(paths, max(1, len(paths) // 100)):
+            with open(os.path.join(rootdir, path)) as f:
+                removed[path] = f.read()
+            os.remove(os.path.join(rootdir, path))
+        index, elapsed = _timed(Zettelparser.update_index, rootdir, index,
+                                ignore)
+        self.record(size, 'update', '1% deleted (pruning)', elapsed)
+        for path, content in removed.items():
+            with open(os.path.join(rootdir, path), 'w') as f:
+                f.write(content)
+        index = Zettelparser.update_index(rootdir, index, ignore)
+
+        fulltext = FulltextIndex()
+        _, elapsed = _timed(fulltext.sync, rootdir, index['manifest'])
+        self.record(size, 'update', 'full-text build', elapsed)
+        return index
+
+    def run_serialization(self, size, workdir, index):
+        for name in indexformats.format_names():
+            filename = os.path.join(workdir, 'index.' + name)
+            _, elapsed = self.best_of(Zettelparser.write_index, index,
+                                      filename, name)
+            self.record(size, 'write_index', name, elapsed)
+            _, elapsed = self.best_of(Zettelparser.read_index, filename)
+            self.record(size, 'read_index', name, elapsed)
+            self.results.append(dict(size=size, group='file size', name=name,
+                                     bytes=os.path.getsize(filename)))
+
+    def run_journal(self, size, workdir, rootdir, index, paths):
+        # Single-Zettel edits, each followed by writing the index: the 
+        # whole index versus appending to the journal.
+        rng = random.Random(2)
+        edits = rng.sample(paths, min(10, len(paths)))
+        for name, journaled in (('rewrite', False), ('journal', True)):
+            filename = os.path.join(workdir, 'index-' + name + '.yaml')
+            Zettelparser.write_index(index, filename, 'yaml')
+            index = Zettelparser.read_index(filename)
+            baseline = journal.Baseline(index) if journaled else None
+            elapsed = 0
+            for path in edits:
+                _touch_content(rootdir, [path])
+                Zettelparser.update_paths(rootdir, index, [path], 
+                                          zettelgen.IGNORE)
+                _, seconds = _timed(Zettelparser.write_index, index, 
+                                    filename, None, baseline)
+                elapsed += seconds
+            self.record(size, 'journal', 'write after edit, ' + name, 
+                        elapsed, len(edits))
+            if journaled:
+                self.results.append(dict(size=size, group='file size', 
+                    name='journal after ' + str(len(edits)) + ' edits', 
+                    bytes=journal.IndexJournal(filename).size()))
+                _, elapsed = self.best_of(Zettelparser.read_index, filename)
+                self.record(size, 'journal', 'read_index with journal', 
+                            elapsed)
+
+    def run_memory(self, size, workdir, index):
+        # Memory taken by the loaded index, and by the CompactIndex built
+        # from it, after the index dictionary has been freed. Strings the
+        # CompactIndex shares with the dictionary count for the former.
+        filename = os.path.join(workdir, 'index.memory')
+        Zettelparser.write_index(index, filename, 'binary')
+        gc.collect()
+        tracemalloc.start()
+        try:
+            loaded = Zettelparser.read_index(filename)
+            loaded_size = tracemalloc.get_traced_memory()[0]
+            compact = CompactIndex(loaded)
+            del loaded
+            gc.collect()
+            compact_size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        for name, size_bytes in (('index dictionary', loaded_size),
+                                 ('CompactIndex', compact_size)):
+            self.results.append(dict(size=size, group='memory', name=name,
+                                     bytes=size_bytes))
+            print("{0:>9} {1:<14}{2:<28}{3:>12} bytes".format(
+                  size, 'memory', name, size_bytes))
+        os.remove(filename)
+
+    def _queries(self, zk, paths):
+        zettels = [os.path.join(zk.rootdir, p) for p in paths]
+        return [
+            ('get_list_of_zettels', lambda: zk.get_list_of_zettels(), 1),
+            ('iter_zettels, first 10',
+             lambda: list(zk.iter_zettels(limit=10)), 1),
+            ('iter_zettels, top 10 sorted',
+             lambda: list(zk.iter_zettels(limit=10, sort=True)), 1),
+            ('get_title_of', lambda: [zk.get_title_of(z) for z in zettels],
+             len(zettels)),
+            ('get_followups_of',
+             lambda: [zk.get_followups_of(z) for z in zettels], len(zettels)),
+            ('get_targets_of',
+             lambda: [zk.get_targets_of(z) for z in zettels], len(zettels)),
+            ('get_incoming_of',
+             lambda: [zk.get_incoming_of(z) for z in zettels], len(zettels)),
+            ('get_tags_of',
+             lambda: [zk.get_tags_of(z) for z in zettels], len(zettels)),
+            ('get_relations_of',
+             lambda: [zk.get_relations_of(z) for z in zettels], len(zettels)),
+            ('get_zettels_tagged_with',
+             lambda: zk.get_zettels_tagged_with('tag1'), 1),
+            ('get_zettels_matching',
+             lambda: zk.get_zettels_matching('tag1 OR (group5 AND NOT bench)'),
+             1),
+            ('get_ranking, pagerank',
+             lambda: zk.get_ranking('pagerank'), 1),
+            ('get_ranking, authority',
+             lambda: zk.get_ranking('authority'), 1),
+            ('export_graph, graphml',
+             lambda: _export(zk, 'graphml'), 1),
+            ('export_graph, tsv', lambda: _export(zk, 'tsv'), 1),
+        ]
+
+    def run_queries(self, size, rootdir, index, paths):
+        rng = random.Random(2)
+        sample = rng.sample(paths, min(self.sample, len(paths)))
+        zk = Zettelkasten(index, rootdir)
+        for name, query, calls in self._queries(zk, sample):
+            _, elapsed = self.best_of(query)
+            self.record(size, 'query', name, elapsed, calls)
+        zk, elapsed = _timed(CompactZettelkasten, index, rootdir)
+        self.record(size, 'compact query', 'build CompactIndex', elapsed)
+        for name, query, calls in self._queries(zk, sample):
+            _, elapsed = self.best_of(query)
+            self.record(size, 'compact query', name, elapsed, calls)
+
+    def run_store(self, size, workdir, rootdir, paths):
+        filename = os.path.join(workdir, 'index.sqlite')
+        store = SQLiteIndex(filename)
+        _, elapsed = _timed(Zettelparser.update_store, rootdir, store,
+                            zettelgen.IGNORE)
+        self.record(size, 'sqlite', 'full rebuild', elapsed)
+        _, elapsed = self.best_of(Zettelparser.update_store, rootdir, store,
+                                  zettelgen.IGNORE)
+        self.record(size, 'sqlite', 'no changes', elapsed)
+        rng = random.Random(2)
+        sample = rng.sample(paths, min(self.sample, len(paths)))
+        zk = SQLiteZettelkasten(store, rootdir)
+        for name, query, calls in self._queries(zk, sample):
+            _, elapsed = self.best_of(query)
+            self.record(size, 'sqlite query', name, elapsed, calls)
+        store.close()
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old_file, new_file):
+    """
+    Print the ratio new/old of each result both runs contain.
+    """
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    key = lambda r: (r['size'], r['group'], r['name'])
+    old_results = dict((key(r), r) for r in old['results'] if 'per_call' in r)
+    print("{0:>9} {1:<14}{2:<28}{3:>12}{4:>12}{5:>9}".format(
+          'size', 'group', 'name', 'old', 'new', 'new/old'))
+    for r in new['results']:
+        o = old_results.get(key(r))
+        if o is None or not o['per_call'] or not 'per_call' in r:
+            continue
+        print("{0:>9} {1:<14}{2:<28}{3:>12.6f}{4:>12.6f}{5:>8.2f}x".format(
+              r['size'], r['group'], r['name'], o['per_call'], r['per_call'],
+              r['per_call'] / o['per_call']))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Zettels with \
+        synthetic Zettelkästen.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+        help='numbers of Zettels to run the suite for (default: 1000 10000)')
+    parser.add_argument('-o', '--output', default='bench_results.json',
+        help='file to write the results to (default: bench_results.json)')
+    parser.add_argument('--sample', type=int, default=200,
+        help='number of Zettels per query type (default: 200)')
+    parser.add_argument('--repeat', type=int, default=3,
+        help='runs of repeatable measurements, the fastest counts \
+        (default: 3)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--metadata', type=int, default=2)
+    parser.add_argument('--links', type=int, default=3)
+    parser.add_argument('--followup-depth', type=int, default=2)
+    parser.add_argument('--fanout', type=int, default=10)
+    parser.add_argument('--per-dir', type=int, default=100)
+    parser.add_argument('--ignored', type=float, default=0.05)
+    parser.add_argument('--body', type=int, default=20)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+        help='compare the results of two runs instead of running the suite')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    generator_params = dict(seed=args.seed, metadata=args.metadata,
+                            links=args.links,
+                            followup_depth=args.followup_depth,
+                            fanout=args.fanout, per_dir=args.per_dir,
+                            ignored=args.ignored, body=args.body)
+    suite = Suite(generator_params, args.sample, args.repeat)
+    for size in args.sizes:
+        suite.run(size)
+
+    with open(args.output, 'w') as f:
+        json.dump(dict(
+            meta=dict(date=datetime.datetime.now().isoformat(),
+                      revision=_git_revision(),
+                      python=platform.python_version(),
+                      platform=platform.platform(),
+                      sizes=args.sizes, sample=args.sample,
+                      repeat=args.repeat, generator=generator_params),
+            results=suite.results), f, indent=1)
+    print("Results written to " + args.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+#! /usr/bin/env python3
+
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+Check zettels.frontmatter against PyYAML, and compare their speed.
+
+Random metadata blocks are put together from simple and tricky pieces
+(booleans, dates, floats, nested structures, odd quoting and indentation,
+...). Each one is parsed by frontmatter.load() and by PyYAML: with the
+loader frontmatter.load() falls back to, and with the pure Python
+yaml.safe_load() for the blocks the fast path handles. They have to return
+the same data, with the same types, or all of them have to fail. The
+metadata blocks of the Zettels in the given directories are checked the
+same way.
+
+The exit status is 1 if there's any mismatch, so the check can gate 
+changes of the parser (see "make check"). The speed is only compared if
+all of them agree.
+
+Usage: python3 benchmarks/check_frontmatter.py [-n NUMBER] [DIRECTORY ...]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from zettels import frontmatter
+from zettels.zettelparser import Zettelparser
+
+_KEYS = ['title', 'tags', 'followups', 'author', 'date', 'yes', 'On', 'a-b',
+         'x_1', '"quoted"', '? complex', 'title ', ' title', 'Title']
+_SCALARS = ['Note 1', "'Note 1'", '"Note 1"', "'it''s'", "it's", '"a\\tb"',
+            'yes', 'No', 'off', 'y', 'n', 'null', '~', 'Null', 'nULL', '',
+            '42', '-7', '+0', '0', '007', '1_000', '0x1f', '1.5', '.5',
+            '1e3', '.inf', '-.Inf', '.NaN', '1:20', '2017-01-01',
+            '2017-01-01 12:00:00', 'a: b', 'a:b', 'a #b', 'a#b', 'a # b',
+            '#x', '- a', '-a', '&anchor a', '*alias', '!!str 1', '!tag x',
+            '|', '>', '%x', '@x', '`x', '{a: b}', '{}', 'Zettelkästen',
+            'ünïcode', '日本語', 'a, b', 'a [b]', 'x   y', 'x ', "'a' 'b'",
+            "'unterminated", '"unterminated', '<<', '=', 'e5', 'inf', 'NaN',
+            'True', 'FALSE', '_x', '%', "'#'", 'a\tb', ' ', '\x85',
+            '\ufeff', '\x07', '../a.md', './b.md', '/c', '//d', '.x',
+            '..', './', '.1/x', '~/x']
+_LISTS = ['[]', '[ ]', '[a, b]', "['a, b', c]", '[a,b]', '[a, ]', '[, a]',
+          '[1, 2]', '[1.5]', '[yes, no]', '[[a], b]', '[a b, c]',
+          '["x", \'y\']', '[a] # comment', '[a]]', '[a', '[a, {b: c}]',
+          '[a:b]', '[a #b]', "[it's]", '[a] x', '[2017-01-01]',
+          '[../a.md, ./b.md]', '[/c.md]', '[.5/x]', '[.../x]', '[~/x]',
+          '[yes, No, TRUE, y, n, On]', '[,]', '[a,#b]', '{a, b}', '{a, }',
+          '{}', '{a: b}', "{'*~', '.*', '.*/'}", '{yes, 1}', '{[a]}',
+          '[\n  a,\n  b,\n]', '{\n    # comment\n    a,\n}', 
+          '[a, # comment\n b]', '[x,#c\n y]', '[x\n y]', "['a\n b']",
+          '[a,\nb]', '{\n  a', '[a]\n  ]']
+
+def _value(rng):
+    kind = rng.random()
+    if kind < 0.45:
+        return rng.choice(_SCALARS)
+    if kind < 0.8:
+        return rng.choice(_LISTS)
+    if kind < 0.9:
+        return rng.choice(_SCALARS) + ' # ' + rng.choice(_SCALARS)
+    return rng.choice(_SCALARS) + rng.choice(_LISTS)
+
+def _block(rng):
+    lines = [rng.choice(['---'] * 20 + ['--- ', 'x---', ''])]
+    for _ in range(rng.randrange(6)):
+        kind = rng.random()
+        if kind < 0.1:
+            lines.append(rng.choice(['', '  ', '# comment', '  # comment']))
+        elif kind < 0.3:
+            # A block list
+            lines.append(rng.choice(_KEYS) + ':'
+                         + rng.choice(['', ' ', ' # comment']))
+            indent = ' ' * rng.choice([0, 0, 2, 4])
+            for _ in range(rng.randrange(4)):
+                if rng.random() < 0.1:
+                    indent = ' ' * rng.choice([0, 1, 2])
+                lines.append(indent + rng.choice(['- ', '- ', '-', '-  '])
+                             + _value(rng))
+        elif kind < 0.35:
+            # A continuation line or a nested mapping
+            lines.append(rng.choice(['  continued', '  key: value',
+                                     'key:', 'key: value']))
+        else:
+            lines.append(rng.choice(_KEYS) + rng.choice([': '] * 10 + [':'])
+                         + _value(rng))
+    return '\n'.join(lines) + rng.choice(['\n', ''])
+
+def _same(a, b):
+    # Equal, with the same types all the way down (1 == True, but not for
+    # us). NaN isn't even equal to itself.
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict):
+        return (list(a) == list(b)
+                and all(_same(a[k], b[k]) for k in a))
+    if isinstance(a, float) and a != a:
+        return b != b
+    return a == b
+
+def _outcome(load, text):
+    try:
+        return True, load(text)
+    except (yaml.YAMLError, ValueError):
+        return False, 'error'
+
+def _libyaml_load(text):
+    # What frontmatter.load() falls back to
+    return yaml.load(text, Loader=frontmatter._safe_loader())
+
+def _is_fast(text, delimited=True):
+    try:
+        frontmatter._load_simple(text, delimited)
+    except frontmatter._Unsupported:
+        return False
+    return True
+
+def check(texts):
+    """
+    Compare frontmatter.load() with the loader it falls back to. The 
+    blocks the fast path handles are compared with the pure Python 
+    yaml.safe_load(), too, since libyaml is optional. The same for 
+    frontmatter.load_document(), with the first line of each block 
+    removed.
+    
+    :return: the number of texts the results differ for
+    """
+    mismatches = 0
+    documents = [(frontmatter.load_document, text.partition('\n')[2], False)
+                 for text in texts]
+    for parse, text, delimited in ([(frontmatter.load, text, True)
+                                    for text in texts] + documents):
+        ok, result = _outcome(parse, text)
+        references = [('libyaml' if frontmatter._safe_loader() is not 
+                       yaml.SafeLoader else 'PyYAML', _libyaml_load)]
+        if _is_fast(text, delimited):
+            references.append(('PyYAML', yaml.safe_load))
+        for name, load in references:
+            reference_ok, reference = _outcome(load, text)
+            if ok != reference_ok or (ok and not _same(result, reference)):
+                mismatches += 1
+                print("Mismatch for " + repr(text))
+                print("  frontmatter: " + repr(result))
+                print("  {0:<13}".format(name + ':') + repr(reference))
+                break
+    return mismatches
+
+def _time(load, texts):
+    start = time.perf_counter()
+    for text in texts:
+        try:
+            load(text)
+        except yaml.YAMLError:
+            pass
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the front matter \
+        parser against PyYAML.')
+    parser.add_argument('directories', metavar='DIRECTORY', nargs='*',
+        help='check the metadata blocks of the Zettels in DIRECTORY, too')
+    parser.add_argument('-n', type=int, default=100000,
+        help='number of random metadata blocks (default: 100000)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    # os.walk() silently skips a missing directory, the check mustn't.
+    for directory in args.directories:
+        if not os.path.isdir(directory):
+            parser.error("not a directory: " + directory)
+
+    rng = random.Random(args.seed)
+    texts = [_block(rng) for _ in range(args.n)]
+    for directory in args.directories:
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for name in filenames:
+                y, _ = Zettelparser._scan_file(os.path.join(dirpath, name))
+                if y is not None:
+                    texts.append(y)
+
+    mismatches = check(texts)
+    fast = [text for text in texts if _is_fast(text)]
+    print("{0} metadata blocks checked, {1} handled by the fast path, {2} "
+          "mismatches.".format(len(texts), len(fast), mismatches))
+    if mismatches:
+        print("FAILED: frontmatter and PyYAML disagree.", file=sys.stderr)
+        return 1
+    if fast:
+        print("Per block of those, in microseconds:")
+        for name, load in (('frontmatter', frontmatter.load),
+                           ('libyaml', _libyaml_load),
+                           ('PyYAML', yaml.safe_load)):
+            print("{0:<12}{1:>10.1f}".format(
+                  name, _time(load, fast) * 1e6 / len(fast)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
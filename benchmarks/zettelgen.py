@@ -0,0 +1,181 @@
+#! /usr/bin/env python3
+
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+Generate reproducible synthetic Zettelkästen for benchmarks.
+
+The same parameters and seed always produce the same files.
+
+Usage: python3 benchmarks/zettelgen.py DIRECTORY [options]
+       (see --help)
+"""
+
+import argparse
+import os
+import random
+import sys
+
+# The ignore patterns of the default settings. Files the generator puts
+# there to be ignored match them.
+IGNORE = ['*~', '.*', '.*/']
+
+_WORDS = ('lorem ipsum dolor sit amet consectetur adipisici elit sed eiusmod '
+          'tempor incidunt labore dolore magna aliqua zettel kasten note '
+          'index link followup metadata markdown pandoc luhmann').split()
+
+def zettel_path(i, fanout=0, per_dir=100):
+    """
+    The path of the i-th Zettel, relative to the root directory.
+
+    With fanout > 0, the Zettels are spread over a tree of subdirectories:
+    per_dir Zettels per directory, each directory having up to fanout
+    subdirectories.
+    """
+    name = 'note{0}.md'.format(i)
+    if fanout <= 0:
+        return name
+    d = i // per_dir
+    parts = []
+    while d:
+        d, r = divmod(d - 1, fanout)
+        parts.append('d{0}'.format(r))
+    parts.reverse()
+    return '/'.join(parts + [name])
+
+def _relative(target, source):
+    # posixpath.relpath is too slow for a million Zettels with several
+    # links each. Both paths are relative to the root directory.
+    source_dir = source.split('/')[:-1]
+    target_parts = target.split('/')
+    common = 0
+    while (common < len(source_dir) and common < len(target_parts) - 1
+           and source_dir[common] == target_parts[common]):
+        common += 1
+    return '/'.join(['..'] * (len(source_dir) - common) + target_parts[common:])
+
+def _zettel(i, n, rng, path, params):
+    lines = ['---', "title: 'Note {0}'".format(i),
+             'tags: [bench, tag{0}, group{1}]'.format(i % 10, i % 100)]
+    depth = params['followup_depth']
+    # Zettels form chains of followups, depth followups long.
+    if depth and i % (depth + 1) < depth and i + 1 < n:
+        followup = zettel_path(i + 1, params['fanout'], params['per_dir'])
+        lines.append('followups: [{0}]'.format(_relative(followup, path)))
+    for k in range(params['metadata']):
+        lines.append('field{0}: {1}'.format(k, ' '.join(
+            rng.choice(_WORDS) for _ in range(4))))
+    lines += ['...', '']
+
+    links = []
+    for _ in range(params['links']):
+        target = zettel_path(rng.randrange(n), params['fanout'],
+                             params['per_dir'])
+        links.append('[a link]({0})'.format(_relative(target, path)))
+    links.append('[the web](http://example.com/{0})'.format(i))
+
+    body = []
+    for line in range(params['body']):
+        words = [rng.choice(_WORDS) for _ in range(8)]
+        if line < len(links):
+            words.append(links[line])
+        body.append(' '.join(words))
+    # Links that didn't fit in the body get lines of their own
+    body += links[params['body']:]
+    return '\n'.join(lines + body) + '\n'
+
+def generate(dirname, n, seed=0, metadata=2, links=3, followup_depth=2,
+             fanout=0, per_dir=100, ignored=0.0, body=20):
+    """
+    Generate a synthetic Zettelkasten.
+
+    :param dirname: the (existing) directory to generate the Zettels in
+    :param n: number of Zettels
+    :param seed: seed for the random number generator
+    :param metadata: number of additional front matter fields per Zettel
+    :param links: number of links to other Zettels per Zettel (plus one
+        external link)
+    :param followup_depth: length of the followup chains. 0 for none.
+    :param fanout: number of subdirectories per directory. 0 puts all
+        Zettels in dirname.
+    :param per_dir: number of Zettels per directory, if fanout > 0
+    :param ignored: ratio of additional files matching IGNORE, relative
+        to n (backup files and files in hidden directories)
+    :param body: number of lines of text per Zettel
+    :return: a list of the paths of the Zettels, relative to dirname
+    """
+    rng = random.Random(seed)
+    params = dict(metadata=metadata, links=links,
+                  followup_depth=followup_depth, fanout=fanout,
+                  per_dir=per_dir, body=body)
+    paths = []
+    made = set()
+    for i in range(n):
+        path = zettel_path(i, fanout, per_dir)
+        directory = os.path.dirname(path)
+        if directory and not directory in made:
+            os.makedirs(os.path.join(dirname, directory), exist_ok=True)
+            made.add(directory)
+        with open(os.path.join(dirname, path), 'wt') as f:
+            f.write(_zettel(i, n, rng, path, params))
+        paths.append(path)
+
+    hidden = os.path.join(dirname, '.hidden')
+    for j in range(int(n * ignored)):
+        if j % 2:
+            os.makedirs(hidden, exist_ok=True)
+            ignored_path = os.path.join(hidden, 'note{0}.md'.format(j))
+        else:
+            ignored_path = os.path.join(dirname, paths[j % n] + '~')
+        with open(ignored_path, 'wt') as f:
+            f.write("---\ntitle: 'Ignored {0}'\n...\n".format(j))
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a reproducible \
+        synthetic Zettelkasten for benchmarks.')
+    parser.add_argument('directory', help='directory to generate the Zettels \
+        in. It is created, if necessary.')
+    parser.add_argument('-n', type=int, default=1000,
+        help='number of Zettels (default: 1000)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--metadata', type=int, default=2,
+        help='additional front matter fields per Zettel (default: 2)')
+    parser.add_argument('--links', type=int, default=3,
+        help='links to other Zettels per Zettel (default: 3)')
+    parser.add_argument('--followup-depth', type=int, default=2,
+        help='length of the followup chains (default: 2)')
+    parser.add_argument('--fanout', type=int, default=0,
+        help='subdirectories per directory (default: 0, i.e. flat)')
+    parser.add_argument('--per-dir', type=int, default=100,
+        help='Zettels per directory, if fanout > 0 (default: 100)')
+    parser.add_argument('--ignored', type=float, default=0.0,
+        help='ratio of additional files to be ignored (default: 0)')
+    parser.add_argument('--body', type=int, default=20,
+        help='lines of text per Zettel (default: 20)')
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    paths = generate(args.directory, args.n, args.seed, args.metadata,
+                     args.links, args.followup_depth, args.fanout,
+                     args.per_dir, args.ignored, args.body)
+    print("Generated " + str(len(paths)) + " Zettels in " + args.directory)
+
+if __name__ == "__main__":
+    sys.exit(main())
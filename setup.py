@@ -85,6 +85,7 @@ setup(
     extras_require={
         'dev': ['check-manifest', 'pypandoc'],
         'test': ['coverage'],
+        'analytics': ['numpy'],
     },
 
     # If there are data files included in your packages that need to be
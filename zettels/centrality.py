@@ -0,0 +1,256 @@
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+Centrality scores of the Zettels in the link graph: PageRank, HITS (hubs
+and authorities), in-degree and out-degree.
+
+The graph is kept as two parallel arrays of source and target IDs, i.e.
+a sparse adjacency matrix in coordinate (COO) layout. The power iterations
+of PageRank and HITS multiply it with a vector once per iteration. With
+NumPy, that's numpy.bincount() over the edges, without, a loop over the
+incoming (or outgoing) edges of each Zettel. Both give the same scores,
+NumPy just a lot faster on large graphs.
+"""
+
+import array
+import logging
+
+logger = logging.getLogger('Zettels.' + __name__)
+
+# NumPy takes a while to import, so it's imported on first use, see 
+# _numpy(). False if it isn't installed.
+numpy = None
+
+def _numpy():
+    # The numpy module, or None if it isn't installed
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+    return numpy or None
+
+MEASURES = ['pagerank', 'authority', 'hub', 'in-degree', 'out-degree']
+
+class LinkGraph:
+    """
+    The Zettels of a Zettelkasten as IDs 0..n-1, and the edges between them.
+    Each edge is counted once, even if a Zettel links to another one several
+    times or names it as followup, too. Links of a Zettel to itself don't
+    count.
+    """
+    __slots__ = ('paths', 'ids', 'sources', 'targets')
+
+    def __init__(self, zettels, adjacency):
+        """
+        :param zettels: the paths of all Zettels
+        :param adjacency: an iterable of (source, targets) tuples: the path
+            of a Zettel and the paths its edges point to. Paths that aren't
+            in zettels are ignored.
+        """
+        self.paths = sorted(zettels)
+        self.ids = dict((path, i) for i, path in enumerate(self.paths))
+        self.sources = array.array('i')
+        self.targets = array.array('i')
+        get = self.ids.get
+        for source, targets in adjacency:
+            s = get(source)
+            if s is None:
+                continue
+            row = set(map(get, targets))
+            row.discard(None)
+            row.discard(s)
+            self.sources.extend([s] * len(row))
+            self.targets.extend(sorted(row))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _arrays(self):
+        # The edges as NumPy arrays, sharing the memory of the arrays.
+        if not self.sources:
+            return numpy.zeros(0, numpy.intc), numpy.zeros(0, numpy.intc)
+        return (numpy.frombuffer(self.sources, dtype=numpy.intc),
+                numpy.frombuffer(self.targets, dtype=numpy.intc))
+
+    def _adjacency(self, incoming):
+        # For each Zettel, the list of its sources (incoming) or targets
+        adjacency = [[] for _ in self.paths]
+        if incoming:
+            for s, t in zip(self.sources, self.targets):
+                adjacency[t].append(s)
+        else:
+            for s, t in zip(self.sources, self.targets):
+                adjacency[s].append(t)
+        return adjacency
+
+def in_degree(graph):
+    """
+    :return: a list containing the number of incoming edges per Zettel ID
+    """
+    if _numpy() is not None:
+        return numpy.bincount(graph._arrays()[1],
+                              minlength=len(graph)).tolist()
+    degrees = [0] * len(graph)
+    for t in graph.targets:
+        degrees[t] += 1
+    return degrees
+
+def out_degree(graph):
+    """
+    :return: a list containing the number of outgoing edges per Zettel ID
+    """
+    if _numpy() is not None:
+        return numpy.bincount(graph._arrays()[0],
+                              minlength=len(graph)).tolist()
+    degrees = [0] * len(graph)
+    for s in graph.sources:
+        degrees[s] += 1
+    return degrees
+
+def pagerank(graph, damping=0.85, tolerance=1e-6, max_iterations=100):
+    """
+    Compute the PageRank of each Zettel by power iteration. Zettels without
+    outgoing edges distribute their rank over all Zettels.
+
+    :param graph: a LinkGraph
+    :param damping: probability of following an edge rather than jumping
+        to a random Zettel
+    :param tolerance: the iteration stops once the scores change by less
+        than tolerance per Zettel (summed up)
+    :param max_iterations: the iteration stops after this many iterations,
+        converged or not
+    :return: a list of scores per Zettel ID, summing up to 1
+    """
+    n = len(graph)
+    if not n:
+        return []
+    out = out_degree(graph)
+    if _numpy() is not None:
+        sources, targets = graph._arrays()
+        out = numpy.array(out, dtype=float)
+        dangling = out == 0
+        # Each edge carries the rank of its source divided by its out-degree
+        weights = numpy.zeros(n)
+        weights[~dangling] = 1.0 / out[~dangling]
+        rank = numpy.full(n, 1.0 / n)
+        for iteration in range(max_iterations):
+            base = (1 - damping + damping * rank[dangling].sum()) / n
+            new = base + damping * numpy.bincount(
+                targets, weights=(rank * weights)[sources], minlength=n)
+            error = numpy.abs(new - rank).sum()
+            rank = new
+            if error < n * tolerance:
+                break
+        logger.debug("PageRank: " + str(iteration + 1) + " iterations")
+        return rank.tolist()
+
+    incoming = graph._adjacency(incoming=True)
+    weights = [1.0 / o if o else 0.0 for o in out]
+    dangling = [i for i, o in enumerate(out) if not o]
+    rank = [1.0 / n] * n
+    for iteration in range(max_iterations):
+        base = (1 - damping + damping * sum(rank[i] for i in dangling)) / n
+        contributions = [r * w for r, w in zip(rank, weights)]
+        get = contributions.__getitem__
+        new = [base + damping * sum(map(get, sources))
+               for sources in incoming]
+        error = sum(abs(a - b) for a, b in zip(new, rank))
+        rank = new
+        if error < n * tolerance:
+            break
+    logger.debug("PageRank: " + str(iteration + 1) + " iterations")
+    return rank
+
+def hits(graph, tolerance=1e-6, max_iterations=100):
+    """
+    Compute hub and authority scores by power iteration (Kleinberg's HITS).
+    Good hubs link to good authorities, good authorities are linked to by
+    good hubs.
+
+    :param graph: a LinkGraph
+    :param tolerance: the iteration stops once the hub scores change by less
+        than tolerance per Zettel (summed up)
+    :param max_iterations: the iteration stops after this many iterations,
+        converged or not
+    :return: a tuple of two lists, hub scores and authority scores per
+        Zettel ID, each summing up to 1 (or all 0, if there are no edges)
+    """
+    n = len(graph)
+    if not graph.sources:
+        return [0.0] * n, [0.0] * n
+    if _numpy() is not None:
+        sources, targets = graph._arrays()
+        hub = numpy.full(n, 1.0 / n)
+        authority = numpy.zeros(n)
+        for iteration in range(max_iterations):
+            authority = numpy.bincount(targets, weights=hub[sources],
+                                       minlength=n)
+            new = numpy.bincount(sources, weights=authority[targets],
+                                 minlength=n)
+            authority /= authority.sum()
+            new /= new.sum()
+            error = numpy.abs(new - hub).sum()
+            hub = new
+            if error < n * tolerance:
+                break
+        logger.debug("HITS: " + str(iteration + 1) + " iterations")
+        return hub.tolist(), authority.tolist()
+
+    incoming = graph._adjacency(incoming=True)
+    outgoing = graph._adjacency(incoming=False)
+    hub = [1.0 / n] * n
+    authority = [0.0] * n
+    for iteration in range(max_iterations):
+        get = hub.__getitem__
+        authority = [sum(map(get, sources)) for sources in incoming]
+        get = authority.__getitem__
+        new = [sum(map(get, targets)) for targets in outgoing]
+        total = sum(authority)
+        authority = [a / total for a in authority]
+        total = sum(new)
+        new = [h / total for h in new]
+        error = sum(abs(a - b) for a, b in zip(new, hub))
+        hub = new
+        if error < n * tolerance:
+            break
+    logger.debug("HITS: " + str(iteration + 1) + " iterations")
+    return hub, authority
+
+def scores(graph, measure):
+    """
+    Compute one of the centrality measures.
+
+    :param graph: a LinkGraph
+    :param measure: one of MEASURES
+    :return: a list of scores per Zettel ID
+    """
+    if measure == 'pagerank':
+        return pagerank(graph)
+    if measure == 'hub':
+        return hits(graph)[0]
+    if measure == 'authority':
+        return hits(graph)[1]
+    if measure == 'in-degree':
+        return in_degree(graph)
+    if measure == 'out-degree':
+        return out_degree(graph)
+    raise ValueError("Unknown measure: " + str(measure) + ". Choose one of "
+                     + ", ".join(MEASURES))
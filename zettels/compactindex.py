@@ -0,0 +1,244 @@
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+A compact, read-only in-memory form of the index, for processes that keep
+an index around for a long time.
+
+The index dictionary holds a dictionary per Zettel, repeating the keys and
+the paths of linked Zettels as strings over and over. CompactIndex maps
+each path to an integer ID once. Titles are kept in a list indexed by ID,
+links, followups and tags in arrays in compressed sparse row (CSR) layout:
+The entries of the Zettel with ID i are dst[ptr[i]:ptr[i + 1]].
+"""
+
+import array
+import logging
+import os
+
+from zettels.zettelkasten import Zettelkasten
+from zettels.zettelparser import Zettelparser
+
+logger = logging.getLogger('Zettels.' + __name__)
+
+def _csr(rows):
+    # Pack a sequence of lists of integers into a pointer and a data array.
+    ptr = array.array('i', [0])
+    dst = array.array('i')
+    for row in rows:
+        dst.extend(row)
+        ptr.append(len(dst))
+    return ptr, dst
+
+def _row(ptr, dst, i):
+    return dst[ptr[i]:ptr[i + 1]]
+
+class CompactIndex:
+    """
+    Zettels, titles, links, followups and tags of an index, by integer IDs.
+
+    Link targets and followups that don't resolve to a Zettel in the index
+    are stored as negative numbers: -(k + 1) refers to self.strings[k],
+    the target as written, or the normalized path of the followup.
+    """
+    __slots__ = ('paths', 'ids', 'titles', 'strings',
+                 '_target_ptr', '_target_dst', '_followup_ptr',
+                 '_followup_dst', '_incoming_ptr', '_incoming_dst',
+                 'tag_values', '_tag_ptr', '_tag_dst', 'tag_keys',
+                 '_tagged_ptr', '_tagged_dst')
+
+    def __init__(self, index):
+        """
+        :param index: an index as returned by Zettelparser.update_index()
+            or Zettelparser.read_index()
+        """
+        files = index['files']
+        self.paths = sorted(files)
+        self.ids = dict((path, i) for i, path in enumerate(self.paths))
+        self.titles = []
+        self.strings = []
+        string_ids = {}
+        tag_ids = {}
+        self.tag_values = []
+
+        def string_ref(s):
+            if not s in string_ids:
+                string_ids[s] = len(self.strings)
+                self.strings.append(s)
+            return -(string_ids[s] + 1)
+
+        def tag_ref(tag):
+            key = (type(tag).__name__, str(tag))
+            if not key in tag_ids:
+                tag_ids[key] = len(self.tag_values)
+                self.tag_values.append(tag)
+            return tag_ids[key]
+
+        targets = []
+        followups = []
+        tags = []
+        for path in self.paths:
+            entry = files[path]
+            self.titles.append(entry['title'])
+            zetdir = os.path.dirname(path)
+            row = []
+            for target in Zettelparser._as_list(entry.get('targets')):
+                i = self.ids.get(
+                    Zettelparser._resolve_target(zetdir, str(target)))
+                row.append(string_ref(target) if i is None else i)
+            targets.append(row)
+            row = []
+            for followup in Zettelparser._as_list(entry.get('followups')):
+                followup = os.path.normpath(os.path.join(zetdir, str(followup)))
+                i = self.ids.get(followup)
+                row.append(string_ref(followup) if i is None else i)
+            followups.append(row)
+            tags.append([tag_ref(tag) for tag in
+                         Zettelparser._as_list(entry.get('tags'))])
+
+        self._target_ptr, self._target_dst = _csr(targets)
+        self._followup_ptr, self._followup_dst = _csr(followups)
+        self._tag_ptr, self._tag_dst = _csr(tags)
+
+        # Reverse edges: the Zettels linking to each Zettel or naming it as
+        # followup
+        incoming = [[] for _ in self.paths]
+        for source in range(len(self.paths)):
+            for i in set(targets[source] + followups[source]):
+                if i >= 0:
+                    incoming[i].append(source)
+        self._incoming_ptr, self._incoming_dst = _csr(incoming)
+
+        # Tags are looked up as strings (see Zettelparser._resolve_tags())
+        self.tag_keys = {}
+        tagged = []
+        for zettel, row in enumerate(tags):
+            for key in set(str(self.tag_values[t]) for t in row):
+                if not key in self.tag_keys:
+                    self.tag_keys[key] = len(tagged)
+                    tagged.append([])
+                tagged[self.tag_keys[key]].append(zettel)
+        self._tagged_ptr, self._tagged_dst = _csr(tagged)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def targets(self, i):
+        return _row(self._target_ptr, self._target_dst, i)
+
+    def followups(self, i):
+        return _row(self._followup_ptr, self._followup_dst, i)
+
+    def incoming(self, i):
+        return _row(self._incoming_ptr, self._incoming_dst, i)
+
+    def tags(self, i):
+        return [self.tag_values[t] for t in _row(self._tag_ptr, self._tag_dst, i)]
+
+    def tagged(self, tag):
+        """
+        :return: the IDs of the Zettels tagged with tag (compared as string)
+        """
+        key = self.tag_keys.get(str(tag))
+        if key is None:
+            return array.array('i')
+        return _row(self._tagged_ptr, self._tagged_dst, key)
+
+class CompactZettelkasten(Zettelkasten):
+    """
+    A Zettelkasten answering its queries from a CompactIndex. The index
+    dictionary it was built from isn't referenced anymore, so it can be
+    garbage collected.
+    """
+
+    def __init__(self, index, rootdir, fulltext=None):
+        """
+        :param index: an index of the Zettels generated by Zettelparser
+        :param rootdir: path to the directory containing the Zettels
+        :param fulltext: a zettels.fulltext.FulltextIndex, if needed
+        """
+        Zettelkasten.__init__(self, None, rootdir, fulltext)
+        self.compact = CompactIndex(index)
+
+    def _zettels(self):
+        return zip(self.compact.titles, self.compact.paths)
+
+    def _title(self, zettel):
+        return self.compact.titles[self.compact.ids[zettel]]
+
+    def _followups(self, zettel):
+        c = self.compact
+        for i in c.followups(c.ids[zettel]):
+            if i < 0:
+                yield ("Missing Zettel", c.strings[-i - 1])
+            else:
+                yield (c.titles[i], c.paths[i])
+
+    def _targets(self, zettel):
+        c = self.compact
+        for i in c.targets(c.ids[zettel]):
+            if i < 0:
+                yield ("External link", c.strings[-i - 1])
+            else:
+                yield (c.titles[i], c.paths[i])
+
+    def _incoming(self, zettel):
+        c = self.compact
+        for i in c.incoming(c.ids[zettel]):
+            yield (c.titles[i], c.paths[i])
+
+    def _tags(self, zettel):
+        return self.compact.tags(self.compact.ids[zettel])
+
+    def _tagged(self, tag):
+        c = self.compact
+        return set(c.paths[i] for i in c.tagged(tag))
+
+    def _all_zettels(self):
+        return set(self.compact.paths)
+
+    def _edges(self):
+        c = self.compact
+        for i, zettel in enumerate(c.paths):
+            zetdir = os.path.dirname(zettel)
+            targets = []
+            for t in c.targets(i):
+                if t >= 0:
+                    targets.append(c.paths[t])
+                else:
+                    # Not a Zettel: an external link or a dangling one
+                    resolved = Zettelparser._resolve_target(zetdir, 
+                                                            str(c.strings[-t - 1]))
+                    if resolved is not None:
+                        targets.append(resolved)
+            followups = [c.paths[f] if f >= 0 else c.strings[-f - 1] 
+                         for f in c.followups(i)]
+            yield zettel, targets, followups
+
+    def _expand(self, zettels, links, followups, incoming):
+        c = self.compact
+        neighbors = set()
+        for zettel in zettels:
+            i = c.ids[zettel]
+            if links:
+                neighbors.update(c.targets(i))
+            if followups:
+                neighbors.update(c.followups(i))
+            if incoming:
+                neighbors.update(c.incoming(i))
+        return set(c.paths[i] for i in neighbors if i >= 0)
@@ -0,0 +1,286 @@
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+Parse the YAML metadata block of a Zettel.
+
+Most blocks are flat, like
+
+    ---
+    title: 'A Zettel'
+    tags: [zettel, example]
+    followups: [other.md]
+
+load() parses such blocks itself, which is many times faster than PyYAML.
+It understands top-level keys with plain, quoted, integer and boolean
+scalars, flow lists and block lists of those, blank lines and comments.
+Flow lists may span several lines, and so may flow mappings of keys
+without values, like the ignore patterns in the settings file. Anything
+else (and anything that might mean something else to YAML, like 'y', 
+'1.0' or '2017-01-01') is handed to PyYAML, using libyaml if available.
+The results are the same either way, benchmarks/check_frontmatter.py 
+checks that.
+
+load_document() does the same for a whole YAML document, like the settings
+file. So the command line tool usually doesn't need to import PyYAML at 
+all, which takes about as long as the rest of a query.
+"""
+
+import logging
+import re
+
+logger = logging.getLogger('Zettels.' + __name__)
+
+# PyYAML is imported on first use, see _safe_loader().
+_SafeLoader = None
+
+def _safe_loader():
+    # The libyaml bindings if PyYAML was built with them, else the pure 
+    # Python loader.
+    global _SafeLoader
+    if _SafeLoader is None:
+        import yaml
+        _SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return _SafeLoader
+
+_KEY_PATTERN = re.compile(r'([A-Za-z_][A-Za-z0-9_-]*):(?: +(.*))?$')
+_INT_PATTERN = re.compile(r'[-+]?(?:0|[1-9][0-9]*)$')
+# Plain scalars starting with a letter, or paths starting with '/', './',
+# '../' or '~/'. In block context, ': ' and ' #' would end them, in flow context 
+# ',[]{}' too. '#' and ':' aren't accepted at all, to keep it simple.
+_PLAIN_PATTERN = re.compile(r'(?:[^\W\d]|\.{0,2}/|~/)[^:#]*$')
+_FLOW_PLAIN_PATTERN = re.compile(r'(?:[^\W\d]|\.{0,2}/|~/)[^:#,\[\]{}]*$')
+_FLOW_TOKEN_PATTERN = re.compile(r'[^:#,\[\]{}\n]+')
+_SINGLE_QUOTED_PATTERN = re.compile(r"'((?:[^']|'')*)'")
+_DOUBLE_QUOTED_PATTERN = re.compile(r'"([^"\\]*)"')
+_COMMENT_PATTERN = re.compile(r'(?: +#.*)? *$')
+# Characters YAML rejects, and those it treats specially: tabs, line breaks
+# other than '\n' and the byte order mark. (Listed as they are, rather than
+# as the complement of the printable ones, which takes long to compile.)
+_UNSUPPORTED_PATTERN = re.compile(
+    '[\x00-\x09\x0b-\x1f\x7f-\x9f\u2028\u2029\ud800-\udfff\ufeff'
+    '\ufffe\uffff]')
+# Plain scalars YAML 1.1 resolves to booleans or None (or something close
+# to them, which is left to PyYAML to decide).
+_RESERVED = frozenset(('yes', 'no', 'true', 'false', 'on', 'off', 'null',
+                       'y', 'n'))
+# Those of them spelled the way YAML 1.1 accepts as booleans. Other 
+# spellings, like 'yES', are left to PyYAML.
+_BOOLEANS = dict((spelling, value)
+                 for word, value in (('yes', True), ('no', False),
+                                     ('true', True), ('false', False),
+                                     ('on', True), ('off', False))
+                 for spelling in (word, word.capitalize(), word.upper()))
+
+class _Unsupported(Exception):
+    # Raised by the fast path for anything it doesn't understand.
+    pass
+
+class _Incomplete(_Unsupported):
+    # Raised for a flow collection that doesn't end on its line.
+    pass
+
+def _scalar(s, flow=False):
+    # s is stripped and non-empty.
+    if s[0] == "'":
+        m = _SINGLE_QUOTED_PATTERN.match(s)
+        if m and m.end() == len(s):
+            return m.group(1).replace("''", "'")
+    elif s[0] == '"':
+        m = _DOUBLE_QUOTED_PATTERN.match(s)
+        if m and m.end() == len(s):
+            return m.group(1)
+    elif _INT_PATTERN.match(s):
+        return int(s)
+    elif s in _BOOLEANS:
+        return _BOOLEANS[s]
+    elif ((_FLOW_PLAIN_PATTERN if flow else _PLAIN_PATTERN).match(s)
+          and not s.lower() in _RESERVED):
+        return s
+    raise _Unsupported(s)
+
+def _end_of_line(value, pos):
+    # Only spaces and a comment may follow a complete value.
+    if not _COMMENT_PATTERN.match(value, pos):
+        raise _Unsupported(value)
+
+def _skip(value, pos):
+    # Skip spaces, line breaks and comments inside a flow collection.
+    length = len(value)
+    while pos < length:
+        if value[pos] in ' \n':
+            pos += 1
+        elif value[pos] == '#' and value[pos - 1] in ' \n':
+            pos = value.find('\n', pos)
+            if pos < 0:
+                return length
+        else:
+            break
+    return pos
+
+def _flow_collection(value):
+    # A flow list, or a flow mapping of keys without values, which is 
+    # returned as a dictionary mapping each key to None. Returns the 
+    # collection and the position after it.
+    mapping = value[0] == '{'
+    closing = '}' if mapping else ']'
+    items = []
+    pos = 1
+    length = len(value)
+    while True:
+        pos = _skip(value, pos)
+        if pos == length:
+            raise _Incomplete(value)
+        # Also after a trailing comma
+        if value[pos] == closing:
+            break
+        if value[pos] in '\'"':
+            m = (_SINGLE_QUOTED_PATTERN if value[pos] == "'"
+                 else _DOUBLE_QUOTED_PATTERN).match(value, pos)
+            if m and '\n' in m.group():
+                raise _Unsupported(value)
+        else:
+            m = _FLOW_TOKEN_PATTERN.match(value, pos)
+        if not m:
+            raise _Unsupported(value)
+        items.append(_scalar(m.group().strip(), flow=True))
+        pos = _skip(value, m.end())
+        if pos == length:
+            raise _Incomplete(value)
+        if value[pos] == closing:
+            break
+        if value[pos] != ',':
+            raise _Unsupported(value)
+        pos += 1
+    if mapping:
+        return dict((item, None) for item in items), pos + 1
+    return items, pos + 1
+
+def _value(value):
+    # The value of a key or a block list item. Returns None for an empty
+    # one (which may be followed by a block list).
+    value = value.strip(' ')
+    if not value or value[0] == '#':
+        return None
+    if value[0] in '[{':
+        items, pos = _flow_collection(value)
+        _end_of_line(value, pos)
+        return items
+    if value[0] in '\'"':
+        m = (_SINGLE_QUOTED_PATTERN if value[0] == "'"
+             else _DOUBLE_QUOTED_PATTERN).match(value)
+        if not m:
+            raise _Unsupported(value)
+        _end_of_line(value, m.end())
+        return _scalar(m.group())
+    comment = value.find(' #')
+    if comment >= 0:
+        value = value[:comment].rstrip(' ')
+    return _scalar(value)
+
+def _load_simple(text, delimited=True):
+    """
+    The fast path of load() and load_document().
+
+    :param delimited: whether the text starts with a '---' line
+    :raises _Unsupported: if the block isn't of the simple kind
+    """
+    if _UNSUPPORTED_PATTERN.search(text):
+        raise _Unsupported()
+    lines = text.split('\n')
+    if delimited and lines[0] != '---':
+        raise _Unsupported(lines[0])
+    metadata = {}
+    i = 1 if delimited else 0
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        stripped = line.lstrip(' ')
+        if not stripped or stripped[0] == '#':
+            continue
+        m = _KEY_PATTERN.match(line)
+        if not m or m.group(1).lower() in _RESERVED:
+            raise _Unsupported(line)
+        value = m.group(2) or ''
+        while True:
+            try:
+                value = _value(value)
+                break
+            except _Incomplete:
+                # A flow collection, continued on the next line
+                if i == len(lines):
+                    raise
+                value += '\n' + lines[i]
+                i += 1
+        if value is None:
+            # Possibly a block list, with all items indented alike
+            items = []
+            indent = None
+            while i < len(lines):
+                line = lines[i]
+                stripped = line.lstrip(' ')
+                if stripped and stripped[0] != '#':
+                    if not stripped.startswith('- '):
+                        break
+                    if indent is None:
+                        indent = len(line) - len(stripped)
+                    elif len(line) - len(stripped) != indent:
+                        raise _Unsupported(line)
+                    item = _value(stripped[2:])
+                    if item is None:
+                        raise _Unsupported(line)
+                    items.append(item)
+                i += 1
+            if indent is not None:
+                value = items
+        metadata[m.group(1)] = value
+    return metadata or None
+
+def load(text):
+    """
+    Parse a YAML metadata block, like yaml.safe_load() does.
+
+    :param text: the YAML block, as found by Zettelparser._scan_file()
+    :return: the parsed data, usually a dictionary
+    :raises yaml.YAMLError: if the block isn't valid YAML
+    """
+    try:
+        return _load_simple(text)
+    except _Unsupported:
+        logger.debug("Front matter isn't simple, using PyYAML.")
+    import yaml
+    return yaml.load(text, Loader=_safe_loader())
+
+def load_document(text):
+    """
+    Parse a whole YAML document, like yaml.safe_load() does. For files like
+    the settings file, which aren't delimited by '---' lines.
+
+    :param text: the YAML document
+    :return: the parsed data
+    :raises ValueError: if the document isn't valid YAML
+    """
+    try:
+        return _load_simple(text, delimited=False)
+    except _Unsupported:
+        logger.debug("Document isn't simple, using PyYAML.")
+    import yaml
+    try:
+        return yaml.load(text, Loader=_safe_loader())
+    except yaml.YAMLError as e:
+        raise ValueError(e)
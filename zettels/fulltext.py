@@ -0,0 +1,228 @@
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+An optional full-text index of the Zettel files, ranking search results
+with BM25.
+
+It is kept in a file of its own next to the index file (see filename_for()),
+so the index doesn't grow for users who don't need it. Like the index, it
+is only updated for files that changed: Each document carries the manifest
+record (see Zettelparser._manifest_record()) it was indexed with.
+"""
+
+import collections
+import heapq
+import logging
+import math
+import os
+import re
+
+from zettels import indexformats, indexlock
+
+logger = logging.getLogger('Zettels.' + __name__)
+
+_TOKEN_PATTERN = re.compile(r'\w+')
+
+# The usual BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_VERSION = 1
+
+def tokenize(text):
+    """
+    Split a text into lowercase words.
+
+    :param text: a string
+    :return: a list of terms
+    """
+    return _TOKEN_PATTERN.findall(text.lower())
+
+def filename_for(indexfile):
+    """
+    The full-text index belonging to an index file, e.g. 
+    index.yaml.fulltext for index.yaml.
+    """
+    return indexfile + '.fulltext'
+
+def _same_content(a, b):
+    # Records with equal content hashes (see the setting hashcontent) 
+    # belong to the same content, even if the stats differ.
+    return bool(a and b and a.get('hash')) and a.get('hash') == b.get('hash')
+
+class FulltextIndex:
+    """
+    An inverted index mapping each term to the documents containing it,
+    together with the term frequencies. Documents are paths of Zettels
+    relative to the root directory.
+    """
+
+    def __init__(self, data=None):
+        """
+        :param data: the dictionary an index was saved as, or None for an
+            empty index
+        """
+        if not data or data.get('version') != _VERSION:
+            data = dict(version=_VERSION, postings={}, docs={})
+        # postings: term -> {path: term frequency}
+        self.postings = data['postings']
+        # docs: path -> [length in terms, distinct terms, manifest record]
+        self.docs = data['docs']
+        self.total_length = sum(doc[0] for doc in self.docs.values())
+        self.changed = False
+
+    ######################
+    # Persistence        #
+    ######################
+
+    @staticmethod
+    def load(filename):
+        """
+        Load a full-text index. If the file doesn't exist (yet), the index
+        is empty.
+
+        :param filename: path to the full-text index file
+        :return: a FulltextIndex
+        """
+        try:
+            with open(filename, 'rb') as f:
+                data = indexformats.get_format('binary-zlib').load(f)
+        except FileNotFoundError:
+            logger.debug("No full-text index yet: " + filename)
+            data = None
+        return FulltextIndex(data)
+
+    def save(self, filename):
+        """
+        Write the full-text index to a file.
+
+        :param filename: path to the full-text index file
+        """
+        data = dict(version=_VERSION, postings=self.postings, docs=self.docs)
+        with indexlock.atomic_write(filename) as f:
+            indexformats.get_format('binary-zlib').dump(data, f)
+        self.changed = False
+
+    ######################
+    # Updates            #
+    ######################
+
+    def paths(self):
+        return set(self.docs)
+
+    def add(self, path, text, record=None):
+        """
+        Index a document, replacing an older version of it.
+
+        :param path: path of the Zettel relative to the root directory
+        :param text: the content of the Zettel
+        :param record: the manifest record of the file as it was read
+        """
+        self.remove(path)
+        terms = tokenize(text)
+        counts = collections.Counter(terms)
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[path] = tf
+        self.docs[path] = [len(terms), list(counts), record]
+        self.total_length += len(terms)
+        self.changed = True
+
+    def remove(self, path):
+        """
+        Remove a document from the index, if it's in there.
+
+        :param path: path of the Zettel relative to the root directory
+        """
+        doc = self.docs.pop(path, None)
+        if doc is None:
+            return
+        length, terms, _ = doc
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(path, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= length
+        self.changed = True
+
+    def sync(self, rootdir, manifest):
+        """
+        Bring the full-text index in line with an index' manifest:
+        Documents that aren't in the manifest anymore are removed, files
+        whose manifest record differs from the one they were indexed with
+        are read and indexed (again).
+
+        :param rootdir: the directory containing the Zettel files
+        :param manifest: the manifest of the index, path -> record
+        :return: True, if the full-text index changed
+        """
+        for path in self.paths() - set(manifest):
+            logger.debug("Full-text index: removing " + path)
+            self.remove(path)
+        for path, record in manifest.items():
+            doc = self.docs.get(path)
+            if doc is not None and doc[2] == record:
+                continue
+            if doc is not None and _same_content(doc[2], record):
+                # Only touched
+                doc[2] = record
+                self.changed = True
+                continue
+            logger.debug("Full-text index: reading " + path)
+            try:
+                with open(os.path.join(rootdir, path), 'rt', encoding='utf-8',
+                          errors='replace') as f:
+                    self.add(path, f.read(), record)
+            except FileNotFoundError:
+                self.remove(path)
+        return self.changed
+
+    ######################
+    # Queries            #
+    ######################
+
+    def search(self, query, limit=None):
+        """
+        Rank the documents containing any of the query's terms by BM25.
+
+        :param query: the search terms as a string
+        :param limit: the maximum number of results, or None for all
+        :return: A list of (path, score) tuples, best match first
+        """
+        n = len(self.docs)
+        if not n:
+            return []
+        avgdl = self.total_length / n or 1
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for path, tf in postings.items():
+                norm = K1 * (1 - B + B * self.docs[path][0] / avgdl)
+                scores[path] = (scores.get(path, 0)
+                                + idf * tf * (K1 + 1) / (tf + norm))
+        # Best score first, ties broken by path to keep the order stable
+        key = lambda item: (-item[1], item[0])
+        if limit is not None:
+            return heapq.nsmallest(limit, scores.items(), key=key)
+        return sorted(scores.items(), key=key)
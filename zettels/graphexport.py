@@ -0,0 +1,166 @@
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+Writers for exporting the graph of a Zettelkasten to other tools.
+
+Each writer gets the nodes (Zettels) and edges (links and followups) one
+by one and writes them right away, so the output is never held in memory
+as a whole. Zettelkasten.export_graph() is the intended entry point.
+"""
+
+import logging
+
+logger = logging.getLogger('Zettels.' + __name__)
+
+# Like xml.sax.saxutils.escape() with quotes, without importing it: It 
+# imports urllib.request, which would slow down every run of the command 
+# line tool.
+_XML_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', 
+                              '"': '&quot;'})
+
+def _escape(value):
+    return str(value).translate(_XML_ESCAPES)
+
+class DotWriter:
+    """
+    Graphviz DOT. Followups are drawn as dashed edges.
+    """
+    name = 'dot'
+
+    def __init__(self, out):
+        self.out = out
+
+    @staticmethod
+    def _quote(value):
+        return ('"' + str(value).replace('\\', '\\\\').replace('"', '\\"')
+                .replace('\n', '\\n') + '"')
+
+    def begin(self):
+        self.out.write('digraph zettelkasten {\n')
+
+    def node(self, zettel, title, tags):
+        self.out.write('  ' + self._quote(zettel) + ' [label='
+                       + self._quote(title) + ', tags='
+                       + self._quote(', '.join(str(t) for t in tags)) + '];\n')
+
+    def edge(self, source, target, kind):
+        style = ', style=dashed' if kind == 'followup' else ''
+        self.out.write('  ' + self._quote(source) + ' -> '
+                       + self._quote(target) + ' [type=' + self._quote(kind)
+                       + style + '];\n')
+
+    def end(self):
+        self.out.write('}\n')
+
+class GraphMLWriter:
+    """
+    GraphML, e.g. for Gephi, yEd or NetworkX. Title and tags are node
+    attributes, the kind of relation ('link' or 'followup') is an edge
+    attribute.
+    """
+    name = 'graphml'
+
+    def __init__(self, out):
+        self.out = out
+
+    def begin(self):
+        self.out.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+            '  <key id="title" for="node" attr.name="title" attr.type="string"/>\n'
+            '  <key id="tags" for="node" attr.name="tags" attr.type="string"/>\n'
+            '  <key id="type" for="edge" attr.name="type" attr.type="string"/>\n'
+            '  <graph id="zettelkasten" edgedefault="directed">\n')
+
+    def node(self, zettel, title, tags):
+        self.out.write(
+            '    <node id="' + _escape(zettel) + '">'
+            '<data key="title">' + _escape(title) + '</data>'
+            '<data key="tags">' + _escape(', '.join(str(t) for t in tags))
+            + '</data></node>\n')
+
+    def edge(self, source, target, kind):
+        self.out.write(
+            '    <edge source="' + _escape(source) + '" target="'
+            + _escape(target) + '"><data key="type">' + kind
+            + '</data></edge>\n')
+
+    def end(self):
+        self.out.write('  </graph>\n</graphml>\n')
+
+class EdgeListWriter:
+    """
+    An edge list, one edge per row: source, source title, target, target
+    title and the kind of relation ('link' or 'followup'), with a header.
+    Tab-separated (tsv) or comma-separated (csv). Zettels without any edges
+    don't show up, tags neither. Keeps the titles of all nodes, to write
+    them along with the edges.
+    """
+
+    def __init__(self, out, delimiter):
+        import csv
+        self.out = out
+        self.titles = {}
+        self.writer = csv.writer(out, delimiter=delimiter,
+                                 lineterminator='\n')
+
+    def begin(self):
+        self.writer.writerow(['source', 'source_title', 'target',
+                              'target_title', 'type'])
+
+    def node(self, zettel, title, tags):
+        self.titles[zettel] = title
+
+    def edge(self, source, target, kind):
+        self.writer.writerow([source, self.titles[source], target,
+                              self.titles[target], kind])
+
+    def end(self):
+        pass
+
+class TSVWriter(EdgeListWriter):
+    name = 'tsv'
+
+    def __init__(self, out):
+        EdgeListWriter.__init__(self, out, '\t')
+
+class CSVWriter(EdgeListWriter):
+    name = 'csv'
+
+    def __init__(self, out):
+        EdgeListWriter.__init__(self, out, ',')
+
+WRITERS = [DotWriter, GraphMLWriter, TSVWriter, CSVWriter]
+
+def get_writer(name, out):
+    """
+    Get a writer for an export format by its name.
+
+    :param name: one of 'dot', 'graphml', 'tsv', 'csv'
+    :param out: a text file to write to
+    :return: the writer
+    """
+    for writer in WRITERS:
+        if writer.name == name:
+            return writer(out)
+    raise ValueError("Unknown export format: " + str(name) + ". Choose one of "
+                     + ", ".join(format_names()))
+
+def format_names():
+    return [writer.name for writer in WRITERS]
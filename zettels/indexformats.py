@@ -0,0 +1,506 @@
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+Serializers for the index file.
+
+Each format knows how to recognize its own files, so reading an index never
+requires knowing its format in advance. Zettelparser.read_index() and
+Zettelparser.write_index() are the intended entry points.
+"""
+
+import collections.abc
+import logging
+import marshal
+import mmap
+import os
+import struct
+import zlib
+
+logger = logging.getLogger('Zettels.' + __name__)
+
+def _yaml():
+    # PyYAML takes a while to import and only the YAML format needs it, so
+    # it's imported on first use. Returns the module, loader and dumper, 
+    # using the libyaml bindings if PyYAML was built with them.
+    import yaml
+    try:
+        return yaml, yaml.CSafeLoader, yaml.CSafeDumper
+    except AttributeError:
+        return yaml, yaml.SafeLoader, yaml.SafeDumper
+
+# Values marshal can't handle are wrapped in (_TAGGED, tag, ISO format) 
+# tuples. Safe YAML produces tuples for !!pairs and !!omap, but only pairs.
+_TAGGED = '!zettels'
+_DATE_TAG = '!date'
+_DATETIME_TAG = '!datetime'
+
+class IndexFormatError(Exception):
+    """Raised if an index file can't be read in the format it claims to be."""
+    pass
+
+class YAMLIndexFormat:
+    """
+    The classic index.yaml. Human readable, but slow to read and write on
+    large collections, even with libyaml.
+    """
+    name = 'yaml'
+
+    def matches(self, head):
+        # YAML is the fallback for everything the other formats don't claim.
+        return True
+
+    def load(self, f):
+        yaml, loader, _ = _yaml()
+        return yaml.load(f, Loader=loader)
+
+    def dump(self, index, f):
+        yaml, _, dumper = _yaml()
+        # YAML wants text, the other formats want bytes.
+        f.write(yaml.dump(index, Dumper=dumper,
+                          allow_unicode=True).encode('utf-8'))
+
+class BinaryIndexFormat:
+    """
+    A compact binary container for the index.
+
+    Layout:
+    - 4 bytes magic: b'ZIDX'
+    - 1 byte format version
+    - 1 byte flags (FLAG_ZLIB, FLAG_TAGGED)
+    - the index, serialized by marshal, optionally compressed with zlib
+
+    marshal only knows Python's core types. Values YAML may produce on top
+    of those (dates and timestamps) are wrapped in tagged tuples of three
+    before serializing, wherever they are: in values, keys, sets or 
+    tuples. The only tuples safe YAML produces are the pairs of !!pairs
+    and !!omap, so these can't be confused with real data. Wrapping 
+    requires a walk over the whole index, so it is only done if necessary,
+    which is marked by FLAG_TAGGED.
+    """
+    MAGIC = b'ZIDX'
+    VERSION = 1
+    FLAG_ZLIB = 1
+    FLAG_TAGGED = 2
+    _HEADER = struct.Struct('<4sBB')
+
+    def __init__(self, compress=False):
+        self.compress = compress
+        self.name = 'binary-zlib' if compress else 'binary'
+
+    def matches(self, head):
+        if not head.startswith(self.MAGIC) or len(head) < self._HEADER.size:
+            return False
+        return bool(head[5] & self.FLAG_ZLIB) == self.compress
+
+    def load(self, f):
+        header = f.read(self._HEADER.size)
+        try:
+            magic, version, flags = self._HEADER.unpack(header)
+        except struct.error:
+            raise IndexFormatError("Truncated index file.")
+        if magic != self.MAGIC:
+            raise IndexFormatError("Not a binary index file.")
+        if version != self.VERSION:
+            raise IndexFormatError("Unsupported binary index version: "
+                                   + str(version))
+        payload = f.read()
+        if flags & self.FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        index = marshal.loads(payload)
+        if flags & self.FLAG_TAGGED:
+            index = untag_values(index)
+        return index
+
+    def dump(self, index, f):
+        flags = 0
+        try:
+            payload = marshal.dumps(index)
+        except ValueError:
+            # Something marshal doesn't know, presumably a date.
+            payload = marshal.dumps(tag_values(index))
+            flags |= self.FLAG_TAGGED
+        if self.compress:
+            payload = zlib.compress(payload, 1)
+            flags |= self.FLAG_ZLIB
+        f.write(self._HEADER.pack(self.MAGIC, self.VERSION, flags))
+        f.write(payload)
+
+class MappedIndexFormat:
+    """
+    A random-access index file, read through mmap. Reading it only decodes
+    a small directory. The entries of the Zettels (and of the manifest and
+    the graph) are decoded lazily, one at a time, when they are accessed.
+    So looking up a single Zettel costs the same, no matter how large the
+    index is.
+
+    Layout:
+    - header: 4 bytes magic b'ZMAP', 1 byte format version, 3 bytes 
+      reserved, offset and length of the directory (8 bytes each)
+    - for each section (index['files'], index['manifest'], each mapping in
+      index['graph']):
+      - the values of its entries, each serialized by marshal
+      - the keys of its entries, UTF-8 encoded
+      - the offset table: one record per entry, sorted by key, holding
+        offset and length of key and value
+    - the directory, serialized by marshal: the offset tables' positions 
+      and everything in the index that isn't a section (e.g. the timestamp)
+
+    Values that marshal can't handle are tagged like in BinaryIndexFormat.
+    The sections are loaded as LazySection.
+    """
+    name = 'mmap'
+    MAGIC = b'ZMAP'
+    VERSION = 1
+    _HEADER = struct.Struct('<4sB3xQQ')
+    _ENTRY = struct.Struct('<QIQI')
+    # Top-level entries whose members are sections themselves
+    _GROUPS = ('graph',)
+
+    def matches(self, head):
+        return head.startswith(self.MAGIC)
+
+    def load(self, f):
+        header = f.read(self._HEADER.size)
+        try:
+            magic, version, dir_offset, dir_length = self._HEADER.unpack(header)
+        except struct.error:
+            raise IndexFormatError("Truncated index file.")
+        if magic != self.MAGIC:
+            raise IndexFormatError("Not a mapped index file.")
+        if version != self.VERSION:
+            raise IndexFormatError("Unsupported mapped index version: "
+                                   + str(version))
+        # The mapping stays valid after the file is closed.
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        directory = marshal.loads(mapped[dir_offset:dir_offset + dir_length])
+        index = untag_values(directory['values'])
+        for path, table, count, tagged in directory['sections']:
+            section = LazySection(mapped, table, count, tagged)
+            if len(path) == 1:
+                index[path[0]] = section
+            else:
+                index.setdefault(path[0], {})[path[1]] = section
+        return index
+
+    def dump(self, index, f):
+        sections = []
+        values = {}
+        for key, value in index.items():
+            if key in self._GROUPS and isinstance(value, collections.abc.Mapping):
+                for member, section in value.items():
+                    sections.append(((key, member), section))
+            elif isinstance(value, collections.abc.Mapping):
+                sections.append(((key,), value))
+            else:
+                values[key] = value
+        
+        # The header is written last, when the directory's position is known.
+        f.write(bytes(self._HEADER.size))
+        pos = self._HEADER.size
+        directory = []
+        for path, section in sections:
+            keys = sorted((_encode_key(key), key) for key in section)
+            tagged = False
+            entries = []
+            for encoded, key in keys:
+                try:
+                    payload = marshal.dumps(section[key])
+                except ValueError:
+                    payload = marshal.dumps(tag_values(section[key]))
+                    tagged = True
+                f.write(payload)
+                entries.append([0, len(encoded), pos, len(payload)])
+                pos += len(payload)
+            for entry, (encoded, _) in zip(entries, keys):
+                f.write(encoded)
+                entry[0] = pos
+                pos += len(encoded)
+            directory.append((path, pos, len(entries), tagged))
+            for entry in entries:
+                f.write(self._ENTRY.pack(*entry))
+                pos += self._ENTRY.size
+        
+        payload = marshal.dumps(dict(sections=directory, 
+                                     values=tag_values(values)))
+        f.write(payload)
+        f.seek(0)
+        f.write(self._HEADER.pack(self.MAGIC, self.VERSION, pos, len(payload)))
+
+def _encode_key(key):
+    if not isinstance(key, str):
+        raise IndexFormatError("Keys of mapped sections must be strings, "
+                               "not " + repr(key))
+    return key.encode('utf-8', 'surrogateescape')
+
+class LazySection(collections.abc.MutableMapping):
+    """
+    A section of a MappedIndexFormat file, behaving like a dictionary.
+
+    Keys are looked up by binary search in the offset table. Values are 
+    decoded on first access and kept, so changes to them stick. The file 
+    itself is never written: Assigned and deleted entries are kept in 
+    memory, until the index is written to a file again.
+    """
+
+    def __init__(self, mapped, table, count, tagged=False):
+        self._mapped = mapped
+        self._table = table
+        self._count = count
+        self._tagged = tagged
+        # key -> decoded or assigned value
+        self._values = {}
+        # keys deleted from the file's entries
+        self._deleted = set()
+        # keys not in the file's entries
+        self._new = set()
+
+    def _find(self, key):
+        # Binary search in the offset table. Returns the value's offset 
+        # and length or None.
+        try:
+            encoded = _encode_key(key)
+        except IndexFormatError:
+            return None
+        entry = MappedIndexFormat._ENTRY
+        mapped = self._mapped
+        lo = 0
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key_offset, key_length, offset, length = entry.unpack_from(
+                mapped, self._table + mid * entry.size)
+            probe = mapped[key_offset:key_offset + key_length]
+            if probe < encoded:
+                lo = mid + 1
+            elif probe > encoded:
+                hi = mid
+            else:
+                return offset, length
+        return None
+
+    def _stored_keys(self):
+        entry = MappedIndexFormat._ENTRY
+        for i in range(self._count):
+            key_offset, key_length, _, _ = entry.unpack_from(
+                self._mapped, self._table + i * entry.size)
+            yield self._mapped[key_offset:key_offset + key_length].decode(
+                'utf-8', 'surrogateescape')
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        found = None if key in self._deleted else self._find(key)
+        if found is None:
+            raise KeyError(key)
+        offset, length = found
+        value = marshal.loads(self._mapped[offset:offset + length])
+        if self._tagged:
+            value = untag_values(value)
+        self._values[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self._deleted:
+            self._deleted.discard(key)
+        elif not key in self._values and self._find(key) is None:
+            self._new.add(key)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        if key in self._new:
+            self._new.discard(key)
+            del self._values[key]
+            return
+        if key in self._deleted or self._find(key) is None:
+            raise KeyError(key)
+        self._values.pop(key, None)
+        self._deleted.add(key)
+
+    def __contains__(self, key):
+        if key in self._values:
+            return True
+        return not key in self._deleted and self._find(key) is not None
+
+    def __iter__(self):
+        for key in self._stored_keys():
+            if not key in self._deleted:
+                yield key
+        for key in list(self._new):
+            yield key
+
+    def __len__(self):
+        return self._count - len(self._deleted) + len(self._new)
+
+    def copy(self):
+        """
+        A shallow copy, sharing the mapped file. Nothing is decoded.
+        """
+        section = LazySection(self._mapped, self._table, self._count, 
+                              self._tagged)
+        section._values = dict(self._values)
+        section._deleted = set(self._deleted)
+        section._new = set(self._new)
+        return section
+
+    def touched(self):
+        """
+        :return: the keys whose entries were decoded, assigned or deleted.
+            The entries of all other keys are still the ones in the file.
+        """
+        return set(self._values) | self._deleted
+
+def materialize(index):
+    """
+    Turn the LazySections of an index loaded from a MappedIndexFormat file
+    into dictionaries, so any format can write the index. Decodes every
+    entry.
+
+    :param index: an index
+    :return: the index, containing dictionaries only
+    """
+    if not isinstance(index, dict):
+        return index
+    result = {}
+    for key, value in index.items():
+        if isinstance(value, LazySection):
+            value = dict(value.items())
+        elif isinstance(value, dict):
+            value = materialize(value)
+        result[key] = value
+    return result
+
+def tag_values(value):
+    """
+    Wrap the values marshal can't handle (dates and timestamps) in tagged
+    tuples, recursively. Keys and the members of sets and tuples are 
+    wrapped, too.
+    """
+    # Most indexes don't contain any dates, so datetime is only imported
+    # where it's needed.
+    import datetime
+
+    def tag(value):
+        if isinstance(value, dict):
+            return {tag(k): tag(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [tag(v) for v in value]
+        if isinstance(value, (tuple, set, frozenset)):
+            return type(value)(tag(v) for v in value)
+        # datetime is a subclass of date, so check it first.
+        if isinstance(value, datetime.datetime):
+            return (_TAGGED, _DATETIME_TAG, value.isoformat())
+        if isinstance(value, datetime.date):
+            return (_TAGGED, _DATE_TAG, value.isoformat())
+        return value
+    return tag(value)
+
+def untag_values(value):
+    """
+    Reverse tag_values().
+    """
+    if isinstance(value, dict):
+        return {untag_values(k): untag_values(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [untag_values(v) for v in value]
+    if isinstance(value, tuple):
+        if len(value) == 3 and value[0] == _TAGGED:
+            import datetime
+            _, tag, iso = value
+            if tag == _DATETIME_TAG:
+                return _parse_datetime(iso)
+            return datetime.datetime.strptime(iso, '%Y-%m-%d').date()
+        return tuple(untag_values(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return type(value)(untag_values(v) for v in value)
+    return value
+
+def _parse_datetime(iso):
+    # datetime.fromisoformat() needs Python 3.7. Fall back to YAML, which
+    # produced the value in the first place.
+    import datetime
+    try:
+        return datetime.datetime.fromisoformat(iso)
+    except AttributeError:
+        yaml, loader, _ = _yaml()
+        return yaml.load(iso, Loader=loader)
+
+# All known formats. The first one matching a file's head wins, so YAML,
+# matching everything, has to be the last one.
+FORMATS = [BinaryIndexFormat(),
+           BinaryIndexFormat(compress=True),
+           MappedIndexFormat(),
+           YAMLIndexFormat()]
+
+DEFAULT_FORMAT = 'yaml'
+
+def get_format(name):
+    """
+    Get an index format by its name.
+
+    :param name: one of 'yaml', 'binary', 'binary-zlib', 'mmap'
+    :return: the index format
+    """
+    for fmt in FORMATS:
+        if fmt.name == name:
+            return fmt
+    raise ValueError("Unknown index format: " + str(name) + ". Choose one of "
+                     + ", ".join(format_names()))
+
+def format_names():
+    return [fmt.name for fmt in FORMATS]
+
+def detect_format(filename):
+    """
+    Detect the format of an existing index file.
+
+    :param filename: path to the index file
+    :return: the index format
+    """
+    with open(filename, 'rb') as f:
+        return format_of(f.read(16))
+
+def format_of(head):
+    """
+    Detect the format of an index file by its first bytes.
+
+    :param head: the first 16 bytes of the file
+    :return: the index format
+    """
+    for fmt in FORMATS:
+        if fmt.matches(head):
+            return fmt
+
+def format_for_writing(filename, name=None):
+    """
+    Choose the format to write an index file in.
+
+    If no name is given, an existing index file keeps its format. New files
+    are written in the default format.
+
+    :param filename: path to the index file
+    :param name: name of the format, if it is to be chosen explicitly
+    :return: the index format
+    """
+    if name:
+        return get_format(name)
+    if os.path.exists(filename):
+        return detect_format(filename)
+    return get_format(DEFAULT_FORMAT)
@@ -0,0 +1,172 @@
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+Safe concurrent access to an index file.
+
+Several processes may use the same index at once, e.g. a cron job
+updating it while queries run interactively:
+
+- Updates (reading the index, updating and writing it) hold the exclusive
+  IndexLock of the index file, so they run one after the other. So do
+  searches, which may bring the full-text index up to date and save it.
+- The index file is never written in place. A new version is written to
+  a temporary file, flushed to disk and renamed over the old one (see
+  atomic_write()). A crash leaves either the old or the new version.
+- Reading needs no lock. A reader keeps reading the version it opened,
+  even if it's replaced meanwhile (see Zettelparser.read_index()).
+
+Locks are advisory, using flock(). Where that's not available (Windows),
+updates aren't serialized, but files are still replaced atomically.
+"""
+
+import contextlib
+import logging
+import os
+import stat
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger('Zettels.' + __name__)
+
+def filename_for(indexfile):
+    """
+    The lock file belonging to an index file, e.g. index.yaml.lock for
+    index.yaml.
+    """
+    return indexfile + '.lock'
+
+class IndexLock:
+    """
+    A reader/writer lock on an index file, held as context manager:
+
+        with IndexLock(indexfile):
+            index = Zettelparser.read_index(indexfile)
+            ...
+            Zettelparser.write_index(index, indexfile)
+
+    The lock file is created next to the index file and left there.
+    """
+
+    def __init__(self, indexfile, exclusive=True):
+        """
+        :param indexfile: path to the index file
+        :param exclusive: True for updates, False for readers who want to
+            wait for running updates
+        """
+        self.filename = filename_for(indexfile)
+        self.exclusive = exclusive
+        self._fd = None
+
+    def acquire(self):
+        if fcntl is None:
+            logger.debug("No file locking on this platform.")
+            return
+        self._fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+        operation = fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(self._fd, operation | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info("Waiting for another update of the index to finish...")
+            fcntl.flock(self._fd, operation)
+        except OSError:
+            # Some file systems (e.g. some network shares) don't support it.
+            # Go on without the lock.
+            logger.warning("Can't lock " + self.filename)
+            os.close(self._fd)
+            self._fd = None
+            return
+        logger.debug("Locked " + self.filename)
+
+    def release(self):
+        if self._fd is not None:
+            # Closing the file releases the lock.
+            os.close(self._fd)
+            self._fd = None
+            logger.debug("Unlocked " + self.filename)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+def fsync_directory(path):
+    """
+    Flush a directory to disk, so a file created or renamed in it survives
+    a crash. Does nothing where directories can't be opened (Windows).
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+@contextlib.contextmanager
+def atomic_write(filename):
+    """
+    Write a file as a whole or not at all:
+
+        with atomic_write('index.yaml') as f:
+            f.write(data)
+
+    The data goes into a temporary file next to filename, which is flushed
+    to disk and then renamed to filename. If anything fails, filename is
+    left untouched and the temporary file is removed. Each call gets a 
+    temporary file of its own, so concurrent writers can't write into the
+    same one. The last one to finish wins.
+
+    :param filename: path to the file to be written
+    :return: the temporary file, opened for writing binary data
+    """
+    # tempfile is slow to import and only needed for writing, which 
+    # queries don't do.
+    import tempfile
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmpfile = tempfile.mkstemp(prefix=os.path.basename(filename) + '.',
+                                   suffix='.writing', dir=directory)
+    try:
+        with open(fd, 'wb') as f:
+            # mkstemp() creates the file readable for the owner only. Keep
+            # the permissions of the file that's replaced, if any.
+            try:
+                mode = stat.S_IMODE(os.stat(filename).st_mode)
+            except FileNotFoundError:
+                mode = 0o644
+            os.chmod(tmpfile, mode)
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpfile, filename)
+    except BaseException:
+        try:
+            os.remove(tmpfile)
+        except FileNotFoundError:
+            pass
+        raise
+    fsync_directory(directory)
@@ -0,0 +1,296 @@
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+An append-only journal of changes to an index file.
+
+Writing the whole index after every update costs as much as the index is
+large, even if a single Zettel changed. In journal mode (setting
+`journal`), Zettelparser.write_index() appends a record per changed Zettel
+to the journal next to the index file instead. Zettelparser.read_index()
+replays the journal on top of the index file, the snapshot. Once the
+journal grows larger than half the snapshot, the snapshot is rewritten and
+the journal removed (compaction).
+
+Layout:
+- header: 4 bytes magic b'ZJNL', 1 byte format version, 3 bytes reserved,
+  then size, mtime (in ns) and inode of the snapshot the journal belongs
+  to (8 bytes each)
+- batches, one per update: length and CRC-32 of the payload (4 bytes 
+  each), followed by the payload, a list of records serialized by marshal
+  (values tagged like in indexformats.BinaryIndexFormat). Records are 
+  lists:
+  - ['upsert', path, entry, manifest record]: the entry or the manifest
+    record of a Zettel changed. Either one may be None, if it didn't.
+  - ['delete', path]: a Zettel was removed from the index
+  - ['timestamp', timestamp]: the timestamp of the index
+
+A journal whose header doesn't match the snapshot is stale and ignored.
+That's the case after a crash between writing a new snapshot and removing
+the journal, which is harmless, since the snapshot contains all the
+changes. An incomplete batch at the end (still being appended, or left by 
+a crash) is ignored, so readers see each update completely or not at all.
+"""
+
+import logging
+import marshal
+import os
+import struct
+import zlib
+
+from zettels import indexformats, indexlock
+
+logger = logging.getLogger('Zettels.' + __name__)
+
+# The journal is compacted once it's larger than the snapshot times this
+# ratio, but not before it's this large.
+COMPACT_RATIO = 0.5
+COMPACT_MIN_SIZE = 65536
+
+def filename_for(indexfile):
+    """
+    The journal belonging to an index file, e.g. index.yaml.journal for
+    index.yaml.
+    """
+    return indexfile + '.journal'
+
+class IndexJournal:
+    """
+    The journal file of an index file.
+    """
+    MAGIC = b'ZJNL'
+    VERSION = 1
+    _HEADER = struct.Struct('<4sB3xQQQ')
+    _BATCH = struct.Struct('<II')
+
+    def __init__(self, indexfile):
+        """
+        :param indexfile: path to the index file (the snapshot)
+        """
+        self.indexfile = indexfile
+        self.filename = filename_for(indexfile)
+
+    def _header(self, st=None):
+        # The header identifying a snapshot, by default the current one
+        if st is None:
+            st = os.stat(self.indexfile)
+        return self._HEADER.pack(self.MAGIC, self.VERSION, st.st_size,
+                                 st.st_mtime_ns, st.st_ino)
+
+    def size(self):
+        """
+        :return: the size of the journal file in bytes, 0 if there is none
+        """
+        try:
+            return os.path.getsize(self.filename)
+        except FileNotFoundError:
+            return 0
+
+    def needs_compaction(self, additional=0):
+        """
+        Check whether the journal is too large compared to the snapshot,
+        e.g. because replaying it would take longer than reading a new
+        snapshot.
+
+        :param additional: number of bytes about to be appended
+        """
+        limit = max(COMPACT_MIN_SIZE,
+                    os.path.getsize(self.indexfile) * COMPACT_RATIO)
+        return self.size() + additional > limit
+
+    def _scan(self, data):
+        # The records of the complete batches in data, and where they end
+        records = []
+        pos = self._HEADER.size
+        while pos + self._BATCH.size <= len(data):
+            length, crc = self._BATCH.unpack_from(data, pos)
+            start = pos + self._BATCH.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            records.extend(indexformats.untag_values(marshal.loads(payload)))
+            pos = start + length
+        return records, pos
+
+    def records(self, st=None):
+        """
+        Read the records of the journal. An incomplete batch at the end 
+        (being appended right now, or left by a crash) is ignored.
+
+        :param st: os.stat_result of the snapshot the journal is read for.
+            By default, the current index file.
+        :return: a list of records, empty if there is no journal, None if 
+            the journal doesn't belong to the snapshot
+        """
+        try:
+            with open(self.filename, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        try:
+            header = self._header(st)
+        except FileNotFoundError:
+            return None
+        if data[:self._HEADER.size] != header:
+            return None
+        records, end = self._scan(data)
+        if end < len(data):
+            logger.debug("Ignoring an incomplete batch at the end of "
+                         + self.filename)
+        logger.debug("Journal: " + str(len(records)) + " records")
+        return records
+
+    @staticmethod
+    def encode(records):
+        """
+        :param records: a list of records, making up one batch
+        :return: the batch, as it's appended to the journal file
+        """
+        payload = marshal.dumps(indexformats.tag_values(records))
+        return (IndexJournal._BATCH.pack(len(payload), zlib.crc32(payload))
+                + payload)
+
+    def append(self, data):
+        """
+        Append a batch of records to the journal and flush it to disk. A 
+        missing or stale journal is started anew, an incomplete batch at 
+        its end is cut off first. Only call this holding the IndexLock.
+
+        :param data: a batch, as returned by IndexJournal.encode()
+        """
+        header = self._header()
+        try:
+            f = open(self.filename, 'r+b')
+        except FileNotFoundError:
+            f = open(self.filename, 'w+b')
+        with f:
+            current = f.read(self._HEADER.size) == header
+            if current:
+                _, end = self._scan(header + f.read())
+                if end < f.tell():
+                    logger.warning("Cutting off an incomplete batch at the "
+                                   "end of " + self.filename)
+            else:
+                if f.tell():
+                    logger.debug("Starting over stale journal " 
+                                 + self.filename)
+                end = 0
+            f.seek(end)
+            f.truncate()
+            if not current:
+                f.write(header)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if not current:
+            indexlock.fsync_directory(os.path.dirname(
+                os.path.abspath(self.filename)))
+
+    def remove(self):
+        """
+        Remove the journal, e.g. after its records went into a new snapshot.
+        """
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
+def _copy(section):
+    if isinstance(section, indexformats.LazySection):
+        return section.copy()
+    return dict(section)
+
+def _changes(old, new):
+    # Keys with a new value in section new, compared to its old version,
+    # and keys that are gone.
+    if (isinstance(old, indexformats.LazySection)
+        and isinstance(new, indexformats.LazySection)):
+        # Both read from the same file: Only touched entries can differ.
+        keys = old.touched() | new.touched()
+    else:
+        keys = set(old) | set(new)
+    changed = set()
+    gone = set()
+    for key in keys:
+        if not key in new:
+            if key in old:
+                gone.add(key)
+        elif not key in old:
+            changed.add(key)
+        else:
+            value = new[key]
+            previous = old[key]
+            if value is not previous and value != previous:
+                changed.add(key)
+    return changed, gone
+
+class Baseline:
+    """
+    The state of an index as of its last reading or writing, to find out
+    which entries changed since. Copying the state is shallow: Updates
+    replace the entries of Zettels, they don't change them in place.
+    """
+
+    def __init__(self, index):
+        """
+        :param index: an index as returned by Zettelparser.read_index(),
+            or None
+        """
+        self.reset(index)
+
+    def reset(self, index):
+        """
+        Take the current state of an index as the baseline.
+        """
+        self.index = index
+        if index is None:
+            self.files = {}
+            self.manifest = {}
+            self.timestamp = None
+        else:
+            self.files = _copy(index['files'])
+            self.manifest = _copy(index.get('manifest') or {})
+            self.timestamp = index.get('timestamp')
+
+    def records(self, index):
+        """
+        Get the journal records for the changes made to an index.
+
+        :param index: the index the baseline was taken of
+        :return: a list of records, or None if index is another one (e.g.
+            built from scratch)
+        """
+        if self.index is None or index is not self.index:
+            return None
+        files = index['files']
+        manifest = index.get('manifest') or {}
+        changed, gone = _changes(self.files, files)
+        changed_records, gone_records = _changes(self.manifest, manifest)
+        records = []
+        for path in sorted(changed | changed_records):
+            records.append(['upsert', path,
+                files[path] if path in changed else None,
+                manifest[path] if path in changed_records else None])
+        gone |= set(path for path in gone_records if not path in files)
+        for path in sorted(gone - changed):
+            records.append(['delete', path])
+        # An update without changes doesn't need to be recorded, even if
+        # it set a new timestamp.
+        if records and index.get('timestamp') != self.timestamp:
+            records.append(['timestamp', index.get('timestamp')])
+        return records
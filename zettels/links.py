@@ -0,0 +1,189 @@
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+Extract the targets of the links in a Zettel, in a single pass.
+
+One regular expression recognizes all supported kinds of links:
+
+- inline links and images: [text](target "title"), [text](<tar get>),
+  ![alt](image.png). Parentheses in targets are fine, if they're balanced
+  (like in https://en.wikipedia.org/wiki/Pipeline_(Unix)) or escaped.
+- reference links: [text][label], [label][] and [label], resolved by the
+  link reference definitions ([label]: target "title") anywhere in the
+  Zettel. References without a definition aren't links (like [x] or [ ]).
+- autolinks: <https://example.com>, <someone@example.com> (which becomes
+  mailto:someone@example.com)
+- wikilinks: [[target]], [[target|text]], [[target#heading]]. A target
+  without an extension gets the one of the linking Zettel, so [[other]]
+  in a Markdown file links to other.md. Dots in titles, like in
+  [[Dr. Who]] or [[v1.2 notes]], don't count as extensions.
+
+Links don't span lines, so a text can be fed in chunks of complete lines.
+"""
+
+import logging
+import re
+
+logger = logging.getLogger('Zettels.' + __name__)
+
+# Every alternative starts with '[' or '<', so the regular expression
+# engine skips everything else quickly. Images are found by the '[' after
+# their '!'. Link reference definitions have to start a line, which is
+# checked afterwards.
+_TOKEN_PATTERN = re.compile(r'''
+    # A wikilink: [[target#heading|text]]
+    \[\[(?P<wiki>[^\[\]|#\n]*)(?:\#[^\[\]|\n]*)?(?:\|[^\[\]\n]*)?\]\]
+  # A link reference definition: [label]: target "title"
+  | \[(?P<label>[^\[\]^\n][^\[\]\n]*)\]:[ \t]*
+        (?:<(?P<defangle>[^<>\n]*)>|(?P<defdest>[^\s<][^\s]*))
+  # An inline link, or a reference link
+  | \[(?P<text>(?:[^\[\]\\\n]|\\.|\[[^\[\]\n]*\])*)\]
+    (?:
+        \([ \t]*
+            (?:<(?P<angle>[^<>\n]*)>
+            |(?P<dest>(?:[^\s()\\]|\\.|\((?:[^\s()\\]|\\.)*\))+))?
+            (?:[ \t]+(?:"[^"\n]*"|'[^'\n]*'|\([^()\n]*\)))?
+        [ \t]*\)
+      | \[(?P<ref>[^\[\]\n]*)\]
+    )?
+  # An autolink: <scheme:...> or <address@example.com>
+  | <(?P<auto>[A-Za-z][A-Za-z0-9+.-]{1,31}:[^\s<>]*)>
+  | <(?P<email>[A-Za-z0-9.!\#$%&'*+/=?^_`{|}~-]+@[A-Za-z0-9]
+        (?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?
+        (?:\.[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?)*)>
+''', re.VERBOSE)
+
+_ESCAPE_PATTERN = re.compile(r'\\([!-/:-@\[-`{-~])')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+# What counts as a file extension at the end of a wikilink target: short,
+# no spaces, at least one letter (so [[v1.2]] isn't taken for one).
+_EXTENSION_PATTERN = re.compile(r'\.(?=[0-9]*[A-Za-z])[A-Za-z0-9]{1,5}$')
+
+def _normalize_label(label):
+    # Labels match case-insensitively, regardless of whitespace.
+    return _WHITESPACE_PATTERN.sub(' ', label.strip()).lower()
+
+def _unescape(target):
+    return _ESCAPE_PATTERN.sub(r'\1', target)
+
+class LinkExtractor:
+    """
+    Collects the link targets of a text fed to it in pieces.
+
+        extractor = LinkExtractor('.md')
+        for chunk in chunks:
+            extractor.feed(chunk)
+        targets = extractor.targets()
+    """
+
+    def __init__(self, extension=''):
+        """
+        :param extension: extension of the Zettel (e.g. '.md'), for
+            wikilinks without one
+        """
+        self.extension = extension
+        # Targets, and (label,) tuples for reference links, in the order of
+        # their first appearance
+        self._found = []
+        self._seen = set()
+        self._definitions = {}
+
+    def feed(self, text):
+        """
+        Extract the links of a piece of the text.
+
+        :param text: complete lines of the text
+        """
+        if not ('[' in text or '<' in text):
+            return
+        found = []
+        for m in _TOKEN_PATTERN.finditer(text):
+            if m.group('dest') is not None:
+                found.append(_unescape(m.group('dest')))
+            elif m.group('angle') is not None:
+                found.append(_unescape(m.group('angle')))
+            elif m.group('text') is not None:
+                # A reference link, full ([text][label]), collapsed
+                # ([label][]) or shortcut ([label]). Images and inline
+                # links without a target end up here, too.
+                ref = m.group('ref')
+                if ref is None and m.group().endswith(')'):
+                    continue
+                label = ref if ref else m.group('text')
+                if label:
+                    found.append((_normalize_label(label),))
+            elif m.group('label') is not None:
+                label = _normalize_label(m.group('label'))
+                start = m.start()
+                indent = start - text.rfind('\n', 0, start) - 1
+                if indent > 3 or text[start - indent:start].strip(' '):
+                    # Not at the start of a line, so it's a reference link
+                    # followed by a colon.
+                    found.append((label,))
+                elif label and not label in self._definitions:
+                    self._definitions[label] = _unescape(
+                        m.group('defangle') if m.group('defangle') is not None
+                        else m.group('defdest'))
+            elif m.group('wiki') is not None:
+                target = m.group('wiki').strip()
+                if target:
+                    if not (target.endswith(self.extension)
+                            or _EXTENSION_PATTERN.search(target)):
+                        target += self.extension
+                    found.append(target)
+            elif m.group('auto') is not None:
+                found.append(m.group('auto'))
+            else:
+                found.append('mailto:' + m.group('email'))
+        # Keep each one once, so memory doesn't grow with repeated links.
+        for target in found:
+            if not target in self._seen:
+                self._seen.add(target)
+                self._found.append(target)
+
+    def targets(self):
+        """
+        :return: the distinct link targets, in the order of their first
+            appearance
+        """
+        targets = []
+        seen = set()
+        for target in self._found:
+            if isinstance(target, tuple):
+                target = self._definitions.get(target[0])
+                if target is None:
+                    # Not a link after all
+                    continue
+            if target and not target in seen:
+                seen.add(target)
+                targets.append(target)
+        return targets
+
+def extract(text, extension=''):
+    """
+    Get the link targets of a text.
+
+    :param text: the text of a Zettel
+    :param extension: extension of the Zettel, for wikilinks
+    :return: the distinct link targets, in the order of their first
+        appearance
+    """
+    extractor = LinkExtractor(extension)
+    extractor.feed(text)
+    return extractor.targets()
@@ -0,0 +1,531 @@
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+An index stored in an SQLite database.
+
+Instead of a dictionary that is read and written as a whole, the index lives
+in a database and is updated one Zettel at a time. Queries run as SQL, so
+they don't need to load the whole index into memory.
+
+Zettels uses this storage if the index file is an SQLite database, or, for
+a new index file, if its name ends with one of SQLITE_EXTENSIONS.
+"""
+
+import logging
+import marshal
+import os
+
+from zettels import indexformats
+from zettels.zettelkasten import Zettelkasten
+from zettels.zettelparser import Zettelparser
+
+logger = logging.getLogger('Zettels.' + __name__)
+
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+_SQLITE_MAGIC = b'SQLite format 3\x00'
+_SCHEMA_VERSION = 1
+
+# The fields every entry has. Everything else goes to the metadata table.
+_FIELDS = ('title', 'targets', 'tags', 'followups')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS info (
+    key     TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS files (
+    id      INTEGER PRIMARY KEY,
+    path    TEXT NOT NULL UNIQUE,
+    title,
+    mtime_ns INTEGER,
+    size    INTEGER,
+    inode   INTEGER,
+    hash    TEXT
+);
+CREATE TABLE IF NOT EXISTS metadata (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    key     TEXT NOT NULL,
+    value   BLOB,
+    PRIMARY KEY (file_id, key)
+);
+-- The tag as YAML parsed it (a number, a date, ...) is kept in value, like
+-- the metadata. Tags are looked up by tag, the value as a string, like in
+-- the dictionary index.
+CREATE TABLE IF NOT EXISTS tags (
+    file_id  INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    tag      TEXT NOT NULL,
+    value    BLOB NOT NULL,
+    PRIMARY KEY (file_id, position)
+);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+CREATE TABLE IF NOT EXISTS targets (
+    file_id  INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    target   TEXT NOT NULL,
+    resolved TEXT,
+    PRIMARY KEY (file_id, position)
+);
+CREATE INDEX IF NOT EXISTS targets_resolved ON targets (resolved);
+CREATE TABLE IF NOT EXISTS followups (
+    file_id  INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    followup TEXT NOT NULL,
+    resolved TEXT NOT NULL,
+    PRIMARY KEY (file_id, position)
+);
+CREATE INDEX IF NOT EXISTS followups_resolved ON followups (resolved);
+'''
+
+class SQLiteIndex:
+    """
+    An index stored in an SQLite database.
+
+    Besides the queries used by SQLiteZettelkasten, it offers the methods
+    Zettelparser.update_store() needs: timestamp, paths(), manifest(), 
+    upsert(), set_manifest() and delete(). Each upsert and delete is a 
+    transaction of its own.
+    """
+
+    def __init__(self, filename):
+        """
+        Open (and if necessary create) an SQLite index.
+
+        :param filename: path to the database file
+        :raises zettels.indexformats.IndexFormatError: if the database has
+            a schema version this version of Zettels doesn't know
+        """
+        # Imported here, so the other index formats don't pay for it
+        import sqlite3
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('PRAGMA foreign_keys=ON')
+        # Only a new database is written to here. Opening an existing one
+        # for a query mustn't need write access, or wait for an update.
+        version = self._schema_version()
+        if version is None:
+            self._create()
+        elif version != _SCHEMA_VERSION:
+            self.connection.close()
+            raise indexformats.IndexFormatError(
+                "Unsupported SQLite index version: " + str(version))
+
+    def _schema_version(self):
+        # None for a new database
+        if not self.connection.execute(
+                "SELECT 1 FROM sqlite_master "
+                "WHERE type = 'table' AND name = 'info'").fetchone():
+            return None
+        row = self.connection.execute(
+            "SELECT value FROM info WHERE key = 'schema_version'").fetchone()
+        return row[0] if row else None
+
+    def _create(self):
+        # Write ahead logging makes the many small transactions of an
+        # update cheap. It's a property of the database file, so it only
+        # needs to be switched on once.
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.executescript(_SCHEMA)
+            self.connection.execute(
+                'INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)',
+                ('schema_version', _SCHEMA_VERSION))
+
+    @staticmethod
+    def is_sqlite(filename):
+        """
+        Tell whether filename is (or is going to be) an SQLite index.
+
+        Existing files are recognized by their content, new ones by their
+        extension.
+        """
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                return f.read(len(_SQLITE_MAGIC)) == _SQLITE_MAGIC
+        return filename.lower().endswith(SQLITE_EXTENSIONS)
+
+    def close(self):
+        self.connection.close()
+
+    ######################
+    # Updating           #
+    ######################
+
+    @property
+    def timestamp(self):
+        row = self.connection.execute(
+            "SELECT value FROM info WHERE key = 'timestamp'").fetchone()
+        return row[0] if row else None
+
+    @timestamp.setter
+    def timestamp(self, value):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO info (key, value) "
+                "VALUES ('timestamp', ?)", (value,))
+
+    def paths(self):
+        """
+        :return: A set of the paths of all Zettels in the index.
+        """
+        return set(row[0] for row in
+                   self.connection.execute('SELECT path FROM files'))
+
+    def manifest(self):
+        """
+        :return: The manifest of all Zettels, as in the index dictionary.
+        """
+        manifest = {}
+        for path, mtime_ns, size, inode, hash_ in self.connection.execute(
+                'SELECT path, mtime_ns, size, inode, hash FROM files'):
+            if mtime_ns is None:
+                continue
+            record = dict(mtime_ns=mtime_ns, size=size, inode=inode)
+            if hash_ is not None:
+                record['hash'] = hash_
+            manifest[path] = record
+        return manifest
+
+    def set_manifest(self, zettel, record):
+        """
+        Replace the manifest record of a Zettel in one transaction.
+        """
+        with self.connection as c:
+            c.execute('UPDATE files SET mtime_ns = ?, size = ?, inode = ?, '
+                      'hash = ? WHERE path = ?', 
+                      self._manifest_values(record) + (zettel,))
+
+    @staticmethod
+    def _manifest_values(record):
+        record = record or {}
+        return (record.get('mtime_ns'), record.get('size'),
+                record.get('inode'), record.get('hash'))
+
+    def upsert(self, zettel, entry, record=None):
+        """
+        Insert or replace the entry of a Zettel in one transaction.
+
+        :param zettel: path of the Zettel relative to the root directory
+        :param entry: the Zettel's entry, as produced by Zettelparser
+        :param record: the Zettel's manifest record, if any
+        """
+        internal, external, followups = Zettelparser._resolve_edges(zettel,
+                                                                    entry)
+        zetdir = os.path.dirname(zettel)
+        with self.connection as c:
+            row = c.execute('SELECT id FROM files WHERE path = ?',
+                            (zettel,)).fetchone()
+            if row:
+                file_id = row[0]
+                c.execute('UPDATE files SET title = ?, mtime_ns = ?, '
+                          'size = ?, inode = ?, hash = ? WHERE id = ?',
+                          (_scalar(entry.get('title')),) 
+                          + self._manifest_values(record) + (file_id,))
+                for table in ('metadata', 'tags', 'targets', 'followups'):
+                    c.execute('DELETE FROM ' + table + ' WHERE file_id = ?',
+                              (file_id,))
+            else:
+                file_id = c.execute(
+                    'INSERT INTO files (path, title, mtime_ns, size, inode, '
+                    'hash) VALUES (?, ?, ?, ?, ?, ?)',
+                    (zettel, _scalar(entry.get('title'))) 
+                    + self._manifest_values(record)).lastrowid
+
+            c.executemany('INSERT INTO metadata VALUES (?, ?, ?)',
+                ((file_id, key, _pack(value)) for key, value in entry.items()
+                 if not key in _FIELDS))
+            c.executemany('INSERT INTO tags VALUES (?, ?, ?, ?)',
+                ((file_id, i, str(tag), _pack(tag)) for i, tag in
+                 enumerate(Zettelparser._as_list(entry.get('tags')))))
+            rows = []
+            for i, target in enumerate(
+                    Zettelparser._as_list(entry.get('targets'))):
+                target = str(target)
+                resolved = Zettelparser._resolve_target(zetdir, target)
+                if not resolved in internal:
+                    resolved = None
+                rows.append((file_id, i, target, resolved))
+            c.executemany('INSERT INTO targets VALUES (?, ?, ?, ?)', rows)
+            rows = []
+            for i, followup in enumerate(
+                    Zettelparser._as_list(entry.get('followups'))):
+                followup = str(followup)
+                rows.append((file_id, i, followup,
+                             os.path.normpath(os.path.join(zetdir, followup))))
+            c.executemany('INSERT INTO followups VALUES (?, ?, ?, ?)', rows)
+
+    def delete(self, zettel):
+        """
+        Remove a Zettel from the index in one transaction.
+
+        :param zettel: path of the Zettel relative to the root directory
+        """
+        with self.connection as c:
+            c.execute('DELETE FROM files WHERE path = ?', (zettel,))
+
+    ######################
+    # Querying           #
+    ######################
+
+    def titles(self):
+        """
+        :return: An iterator over (title, path) of all Zettels.
+        """
+        return self.connection.execute('SELECT title, path FROM files')
+
+    def title_of(self, zettel):
+        row = self.connection.execute(
+            'SELECT title FROM files WHERE path = ?', (zettel,)).fetchone()
+        if row is None:
+            raise KeyError(zettel)
+        return row[0]
+
+    def _file_id(self, zettel):
+        row = self.connection.execute(
+            'SELECT id FROM files WHERE path = ?', (zettel,)).fetchone()
+        if row is None:
+            raise KeyError(zettel)
+        return row[0]
+
+    def followups_of(self, zettel):
+        """
+        :return: An iterator over (title, path, resolved followup) of the
+            followups of zettel, fetched as they are consumed. Title and 
+            path are None for followups that aren't in the index.
+        """
+        return self.connection.execute(
+            'SELECT f.title, f.path, fu.resolved FROM followups fu '
+            'LEFT JOIN files f ON f.path = fu.resolved '
+            'WHERE fu.file_id = ? ORDER BY fu.position',
+            (self._file_id(zettel),))
+
+    def targets_of(self, zettel):
+        """
+        :return: An iterator over (title, resolved path, target as written)
+            of the link targets of zettel, fetched as they are consumed. 
+            Title and resolved path are None for targets that aren't in the
+            index.
+        """
+        return self.connection.execute(
+            'SELECT f.title, f.path, t.target FROM targets t '
+            'LEFT JOIN files f ON f.path = t.resolved '
+            'WHERE t.file_id = ? ORDER BY t.position',
+            (self._file_id(zettel),))
+
+    def incoming_of(self, zettel):
+        """
+        :return: An iterator over distinct (title, path) of the Zettels 
+            linking to zettel or naming it as a followup, fetched as they 
+            are consumed.
+        """
+        return self.connection.execute(
+            'SELECT f.title, f.path FROM files f WHERE f.id IN ('
+            'SELECT file_id FROM targets WHERE resolved = ? UNION '
+            'SELECT file_id FROM followups WHERE resolved = ?)',
+            (zettel, zettel))
+
+    def neighbors_of(self, zettels, links=True, followups=True, 
+                     incoming=True):
+        """
+        :param zettels: paths of Zettels
+        :param links: include the targets of their links
+        :param followups: include their followups
+        :param incoming: include the Zettels linking to them or naming 
+            them as followup
+        :return: A set of the paths of all Zettels in the index adjacent to
+            any of zettels.
+        """
+        selects = []
+        if links:
+            selects.append('SELECT t.resolved FROM targets t '
+                           'JOIN files s ON s.id = t.file_id '
+                           'WHERE s.path IN ({0})')
+        if followups:
+            selects.append('SELECT fu.resolved FROM followups fu '
+                           'JOIN files s ON s.id = fu.file_id '
+                           'WHERE s.path IN ({0})')
+        if incoming:
+            selects.append('SELECT s.path FROM targets t '
+                           'JOIN files s ON s.id = t.file_id '
+                           'WHERE t.resolved IN ({0})')
+            selects.append('SELECT s.path FROM followups fu '
+                           'JOIN files s ON s.id = fu.file_id '
+                           'WHERE fu.resolved IN ({0})')
+        neighbors = set()
+        if not selects:
+            return neighbors
+        zettels = list(zettels)
+        # Stay below SQLite's limit of host parameters per statement.
+        chunk = 900 // len(selects)
+        for i in range(0, len(zettels), chunk):
+            part = zettels[i:i + chunk]
+            placeholders = ', '.join('?' * len(part))
+            sql = ('SELECT path FROM files WHERE path IN (' 
+                   + ' UNION '.join(selects).format(placeholders) + ')')
+            neighbors.update(row[0] for row in self.connection.execute(
+                sql, part * len(selects)))
+        return neighbors
+
+    def edges(self):
+        """
+        :return: An iterator over (path, link targets, followups) of all 
+            Zettels. Link targets (internal ones only) and followups are 
+            resolved paths, whether they're in the index or not.
+        """
+        targets = {}
+        for file_id, resolved in self.connection.execute(
+                'SELECT file_id, resolved FROM targets '
+                'WHERE resolved IS NOT NULL ORDER BY file_id, position'):
+            targets.setdefault(file_id, []).append(resolved)
+        followups = {}
+        for file_id, resolved in self.connection.execute(
+                'SELECT file_id, resolved FROM followups '
+                'ORDER BY file_id, position'):
+            followups.setdefault(file_id, []).append(resolved)
+        for file_id, path in self.connection.execute(
+                'SELECT id, path FROM files'):
+            yield path, targets.get(file_id, []), followups.get(file_id, [])
+
+    def tags_of(self, zettel):
+        return [_unpack(row[0]) for row in self.connection.execute(
+            'SELECT value FROM tags WHERE file_id = ? ORDER BY position',
+            (self._file_id(zettel),))]
+
+    def tagged_with(self, tag):
+        """
+        :return: A list of (title, path) of the Zettels tagged with tag.
+            Tags are compared as strings, see Zettelparser._resolve_tags().
+        """
+        return self.connection.execute(
+            'SELECT DISTINCT f.title, f.path FROM tags t '
+            'JOIN files f ON f.id = t.file_id '
+            'WHERE t.tag = ?',
+            (str(tag),)).fetchall()
+
+    ######################
+    # Conversion         #
+    ######################
+
+    def to_index(self):
+        """
+        Export the whole index as a dictionary, as used by Zettelparser.
+        """
+        files = {}
+        ids = {}
+        for file_id, path, title in self.connection.execute(
+                'SELECT id, path, title FROM files'):
+            files[path] = dict(title=title, targets=[], tags=[], followups=[])
+            ids[file_id] = files[path]
+        for file_id, key, value in self.connection.execute(
+                'SELECT file_id, key, value FROM metadata'):
+            ids[file_id][key] = _unpack(value)
+        for file_id, value in self.connection.execute(
+                'SELECT file_id, value FROM tags ORDER BY file_id, position'):
+            ids[file_id]['tags'].append(_unpack(value))
+        for table, column in (('targets', 'target'), 
+                              ('followups', 'followup')):
+            for file_id, value in self.connection.execute(
+                    'SELECT file_id, ' + column + ' FROM ' + table
+                    + ' ORDER BY file_id, position'):
+                ids[file_id][table].append(value)
+        index = dict(files=files, manifest=self.manifest())
+        if self.timestamp is not None:
+            index['timestamp'] = self.timestamp
+        return index
+
+    def from_index(self, index):
+        """
+        Import a whole index, as used by Zettelparser, replacing the
+        current content.
+        """
+        with self.connection as c:
+            c.execute('DELETE FROM files')
+        manifest = index.get('manifest') or {}
+        for zettel, entry in index['files'].items():
+            self.upsert(zettel, entry, manifest.get(zettel))
+        if 'timestamp' in index:
+            self.timestamp = index['timestamp']
+
+def _scalar(value):
+    # Titles are stored in a column of their own. SQLite takes strings and
+    # numbers, anything else is stored as string.
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return str(value)
+
+def _pack(value):
+    return marshal.dumps(indexformats.tag_values(value))
+
+def _unpack(blob):
+    return indexformats.untag_values(marshal.loads(blob))
+
+class SQLiteZettelkasten(Zettelkasten):
+    """
+    A Zettelkasten answering its queries with SQL on an SQLiteIndex, instead
+    of looking them up in an index dictionary.
+    """
+
+    def __init__(self, store, rootdir, fulltext=None):
+        """
+        :param store: an SQLiteIndex
+        :param rootdir: path to the directory containing the Zettels
+        :param fulltext: a zettels.fulltext.FulltextIndex, if needed
+        """
+        Zettelkasten.__init__(self, None, rootdir, fulltext)
+        self.store = store
+
+    def _zettels(self):
+        return self.store.titles()
+
+    def _title(self, zettel):
+        return self.store.title_of(zettel)
+
+    def _followups(self, zettel):
+        for title, path, followup in self.store.followups_of(zettel):
+            if path is None:
+                yield ("Missing Zettel", followup)
+            else:
+                yield (title, path)
+
+    def _targets(self, zettel):
+        for title, path, target in self.store.targets_of(zettel):
+            if path is None:
+                yield ("External link", target)
+            else:
+                yield (title, path)
+
+    def _incoming(self, zettel):
+        for title, path in self.store.incoming_of(zettel):
+            yield (title, path)
+
+    def _tags(self, zettel):
+        return self.store.tags_of(zettel)
+
+    def _expand(self, zettels, links, followups, incoming):
+        return self.store.neighbors_of(zettels, links, followups, incoming)
+
+    def _edges(self):
+        return self.store.edges()
+
+    def _tagged(self, tag):
+        return set(path for title, path in self.store.tagged_with(tag))
+
+    def _all_zettels(self):
+        return set(self.store.paths())
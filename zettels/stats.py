@@ -0,0 +1,103 @@
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+Timers and counters for the phases of an index update.
+
+Zettelparser.stats collects them all the time. It's cheap: Phases are
+timed as a whole, not per file. The only exception is parsing the front
+matter ('yaml'), which is timed per file with two calls of perf_counter() 
+and added with add(). See the options --stats and --stats-file.
+"""
+
+import collections
+import contextlib
+import time
+
+class Stats:
+    """
+    Accumulates the time spent in named phases and named counters.
+
+    Phases may be nested (e.g. 'yaml' happens during 'scan'). A nested
+    phase's time is included in the time of the enclosing one.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # name -> [seconds, calls], in the order the phases first occurred
+        self.timers = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Time a phase:
+
+            with Zettelparser.stats.phase('walk'):
+                ...
+        """
+        timer = self.timers.setdefault(name, [0.0, 0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timer[0] += time.perf_counter() - start
+            timer[1] += 1
+
+    def add(self, name, seconds, calls=1):
+        """
+        Add time measured elsewhere to a phase. Cheaper than phase() for
+        something that happens once per file:
+
+            start = time.perf_counter()
+            ...
+            Zettelparser.stats.add('yaml', time.perf_counter() - start)
+        """
+        timer = self.timers.setdefault(name, [0.0, 0])
+        timer[0] += seconds
+        timer[1] += calls
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        """
+        :return: A dictionary of the timers and counters, suitable for JSON:
+            - 'phases': name -> {'seconds': ..., 'calls': ...}
+            - 'counters': name -> value
+        """
+        phases = collections.OrderedDict(
+            (name, dict(seconds=seconds, calls=calls))
+            for name, (seconds, calls) in self.timers.items())
+        return dict(phases=phases, counters=collections.OrderedDict(self.counters))
+
+    def format(self):
+        """
+        :return: the timers and counters as a human readable table
+        """
+        lines = ["{0:<24}{1:>12}{2:>8}".format('Phase', 'seconds', 'calls')]
+        for name, (seconds, calls) in self.timers.items():
+            lines.append("{0:<24}{1:>12.4f}{2:>8}".format(name, seconds, calls))
+        if self.counters:
+            lines.append("")
+            lines.append("{0:<24}{1:>12}".format('Counter', 'value'))
+            for name, value in self.counters.items():
+                lines.append("{0:<24}{1:>12}".format(name, value))
+        return "\n".join(lines)
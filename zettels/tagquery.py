@@ -0,0 +1,181 @@
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+Boolean tag expressions, like ``zettel AND (python OR "data science") NOT
+draft``.
+
+Operators are AND, OR and NOT (in capitals, so lowercase tags named like
+them still work) and parentheses. Tags following each other without an
+operator are combined with AND. NOT binds strongest, OR weakest. Tags
+containing spaces or parentheses are put in double quotes.
+
+Expressions are evaluated with set operations on the tag inverted index,
+see Zettelkasten.get_zettels_matching().
+"""
+
+import logging
+import re
+
+logger = logging.getLogger('Zettels.' + __name__)
+
+_TOKEN_PATTERN = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+_OPERATORS = ('AND', 'OR', 'NOT')
+
+class TagExpressionError(ValueError):
+    """Raised if a tag expression can't be parsed."""
+    pass
+
+def _tokenize(expression):
+    # Yields (kind, value) with kind being one of '(', ')', 'op', 'tag'.
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = _TOKEN_PATTERN.match(expression, pos)
+        if not match:
+            raise TagExpressionError("Unbalanced quotes in tag expression: "
+                                     + expression)
+        pos = match.end()
+        lparen, rparen, quoted, word = match.groups()
+        if lparen:
+            yield ('(', lparen)
+        elif rparen:
+            yield (')', rparen)
+        elif quoted is not None:
+            yield ('tag', quoted)
+        elif word in _OPERATORS:
+            yield ('op', word)
+        else:
+            yield ('tag', word)
+
+class _Parser:
+    # A recursive descent parser for the grammar
+    #   or_expr  := and_expr ('OR' and_expr)*
+    #   and_expr := not_expr (['AND'] not_expr)*
+    #   not_expr := 'NOT' not_expr | '(' or_expr ')' | tag
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = list(_tokenize(expression))
+        self.pos = 0
+
+    def _peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def _next(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def _error(self, message):
+        return TagExpressionError(message + " in tag expression: "
+                                  + self.expression)
+
+    def parse(self):
+        if not self.tokens:
+            raise self._error("No tags")
+        tree = self._or_expr()
+        if self.pos < len(self.tokens):
+            raise self._error("Unexpected '" + str(self._peek()[1]) + "'")
+        return tree
+
+    def _or_expr(self):
+        operands = [self._and_expr()]
+        while self._peek() == ('op', 'OR'):
+            self._next()
+            operands.append(self._and_expr())
+        return operands[0] if len(operands) == 1 else ('OR', operands)
+
+    def _and_expr(self):
+        operands = [self._not_expr()]
+        while True:
+            kind, value = self._peek()
+            if (kind, value) == ('op', 'AND'):
+                self._next()
+            elif not (kind in ('tag', '(') or (kind, value) == ('op', 'NOT')):
+                break
+            operands.append(self._not_expr())
+        return operands[0] if len(operands) == 1 else ('AND', operands)
+
+    def _not_expr(self):
+        kind, value = self._next()
+        if (kind, value) == ('op', 'NOT'):
+            return ('NOT', self._not_expr())
+        if kind == '(':
+            tree = self._or_expr()
+            if self._next()[0] != ')':
+                raise self._error("Missing ')'")
+            return tree
+        if kind == 'tag':
+            return ('TAG', value)
+        if kind is None:
+            raise self._error("Unexpected end")
+        raise self._error("Unexpected '" + str(value) + "'")
+
+def parse(expression):
+    """
+    Parse a tag expression into a tree of tuples:
+    ('TAG', tag), ('NOT', tree), ('AND', [trees]) or ('OR', [trees]).
+
+    :param expression: the tag expression as a string
+    :return: the parsed expression
+    """
+    return _Parser(expression).parse()
+
+def evaluate(tree, tagged, everything):
+    """
+    Evaluate a parsed tag expression with set operations.
+
+    :param tree: a tag expression as returned by parse()
+    :param tagged: a function returning the set of Zettels tagged with
+        a tag
+    :param everything: a function returning the set of all Zettels.
+        It's only called if the expression contains NOT.
+    :return: the set of Zettels matching the expression
+    """
+    op, operand = tree
+    if op == 'TAG':
+        return set(tagged(operand))
+    if op == 'NOT':
+        return everything() - evaluate(operand, tagged, everything)
+    if op == 'OR':
+        result = set()
+        for subtree in operand:
+            result |= evaluate(subtree, tagged, everything)
+        return result
+    # AND: Start with the positive operands, smallest set first, and only
+    # subtract the negated ones from that, instead of building complements.
+    positive = [subtree for subtree in operand if subtree[0] != 'NOT']
+    negative = [subtree[1] for subtree in operand if subtree[0] == 'NOT']
+    if positive:
+        sets = sorted((evaluate(subtree, tagged, everything)
+                       for subtree in positive), key=len)
+        result = sets[0]
+        for other in sets[1:]:
+            if not result:
+                break
+            result &= other
+    else:
+        result = set(everything())
+    for subtree in negative:
+        if not result:
+            break
+        result -= evaluate(subtree, tagged, everything)
+    return result
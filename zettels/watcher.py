@@ -0,0 +1,287 @@
+# -*- coding: utf8 -*-
+## Copyright (c) 2017 Stefan Thesing
+##
+##This file is part of Zettels.
+##
+##Zettels is free software: you can redistribute it and/or modify
+##it under the terms of the GNU General Public License as published by
+##the Free Software Foundation, either version 3 of the License, or
+##(at your option) any later version.
+##
+##Zettels is distributed in the hope that it will be useful,
+##but WITHOUT ANY WARRANTY; without even the implied warranty of
+##MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##GNU General Public License for more details.
+##
+##You should have received a copy of the GNU General Public License
+##along with Zettels. If not, see http://www.gnu.org/licenses/.
+
+"""
+Watch the Zettelkasten directory for changes with inotify (Linux only).
+
+inotify is used via ctypes, so there's no additional dependency. The
+Watcher blocks in select() while nothing happens, so watching an idle
+Zettelkasten costs nothing but one file descriptor and one watch per
+directory.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+from zettels.zettelparser import Zettelparser
+
+logger = logging.getLogger('Zettels.' + __name__)
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONTFOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+# Files written next to an excluded file: SQLite's write ahead log, shared
+# memory and rollback journal, the journal (see zettels.journal), the lock 
+# (see zettels.indexlock) and the file --convert-index writes first.
+_COMPANION_SUFFIXES = ('-wal', '-shm', '-journal', '.journal', '.lock', 
+                       '.converting')
+# The temporary files of zettels.indexlock.atomic_write() are named 
+# <name>.<random>.writing
+_TEMPORARY_SUFFIX = '.writing'
+
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+               | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+               | IN_MOVE_SELF | IN_ONLYDIR | IN_DONTFOLLOW)
+
+_EVENT = struct.Struct('iIII')
+
+# Default debouncing: A batch is complete after DELAY seconds without
+# events, but no later than MAX_DELAY seconds after its first event.
+DELAY = 1.0
+MAX_DELAY = 10.0
+
+class WatchError(Exception):
+    """Raised if inotify isn't available or fails."""
+    pass
+
+class Inotify:
+    """
+    A minimal wrapper around the inotify API of the Linux kernel.
+    """
+
+    def __init__(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                               use_errno=True)
+            self._init1 = libc.inotify_init1
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+        except (OSError, AttributeError):
+            raise WatchError("inotify is not available on this system.")
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32]
+        self.fd = self._init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise WatchError("inotify_init1 failed: "
+                             + os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, path, mask=_WATCH_MASK):
+        """
+        :return: the watch descriptor, or None if path vanished meanwhile
+        """
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            raise WatchError("Can't watch " + path + ": " + os.strerror(err))
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """
+        Read the pending events. Blocks if there are none.
+
+        :return: A list of (watch descriptor, mask, cookie, name) tuples.
+        """
+        buf = os.read(self.fd, 65536)
+        events = []
+        pos = 0
+        while pos < len(buf):
+            wd, mask, cookie, length = _EVENT.unpack_from(buf, pos)
+            pos += _EVENT.size
+            name = os.fsdecode(buf[pos:pos + length].rstrip(b'\0'))
+            pos += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class Watcher:
+    """
+    Watches a directory tree and reports the files that changed, in
+    debounced batches.
+
+    Directories matching the ignore patterns aren't watched at all. Files
+    are reported regardless of the patterns, so files that became ignored
+    can be removed from the index (see Zettelparser.update_paths()).
+    """
+
+    def __init__(self, rootdir, ignore_patterns=None, exclude=()):
+        """
+        :param rootdir: the directory containing the Zettel files
+        :param ignore_patterns: a list of gitignore-style patterns
+        :param exclude: absolute paths of files that are never reported,
+            e.g. the index file, if it's inside rootdir. The files written
+            along with them (like index.sqlite-wal, index.yaml.lock or the
+            temporary files of atomic_write()) are excluded, too.
+        """
+        self.rootdir = rootdir
+        self.spec = Zettelparser._ignore_spec(ignore_patterns)
+        self.exclude = tuple(os.path.relpath(path, rootdir) for path in exclude)
+        self._excluded = set(path + suffix for path in self.exclude
+                             for suffix in ('',) + _COMPANION_SUFFIXES)
+        self.inotify = Inotify()
+        # watch descriptor -> directory relative to rootdir ('' for rootdir)
+        self.dirs = {}
+        self._watch_tree('')
+
+    def _watch_tree(self, reldir):
+        # Watch reldir and its subdirectories. Returns the files found
+        # below, because files created in a new directory before it was
+        # watched didn't cause any events.
+        files = []
+        stack = [reldir]
+        while stack:
+            current = stack.pop()
+            if current and not self.spec.match_file(current + '/'):
+                continue
+            wd = self.inotify.add_watch(os.path.join(self.rootdir, current))
+            if wd is None:
+                continue
+            self.dirs[wd] = current
+            try:
+                entries = list(os.scandir(os.path.join(self.rootdir, current)))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                path = os.path.join(current, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(path)
+                else:
+                    files.append(path)
+        logger.debug("Watching " + str(len(self.dirs)) + " directories.")
+        return files
+
+    def _forget_tree(self, reldir):
+        # The directory is gone (or moved away). Its watches are removed by
+        # the kernel, we only have to forget about them.
+        prefix = reldir + os.sep
+        for wd, path in list(self.dirs.items()):
+            if path == reldir or path.startswith(prefix):
+                del self.dirs[wd]
+
+    def _is_excluded(self, path):
+        # Only exact names: An index file named index mustn't hide the 
+        # Zettel index.md.
+        if path in self._excluded:
+            return True
+        if path.endswith(_TEMPORARY_SUFFIX):
+            name = path[:-len(_TEMPORARY_SUFFIX)].rpartition('.')[0]
+            return name in self.exclude
+        return False
+
+    def _handle(self, events, changed, gone):
+        # Returns False if the event queue overflowed, so events were lost.
+        for wd, mask, cookie, name in events:
+            if mask & IN_Q_OVERFLOW:
+                logger.debug("inotify event queue overflowed.")
+                return False
+            reldir = self.dirs.get(wd)
+            if reldir is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.dirs[wd]
+                continue
+            if not name:
+                # An event about the watched directory itself
+                continue
+            path = os.path.join(reldir, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.update(f for f in self._watch_tree(path)
+                                   if not self._is_excluded(f))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._forget_tree(path)
+                    gone.add(path)
+            elif not self._is_excluded(path):
+                changed.add(path)
+        return True
+
+    def batches(self, delay=DELAY, max_delay=MAX_DELAY):
+        """
+        Wait for changes and yield them in batches.
+
+        A batch is yielded once there have been no events for delay
+        seconds (e.g. while an editor is still saving), but no later than
+        max_delay seconds after its first event.
+
+        :return: A generator of tuples containing
+            - the set of files that changed (relative to rootdir)
+            - the set of directories that were removed or moved away,
+              since the files in there don't cause events of their own
+            Both are None if events were lost, which means everything
+            has to be checked.
+        """
+        while True:
+            changed = set()
+            gone = set()
+            # Block until the first event.
+            select.select([self.inotify.fd], [], [])
+            first = time.monotonic()
+            complete = True
+            while True:
+                complete = self._handle(self.inotify.read_events(),
+                                        changed, gone) and complete
+                timeout = min(delay, first + max_delay - time.monotonic())
+                if timeout <= 0:
+                    break
+                ready, _, _ = select.select([self.inotify.fd], [], [], timeout)
+                if not ready:
+                    break
+            if not complete:
+                yield None, None
+            elif changed or gone:
+                yield changed, gone
+
+    def close(self):
+        self.inotify.close()
+
+def known_below(known, dirs):
+    """
+    Get the paths among known that are inside one of dirs.
+
+    :param known: paths relative to rootdir
+    :param dirs: directories relative to rootdir
+    :return: a set of paths
+    """
+    prefixes = tuple(d + os.sep for d in dirs)
+    return set(f for f in known if f.startswith(prefixes)) if prefixes else set()
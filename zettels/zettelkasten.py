@@ -16,24 +16,217 @@
 ##You should have received a copy of the GNU General Public License
 ##along with Zettels. If not, see http://www.gnu.org/licenses/.
 
+import heapq
+import itertools
 import logging
 import os
 
+from zettels.zettelparser import Zettelparser
+
 logger = logging.getLogger('Zettels.' + __name__)
 
+def _cycles(successors):
+    """
+    Find the cycles of a directed graph: its strongly connected components
+    with more than one node, or with a single node pointing to itself. 
+    Tarjan's algorithm, without recursion, in O(V + E).
+    
+    :param successors: a dictionary mapping each node to a list of nodes
+    :return: a list of lists of nodes
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    cycles = []
+    for root in successors:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        # The nodes being visited, with an iterator over their successors
+        work = [(root, iter(successors[root]))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if not child in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(successors.get(child, ()))))
+                    break
+                if child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in successors[node]:
+                        cycles.append(component)
+    return cycles
+
 class Zettelkasten:
 
     ######################
     # Constructor        #
     ######################
-    def __init__(self, index, rootdir):
+    def __init__(self, index, rootdir, fulltext=None):
         """Inits Zettelkasten class
         
         :param index: an index of the Zettels generated by Zettelparser
         :param rootdir: path to the directory containing the Zettels
+        :param fulltext: a zettels.fulltext.FulltextIndex, if full-text 
+            search is needed
         """
         self.index = index
         self.rootdir = rootdir
+        self.fulltext = fulltext
+        # Resolved once, needed for every path given to a query
+        self._realrootdir = os.path.realpath(rootdir)
+        
+    ######################
+    # Internal methods   #
+    ######################
+    
+    def _get_graph(self):
+        # Indexes written by older versions of Zettels don't contain 
+        # a graph. Build it in memory, then.
+        if not Zettelparser.has_graph(self.index):
+            logger.debug("Index contains no graph. Building it.")
+            Zettelparser.build_graph(self.index)
+        return self.index['graph']
+    
+    def _relpath(self, zettel):
+        # First, real path of zettel. In fact, we need the real path 
+        # (desolving symlinks). Then make it relative to the root directory.
+        # To do that, we need the real path of the root directory, too.
+        zettel = os.path.relpath(os.path.realpath(zettel), self._realrootdir)
+        logger.debug("Relative path to ZETTEL: " + str(zettel))
+        return zettel
+    
+    def _format(self, tuples, as_output, outputformat):
+        # Format the tuples by outputformat and sort them, if they're
+        # meant for output.
+        if not as_output:
+            return list(tuples)
+        output = [outputformat.format(tup) for tup in tuples]
+        output.sort(key=str.lower)
+        return output
+    
+    def _stream(self, tuples, offset, limit, sort, as_output, outputformat):
+        # Yield the tuples (formated, if as_output) from offset on, at most
+        # limit of them. Unsorted, nothing is held back. Sorted, everything 
+        # has to be seen first, but with a limit, only the first 
+        # offset + limit are kept, in a heap.
+        if as_output:
+            tuples = (outputformat.format(tup) for tup in tuples)
+            key = str.lower
+        else:
+            key = lambda tup: (str(tup[0]).lower(), tup[1])
+        if sort:
+            if limit is None:
+                tuples = sorted(tuples, key=key)
+            else:
+                tuples = heapq.nsmallest(offset + limit, tuples, key=key)
+        stop = None if limit is None else offset + limit
+        return itertools.islice(tuples, offset, stop)
+    
+    # The following methods take paths relative to the root directory and 
+    # yield (title, path) tuples, so the iter_*() methods can stream them. 
+    # Subclasses using another kind of index storage override them. 
+    # _zettels() may return any iterable.
+    
+    def _zettels(self):
+        return ((entry['title'], zettel) 
+                for zettel, entry in self.index['files'].items())
+    
+    def _title(self, zettel):
+        return self.index['files'][zettel]['title']
+    
+    def _followups(self, zettel):
+        zetdir = os.path.dirname(zettel)
+        files = self.index['files']
+        for followup in files[zettel]['followups']:
+            followup = os.path.normpath(os.path.join(zetdir, followup))
+            if followup in files:
+                yield (files[followup]['title'], followup)
+            else:
+                yield ("Missing Zettel", followup)
+    
+    def _targets(self, zettel):
+        zetdir = os.path.dirname(zettel)
+        files = self.index['files']
+        for target in files[zettel]['targets']:
+            # is it an intenal link to another zettel?
+            normtarget = Zettelparser._resolve_target(zetdir, str(target))
+            if normtarget in files:
+                yield (files[normtarget]['title'], normtarget)
+            else:
+                yield ("External link", target)
+    
+    def _incoming(self, zettel):
+        # The reverse edges of the graph tell us right away which Zettels
+        # link to our zettel or name it as a followup. A Zettel may do 
+        # both, but is yielded once.
+        graph = self._get_graph()
+        files = self.index['files']
+        seen = set()
+        for f in itertools.chain(graph['incoming'].get(zettel, []),
+                                 graph['followup-of'].get(zettel, [])):
+            if not f in seen:
+                seen.add(f)
+                yield (files[f]['title'], f)
+    
+    def _tags(self, zettel):
+        return list(self.index['files'][zettel]['tags'])
+    
+    # The following methods return sets of paths relative to the root 
+    # directory, to be combined by set operations.
+    
+    def _expand(self, zettels, links, followups, incoming):
+        # One step of a breadth-first search: All Zettels adjacent to any 
+        # of zettels via the selected kinds of edges.
+        graph = self._get_graph()
+        files = self.index['files']
+        neighbors = set()
+        for zettel in zettels:
+            if links:
+                entry = graph['links'].get(zettel)
+                if entry:
+                    neighbors.update(entry['internal'])
+            if followups:
+                neighbors.update(graph['followups'].get(zettel, ()))
+            if incoming:
+                neighbors.update(graph['incoming'].get(zettel, ()))
+                neighbors.update(graph['followup-of'].get(zettel, ()))
+        # Links and followups may point to files that aren't Zettels.
+        return set(z for z in neighbors if z in files)
+    
+    def _edges(self):
+        # For each Zettel: its path, the paths its links point to (internal
+        # links only) and the paths of its followups, whether those are 
+        # Zettels or not.
+        graph = self._get_graph()
+        for zettel in self.index['files']:
+            links = graph['links'].get(zettel)
+            yield (zettel, links['internal'] if links else [], 
+                   graph['followups'].get(zettel, []))
+    
+    def _tagged(self, tag):
+        return set(self._get_graph()['tagged'].get(tag, ()))
+    
+    def _all_zettels(self):
+        return set(self.index['files'])
         
     ######################
     # Operations         #
@@ -50,19 +243,7 @@ class Zettelkasten:
             - Title of the Zettel
             - Path of the Zettel relative to rootdir
         """
-        zettels = []
-        for zettel in self.index['files']:
-            tup = (self.index['files'][zettel]['title'], zettel)
-            
-            if as_output:
-                zettels.append(outputformat.format(tup))
-            else:
-                zettels.append(tup)
-        
-        if as_output:
-            zettels.sort(key=str.lower)
-        
-        return zettels
+        return self._format(self._zettels(), as_output, outputformat)
     
     def get_title_of(self, zettel):
         """
@@ -74,82 +255,31 @@ class Zettelkasten:
         
         # Make the path to the file relative to the root directory
         zettel = os.path.relpath(zettel, self.rootdir)
-        return self.index['files'][zettel]['title']
+        return self._title(zettel)
     
     def get_followups_of(self, zettel, as_output=False, outputformat='{0[0]:<40}| {0[1]}'):
         """
         Get the Followups of a Zettel from the index.
 
         :param zettel: path to a Zettel file
-        :param index: An existing index.
         :return: A list of tuples. Each tuple contains:
             - Title of the followup
             - Path of the followup relative to rootdir
         """
-        # First, absolute path of zettel
-        # In fact, we need the real path (desolving symlinks)
-        zettel = os.path.realpath(zettel)
-        logger.debug("Real path to ZETTEL: " + str(zettel))
-        
-        # Make the path to the file relative to the root directory
-        # To do that, we need the real path, too
-        logger.debug("Real path to root Dir: " + str(os.path.realpath(self.rootdir)))
-        
-        zettel = os.path.relpath(zettel, os.path.realpath(self.rootdir))
-        logger.debug("Relative path to ZETTEL: " + str(zettel))
-        zetdir = os.path.dirname(zettel)
-        logger.debug("Dirname of ZETTEL: " + str(zetdir))
-        
-        followups = []
-        for followup in self.index['files'][zettel]['followups']:
-            followup = os.path.normpath(os.path.join(zetdir, followup))
-            tup = (self.index['files'][followup]['title'], followup)
-            
-            if as_output:
-                followups.append(outputformat.format(tup))
-            else:
-                followups.append(tup)
-        
-        if as_output:
-            followups.sort(key=str.lower)
-        
-        return followups
+        zettel = self._relpath(zettel)
+        return self._format(self._followups(zettel), as_output, outputformat)
     
     def get_targets_of(self, zettel, as_output=False, outputformat='{0[0]:<40}| {0[1]}'):
         """
         Get the targets of a Zettel's hyperlinks from the index.
 
         :param zettel: path to a Zettel file
-        :param index: An existing index.
         :return: A list of tuples. Each tuple contains:
             - Title of the target
             - Path of the target relative to rootdir
         """
-        # First, real path of zettel
-        zettel = os.path.realpath(zettel)
-        
-        # Make the path to the file relative to the root directory
-        zettel = os.path.relpath(zettel, os.path.realpath(self.rootdir))
-        zetdir = os.path.dirname(zettel)
-        
-        targets = []
-        for target in self.index['files'][zettel]['targets']:
-            # is it an intenal link to another zettel?
-            try:
-                normtarget = os.path.normpath(os.path.join(zetdir, target))
-                tup = (self.index['files'][normtarget]['title'], normtarget)
-            except KeyError:
-                tup = ("External link", target)
-                
-            if as_output:
-                targets.append(outputformat.format(tup))
-            else:
-                targets.append(tup)
-        
-        if as_output:
-            targets.sort(key=str.lower)
-        
-        return targets
+        zettel = self._relpath(zettel)
+        return self._format(self._targets(zettel), as_output, outputformat)
     
     def get_incoming_of(self, zettel, as_output=False, outputformat='{0[0]:<40}| {0[1]}'):
         """
@@ -160,93 +290,278 @@ class Zettelkasten:
             - Title of the incoming link's source
             - Path of the source relative to rootdir
         """
-        # First, real path of zettel
-        zettel = os.path.realpath(zettel)
-        
-        # Make the path to the file relative to the root directory
-        zettel = os.path.relpath(zettel, os.path.realpath(self.rootdir))
-        zetdir = os.path.dirname(zettel)
-        
-        # Start with an empty list of sources
-        sources = []
-        
-        # Iterate over the whole index
-        for f in self.index['files']:
-            # For every file, read the targets of its links, as well as 
-            # its followups from index
-              
-            # empty lists
-            targets = []
-            followups = []
-            
-            # The dir part of f's path, relative to root dir
-            fdir = os.path.dirname(f)
-                        
-            try:
-                # Get the targets from index and replace the empty list
-                # We could do the following:
-                # targets = self.index['files'][f]['targets']
-                # However, the links contained in targets are relative to the 
-                # file f. We have to make them relative to rootdir. 
-                # So we do this:
-                for target in self.index['files'][f]['targets']:
-                    targets.append(os.path.normpath(os.path.join(fdir, target)))
-                
-                # Same for followups
-                for followup in self.index['files'][f]['followups']:
-                    followups.append(os.path.normpath(os.path.join(fdir, followup)))
-            except KeyError:
-                # Throw an error if the index has no target property for 
-                # the file in question. In that case we continue with the 
-                # empty list, meaning we don't do anything
-                logger.debug(f + "has no target property. That's a sign for \
-                a malformed index. Continuing program, but expect output to \
-                be wrong.")
-                logger.debug(sys.exc_info()[1])
-            
-            # Check if our zettel file is among the targets. If so, 
-            # write the current f to our list of sources
-            if zettel in targets:
-                tup = (self.index['files'][f]['title'], f)
-                if as_output:
-                    sources.append(outputformat.format(tup))
-                else:
-                    sources.append(tup)
-            if zettel in followups:
-                tup = (self.index['files'][f]['title'], f)
-                if as_output:
-                    sources.append(outputformat.format(tup))
-                else:
-                    sources.append(tup)
-        
-        # remove duplicates
-        sources = list(set(sources))
-        sources.sort()
-        
-        return sources
+        zettel = self._relpath(zettel)
+        # The sources are distinct already. Different ones may look the 
+        # same when formated, though.
+        sources = self._incoming(zettel)
+        if as_output:
+            sources = set(outputformat.format(tup) for tup in sources)
+        return sorted(sources)
     
     def get_tags_of(self, zettel, as_output=False, outputformat='{0[0]:<40}| {0[1]}'):
         """
         Get the tags of a Zettel from the index.
 
         :param zettel: path to a Zettel file
-        :param index: An existing index.
         :return: A list of tags
         """
-        # First, real path of zettel
-        zettel = os.path.realpath(zettel)
+        return self._tags(self._relpath(zettel))
+    
+    def get_relations_of(self, zettel, followups=True, targets=True, incoming=True):
+        """
+        Get a Zettel's title and all requested relations at once, resolving
+        its path only once.
         
-        # Make the path to the file relative to the root directory
-        zettel = os.path.relpath(zettel, os.path.realpath(self.rootdir))
-        zetdir = os.path.dirname(zettel)
+        :param zettel: path to a Zettel file
+        :param followups: whether to include the followups
+        :param targets: whether to include the targets of hyperlinks
+        :param incoming: whether to include the sources of incoming links
+        :return: A dictionary containing 
+            - 'path': Path of the Zettel relative to rootdir
+            - 'title': Title of the Zettel
+            - 'followups', 'targets', 'incoming' (as requested): lists of 
+              tuples like the ones returned by get_followups_of(), 
+              get_targets_of() and get_incoming_of()
+        """
+        zettel = self._relpath(zettel)
+        relations = dict(path=zettel, title=self._title(zettel))
+        if followups:
+            relations['followups'] = list(self._followups(zettel))
+        if targets:
+            relations['targets'] = list(self._targets(zettel))
+        if incoming:
+            relations['incoming'] = sorted(self._incoming(zettel))
+        return relations
+    
+    def iter_zettels(self, offset=0, limit=None, sort=False, as_output=False, 
+                     outputformat='{0[0]:<50}| {0[1]}'):
+        """
+        Like get_list_of_zettels(), but yielding the Zettels one by one, 
+        as they are read from the index.
+        
+        :param offset: number of Zettels to skip
+        :param limit: maximum number of Zettels, or None for all
+        :param sort: sort the Zettels by title (or, if as_output is set to 
+            True, like get_list_of_zettels() does). With a limit, only the 
+            first offset + limit Zettels are kept while sorting.
+        :return: An iterator over tuples (or strings formated by 
+            outputformat) like the ones returned by get_list_of_zettels()
+        """
+        return self._stream(self._zettels(), offset, limit, sort, as_output, 
+                            outputformat)
+    
+    def iter_followups_of(self, zettel, offset=0, limit=None, sort=False, 
+                          as_output=False, outputformat='{0[0]:<40}| {0[1]}'):
+        """
+        Like get_followups_of(), but yielding the followups one by one. 
+        See iter_zettels() for the parameters.
+        """
+        return self._stream(self._followups(self._relpath(zettel)), offset, 
+                            limit, sort, as_output, outputformat)
+    
+    def iter_targets_of(self, zettel, offset=0, limit=None, sort=False, 
+                        as_output=False, outputformat='{0[0]:<40}| {0[1]}'):
+        """
+        Like get_targets_of(), but yielding the targets one by one. 
+        See iter_zettels() for the parameters.
+        """
+        return self._stream(self._targets(self._relpath(zettel)), offset, 
+                            limit, sort, as_output, outputformat)
+    
+    def iter_incoming_of(self, zettel, offset=0, limit=None, sort=False, 
+                         as_output=False, outputformat='{0[0]:<40}| {0[1]}'):
+        """
+        Like get_incoming_of(), but yielding the sources one by one. 
+        See iter_zettels() for the parameters.
+        """
+        return self._stream(self._incoming(self._relpath(zettel)), offset, 
+                            limit, sort, as_output, outputformat)
+    
+    def get_neighborhood_of(self, zettel, depth=1, links=True, followups=True, 
+                            incoming=True, as_output=False, 
+                            outputformat='{0[0]:<40}| {0[1]}'):
+        """
+        Get all Zettels within depth hops of a Zettel, found by a 
+        breadth-first search over the link graph.
+        
+        :param zettel: path to a Zettel file
+        :param depth: maximum number of hops
+        :param links: follow links to other Zettels
+        :param followups: follow followups
+        :param incoming: follow incoming links and followups backwards
+        :return: A list of tuples, nearest Zettels first. Each tuple contains:
+            - Title of the Zettel
+            - Path of the Zettel relative to rootdir
+            - Distance from zettel (number of hops)
+            If as_output is set to True, the list contains strings formated 
+            by outputformat, in the same order.
+        """
+        zettel = self._relpath(zettel)
+        # Make sure zettel exists. Raises a KeyError, like the other queries.
+        self._title(zettel)
+        distances = {zettel: 0}
+        frontier = [zettel]
+        for distance in range(1, depth + 1):
+            frontier = [z for z in self._expand(frontier, links, followups, 
+                                                incoming)
+                        if not z in distances]
+            if not frontier:
+                break
+            for z in frontier:
+                distances[z] = distance
+        del distances[zettel]
         
-        tags = []
-        for tag in self.index['files'][zettel]['tags']:
-            tags.append(tag)
+        neighborhood = [(self._title(z), z, d) for z, d in distances.items()]
+        neighborhood.sort(key=lambda t: (t[2], str(t[0]).lower(), t[1]))
+        if as_output:
+            neighborhood = [outputformat.format(t) for t in neighborhood]
+        return neighborhood
+    
+    def get_integrity_report(self):
+        """
+        Check the links and followups of all Zettels, in one pass over the 
+        link graph (O(V + E)).
         
-        return tags
+        :return: A dictionary containing
+            - 'zettels': the number of Zettels
+            - 'dangling links': [source, target] pairs of links to files 
+              that are neither in the index nor exist in rootdir
+            - 'orphans': Zettels no other Zettel links to or names as 
+              followup
+            - 'broken followups': [source, followup] pairs of followups 
+              that aren't in the index
+            - 'followup cycles': groups of Zettels whose followups lead in 
+              circles (the strongly connected components of the followup 
+              graph)
+            All paths are relative to rootdir. All lists are sorted.
+        """
+        zettels = self._all_zettels()
+        linked = set()
+        dangling = set()
+        broken = set()
+        successors = {}
+        for zettel, targets, followups in self._edges():
+            for target in targets:
+                if target in zettels:
+                    if target != zettel:
+                        linked.add(target)
+                elif not os.path.exists(os.path.join(self.rootdir, target)):
+                    # Links to images and the like are fine.
+                    dangling.add((zettel, target))
+            successors[zettel] = []
+            for followup in followups:
+                if followup in zettels:
+                    successors[zettel].append(followup)
+                    if followup != zettel:
+                        linked.add(followup)
+                else:
+                    broken.add((zettel, followup))
+        
+        return {'zettels': len(zettels),
+                'dangling links': [list(pair) for pair in sorted(dangling)],
+                'orphans': sorted(zettels - linked),
+                'broken followups': [list(pair) for pair in sorted(broken)],
+                'followup cycles': sorted(sorted(cycle) for cycle in 
+                                          _cycles(successors))}
     
-    def get_zettels_tagged_with(self, tag):
+    def get_ranking(self, measure='pagerank', limit=10, links=True, 
+                    followups=True, as_output=False, 
+                    outputformat='{0[0]:<50}| {0[1]}'):
+        """
+        Rank the Zettels by their centrality in the graph of links between 
+        Zettels and followups.
+        
+        :param measure: one of 'pagerank', 'authority', 'hub' (see 
+            zettels.centrality), 'in-degree', 'out-degree'
+        :param limit: number of Zettels to return, None for all
+        :param links: count links between Zettels as edges
+        :param followups: count followups as edges
+        :return: A list of tuples, highest score first. Each tuple contains:
+            - Title of the Zettel
+            - Path of the Zettel relative to rootdir
+            - Score
+            If as_output is set to True, the list contains strings formated 
+            by outputformat, in the same order.
+        :raises ValueError: if the measure is unknown
+        """
+        # Only rankings need it, so it's imported here, like the modules 
+        # of the other optional queries.
+        from zettels import centrality
+        def adjacency():
+            for zettel, targets, zettel_followups in self._edges():
+                if links and followups:
+                    yield zettel, itertools.chain(targets, zettel_followups)
+                elif links:
+                    yield zettel, targets
+                elif followups:
+                    yield zettel, zettel_followups
+        
+        graph = centrality.LinkGraph(self._all_zettels(), adjacency())
+        logger.debug("Link graph: " + str(len(graph)) + " Zettels, " 
+                     + str(len(graph.sources)) + " edges")
+        scores = centrality.scores(graph, measure)
+        key = lambda i: (-scores[i], graph.paths[i])
+        if limit is None:
+            ranking = sorted(range(len(graph)), key=key)
+        else:
+            ranking = heapq.nsmallest(limit, range(len(graph)), key=key)
+        ranking = [(self._title(graph.paths[i]), graph.paths[i], scores[i])
+                   for i in ranking]
+        if as_output:
+            ranking = [outputformat.format(t) for t in ranking]
+        return ranking
+    
+    def export_graph(self, out, graphformat='dot', expression=None, 
+                     subdir=None):
+        """
+        Write the graph of the Zettelkasten to a file: the Zettels with 
+        title and tags as nodes, links between Zettels and followups as 
+        edges. Nodes and edges are written one by one, as they're read from 
+        the index.
+        
+        :param out: a text file to write to, e.g. sys.stdout
+        :param graphformat: one of 'dot', 'graphml', 'tsv', 'csv' (see 
+            zettels.graphexport)
+        :param expression: a tag expression (see get_zettels_matching()). 
+            If given, only the Zettels matching it are exported.
+        :param subdir: path to a directory. If given, only the Zettels in 
+            it (or its subdirectories) are exported.
+        :raises tagquery.TagExpressionError: if the expression is malformed
+        :raises ValueError: if the format is unknown
+        """
+        from zettels import graphexport, tagquery
+        writer = graphexport.get_writer(graphformat, out)
+        # Edges are only exported between the selected Zettels.
+        selected = None
+        if expression:
+            tree = tagquery.parse(expression)
+            selected = tagquery.evaluate(tree, self._tagged, self._all_zettels)
+        prefix = None
+        if subdir:
+            prefix = self._relpath(subdir)
+            prefix = '' if prefix == os.curdir else prefix + os.sep
+        
+        def included(zettel):
+            return ((selected is None or zettel in selected) and 
+                    (prefix is None or zettel.startswith(prefix)))
+        
+        writer.begin()
+        for title, zettel in self._zettels():
+            if included(zettel):
+                writer.node(zettel, title, self._tags(zettel))
+        zettels = self._all_zettels() if selected is None else selected
+        for zettel, targets, followups in self._edges():
+            if not included(zettel):
+                continue
+            for target in targets:
+                if target in zettels and included(target):
+                    writer.edge(zettel, target, 'link')
+            for followup in followups:
+                if followup in zettels and included(followup):
+                    writer.edge(zettel, followup, 'followup')
+        writer.end()
+    
+    def get_zettels_tagged_with(self, tag, as_output=False, outputformat='{0[0]:<50}| {0[1]}'):
         """This function returns a list of Zettels contained in the index that 
         are tagged with the specified tag. The list actually
         contains tuples: Title of the file and the path to the file. 
@@ -256,11 +571,51 @@ class Zettelkasten:
             - Title of the Zettel
             - Path to the Zettel as given in the index
         """
-        # Start with an empy list
-        taggedzettels = []
-        # search index
-        for f in index['files']:
-            if tag in index['files'][f]['tags']:
-                taggedzettels.append((index['files'][f]['title'],f))
-        return taggedzettels
-    
\ No newline at end of file
+        return self._format(((self._title(f), f) for f in self._tagged(str(tag))),
+                            as_output, outputformat)
+    
+    def search(self, query, limit=None, as_output=False, outputformat='{0[0]:<50}| {0[1]}'):
+        """
+        Search the text of the Zettels in the full-text index.
+        
+        :param query: the search terms. Zettels containing any of them are 
+            found, ranked by BM25.
+        :param limit: the maximum number of results, or None for all
+        :return: A list of tuples, best match first. Each tuple contains:
+            - Title of the Zettel
+            - Path of the Zettel relative to rootdir
+            If as_output is set to True, the list contains strings formated 
+            by outputformat, in the same order.
+        """
+        if self.fulltext is None:
+            raise ValueError("This Zettelkasten has no full-text index.")
+        results = []
+        for zettel, score in self.fulltext.search(query, limit):
+            logger.debug("Score of " + zettel + ": " + str(score))
+            try:
+                results.append((self._title(zettel), zettel))
+            except KeyError:
+                # The full-text index is ahead of the index.
+                continue
+        if as_output:
+            results = [outputformat.format(tup) for tup in results]
+        return results
+    
+    def get_zettels_matching(self, expression, as_output=False, outputformat='{0[0]:<50}| {0[1]}'):
+        """
+        Get the Zettels whose tags match a boolean tag expression, like
+        'python AND (zettel OR "data science") AND NOT draft'. See 
+        zettels.tagquery for the syntax.
+        
+        :param expression: the tag expression
+        :return: A list of tuples, like get_list_of_zettels(). If as_output 
+            is set to True, the list contains strings formated by 
+            outputformat.
+        :raises tagquery.TagExpressionError: if the expression is malformed
+        """
+        from zettels import tagquery
+        tree = tagquery.parse(expression)
+        logger.debug("Tag expression: " + str(tree))
+        matches = tagquery.evaluate(tree, self._tagged, self._all_zettels)
+        return self._format(((self._title(f), f) for f in matches), 
+                            as_output, outputformat)
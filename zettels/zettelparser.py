@@ -16,25 +16,48 @@
 ##You should have received a copy of the GNU General Public License
 ##along with Zettels. If not, see http://www.gnu.org/licenses/.
 
-import linecache
+import itertools
 import logging
 import os
-import pathspec
-import pkg_resources
-import shlex
-import subprocess
+import re
+import stat
 import sys
 import time
-import yaml
+
+from zettels import frontmatter, indexformats, indexlock, journal
+from zettels.stats import Stats
 
 logger = logging.getLogger('Zettels.' + __name__)
 
+# How often Zettelparser.read_index() tries again, if the index file is 
+# replaced while it's being read.
+_READ_ATTEMPTS = 5
+
+# Files shipped with the package, like zettels-grep-patterns
+_RESOURCES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                              'resources')
+
+# The delimiter patterns from resources/zettels-grep-patterns, as the 
+# Python scanner applies them. Links are extracted by zettels.links.
+_DELIMITER_PATTERN = re.compile(r'(?:---|\.\.\.)$', re.MULTILINE)
+
+# Link targets with a URL scheme (http:, mailto:, ...), absolute paths and
+# anchors don't point to other Zettels.
+_EXTERNAL_PATTERN = re.compile(r'[A-Za-z][A-Za-z0-9+.-]*:|[/#]')
+
+# Files up to this size (in bytes) are read at once. Larger ones are read 
+# in chunks of this many characters. Only a line longer than that is kept
+# in memory as a whole.
+_CHUNK_SIZE = 65536
+
 class Zettelparser:
     """
     Zettelparser contains some methods necessary to build and update the index.
     
-    It uses grep for parsing the Zettels. So if grep is not present
-    on your OS, it won't work.
+    By default, it parses the Zettels with a scanner written in pure Python,
+    which reads each file exactly once. The old engine, which uses find and 
+    grep, is still available (mainly for comparison) by passing 
+    engine='grep' to Zettelparser.update_index().
     
     The central method is probably Zettelparser.update_index(), it calls 
     most of the other methods, which can be viewed as sub-methods.
@@ -43,8 +66,13 @@ class Zettelparser:
     and Zettelparser.write_index()
     
     See the class Zettelkasten for functionality of working with the index.        
+    
+    Zettelparser.stats collects timers and counters for the phases of 
+    updates, see zettels.stats.
     """
     
+    stats = Stats()
+    
     @staticmethod
     def _ignorify(patterns=['*~']):
         """
@@ -69,62 +97,27 @@ class Zettelparser:
     
     @staticmethod
     def _list_files(dirname, ignore_patterns=None):
-        # Reverse pattern
-        ignore_patterns = Zettelparser._ignorify(ignore_patterns)
-        
-        spec = pathspec.PathSpec.from_lines('gitwildmatch', ignore_patterns)
-        matches = spec.match_tree(dirname)
+        snapshot = Zettelparser._snapshot(dirname, ignore_patterns)
         files = []
-        for match in matches:
-            files.append(os.path.join(dirname, match))
+        for f in snapshot['indexable']:
+            files.append(os.path.join(dirname, f))
         
         return files
     
     @staticmethod
-    def _get_updated_files(dirname, index=None, ignore_patterns=None):
-        # Take care of optional parameters
-        index = index or dict(files=dict())
-        
-        ## Maybe our index has no timestamp, yet.
-        try:
-            timestamp = '@' + str(int(index['timestamp']))
-        except KeyError:
-            timestamp = '@0'
-        ignore_patterns = ignore_patterns or []
-        
-        # Prepare ignore_patterns, i.e. reverse them
-        ignore_patterns = Zettelparser._ignorify(ignore_patterns)
-        spec = pathspec.PathSpec.from_lines('gitwildmatch', ignore_patterns)
-                
-        
-        cmd = ['find', dirname, '-type', 'f', '-newerct', timestamp]
-        # TODO (MEMO): should we need to get rid of the ./ at the beginning:
-        # we can pipe it through sed 's/\.\///'
-                
-        output = []
-        for line in subprocess.check_output(cmd).splitlines():
-            line = line.decode()
-            if spec.match_file(line):
-                output.append(line)
-                
-        return output
-        
-    @staticmethod
-    def _grep_files(dirname, index=None, ignore_patterns=None):
+    def _grep_files(dirname, files):
         # Calls grep to get the yaml-Blocks and markdown-Links as specified
         # in the file "zettels-grep-patterns"
-        files = Zettelparser._get_updated_files(dirname, index, ignore_patterns)
         
         # Call grep only if there are any updated files
         grepoutput = None
         if files:
+            # Only the grep engine needs subprocess. Importing it takes a 
+            # while, so it's imported here.
+            import subprocess
             # Path of the patterns file is 
             # [installation directory]/resources/zettels-grep-patterns
-            #patterns_file = os.path.join(sys.path[0], 
-            #                             "resources", 
-            #                             "zettels-grep-patterns ")
-            
-            patterns_file = pkg_resources.resource_filename('zettels', 'resources/zettels-grep-patterns')
+            patterns_file = os.path.join(_RESOURCES_DIR, 'zettels-grep-patterns')
             
             # pass it to grep
             grepcmd = ['grep', '-n', '-E', '-o', '-f', patterns_file]
@@ -140,96 +133,729 @@ class Zettelparser:
                     raise
         
         grepoutput = grepoutput or ""
+
+        return grepoutput
+
+    @staticmethod
+    def _ignore_spec(ignore_patterns=None):
+        # A pathspec matching the paths (relative to the root directory) 
+        # that are *not* ignored. Directories are matched with a trailing 
+        # slash.
+        ignore_patterns = ignore_patterns or []
         
-        return files, grepoutput
+        # Prepare ignore_patterns, i.e. reverse them
+        ignore_patterns = Zettelparser._ignorify(ignore_patterns)
+        # Only updates need pathspec, queries don't. Importing it takes a 
+        # while, so it's imported here.
+        import pathspec
+        return pathspec.PathSpec.from_lines('gitwildmatch', ignore_patterns)
     
     @staticmethod
-    def _parse_metadata(rootdir, for_yaml, index):
-        origcwd = os.getcwd()
-        os.chdir(rootdir)
-        logger.debug("Parsing metadata:")
-        for f in for_yaml:
+    def _snapshot(dirname, ignore_patterns=None):
+        """
+        Walk dirname once and take a snapshot of the tree. 
+        
+        Everything an update needs to know about the file system (which 
+        files are new, modified or deleted) is derived from the snapshot, 
+        so the tree is walked only once per update.
+        
+        :param dirname: the directory containing the Zettel files.
+        :param ignore_patterns: a list of gitignore-style patterns to be ignored
+        :return: A dictionary containing:
+            - 'stats': for every file (relative to dirname), its 
+              os.stat_result
+            - 'indexable': the set of files not matching ignore_patterns
+        """
+        spec = Zettelparser._ignore_spec(ignore_patterns)
+        
+        stats = dict(Zettelparser._walk_files(dirname))
+        indexable = set(f for f in stats if spec.match_file(f))
+        return dict(stats=stats, indexable=indexable)
+    
+    @staticmethod
+    def _manifest_record(st):
+        return dict(mtime_ns=st.st_mtime_ns, size=st.st_size, inode=st.st_ino)
+    
+    @staticmethod
+    def _detect_changes(dirname, snapshot, index=None, hash_content=False):
+        """
+        Compare a snapshot of dirname to the index and find out which files 
+        need to be (re)parsed and which ones need to be removed.
+        
+        A file needs parsing if it isn't in the index, yet, or if its 
+        modification time (in ns), size or inode differ from the ones 
+        recorded in the index' manifest. Changes to the ctime alone 
+        (chmod, ownership) don't count.
+        
+        If hash_content is set, the manifest also records a hash of each 
+        file's content. Then, files whose stats differ, but whose content 
+        hash is unchanged (e.g. after `touch` or a git checkout) aren't 
+        parsed again.
+        
+        Indexes written before manifests existed only have a timestamp. In 
+        that case, files changed (ctime) since the timestamp are parsed, 
+        like find's -newerct did.
+        
+        :param dirname: the directory containing the Zettel files.
+        :param snapshot: a snapshot of dirname, see Zettelparser._snapshot()
+        :param index: An existing index (or anything with 'files', and
+            optionally 'manifest' and 'timestamp').
+        :param hash_content: whether to record and compare content hashes
+        :return: A tuple containing:
+            - the set of files to be parsed (relative to dirname)
+            - the set of files to be removed from the index, because they 
+              were deleted or are ignored now
+            - the new manifest, for all files not being ignored
+        """
+        # Take care of optional parameters
+        index = index or dict(files=dict())
+        old_manifest = index.get('manifest')
+        
+        stats = snapshot['stats']
+        indexable = snapshot['indexable']
+        known = set(index['files'])
+        
+        manifest = dict((f, Zettelparser._manifest_record(stats[f])) 
+                        for f in indexable)
+        
+        # Compare what's in both, the index and the snapshot.
+        candidates = indexable & known
+        if old_manifest is None:
+            ## Maybe our index has no timestamp, yet.
+            try:
+                timestamp = int(index['timestamp'])
+            except (KeyError, TypeError):
+                timestamp = 0
+            # Same as find's -newerct
+            modified = set(f for f in candidates 
+                           if stats[f].st_ctime > timestamp)
+        else:
+            modified = set(f for f in candidates 
+                           if old_manifest.get(f) is None
+                           or not Zettelparser._same_stats(old_manifest[f], 
+                                                           manifest[f]))
+        
+        if hash_content:
+            old_manifest = old_manifest or dict()
+            for f in indexable:
+                previous = old_manifest.get(f) or dict()
+                if f in modified or not 'hash' in previous:
+                    manifest[f]['hash'] = Zettelparser._hash_file(
+                                                    os.path.join(dirname, f))
+                else:
+                    manifest[f]['hash'] = previous['hash']
+            # Only touched? Then the content hash didn't change.
+            touched = set(f for f in modified 
+                          if (old_manifest.get(f) or dict()).get('hash') 
+                             == manifest[f]['hash'])
+            logger.debug("Content unchanged: " + str(touched))
+            modified -= touched
+        
+        updated = (indexable - known) | modified
+        removed = known - indexable
+        return updated, removed, manifest
+    
+    @staticmethod
+    def _classify_paths(dirname, paths, spec, known, old_manifest, 
+                        hash_content=False):
+        """
+        Like Zettelparser._detect_changes(), but only for some paths (e.g. 
+        the ones a file system watcher reported) instead of a snapshot of 
+        the whole tree.
+        
+        :param dirname: the directory containing the Zettel files.
+        :param paths: paths relative to dirname, that may have changed
+        :param spec: the pathspec of Zettelparser._ignore_spec()
+        :param known: the paths in the index
+        :param old_manifest: the manifest of the index
+        :param hash_content: whether to record and compare content hashes
+        :return: A tuple containing:
+            - the set of files to be parsed
+            - the set of files to be removed from the index, because they 
+              were deleted or are ignored
+            - the new manifest records of all paths that still exist, 
+              including files that were only touched
+        """
+        updated = set()
+        removed = set()
+        records = dict()
+        for f in set(paths):
+            path = os.path.join(dirname, f)
+            try:
+                st = os.stat(path, follow_symlinks=False)
+            except (FileNotFoundError, NotADirectoryError):
+                st = None
+            if st is None or not stat.S_ISREG(st.st_mode) or not spec.match_file(f):
+                if f in known:
+                    removed.add(f)
+                continue
+            record = Zettelparser._manifest_record(st)
+            previous = old_manifest.get(f) or dict()
+            if f in known and Zettelparser._same_stats(previous, record):
+                continue
+            if hash_content:
+                record['hash'] = Zettelparser._hash_file(path)
+            records[f] = record
+            if f in known and hash_content and previous.get('hash') == record['hash']:
+                logger.debug("Content unchanged: " + f)
+                continue
+            updated.add(f)
+        return updated, removed, records
+    
+    @staticmethod
+    def _same_stats(a, b):
+        return (a.get('mtime_ns') == b['mtime_ns'] and a.get('size') == b['size'] 
+                and a.get('inode') == b['inode'])
+    
+    @staticmethod
+    def _hash_file(path):
+        Zettelparser.stats.count('files hashed')
+        import hashlib
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                h.update(chunk)
+        return h.hexdigest()
+    
+    @staticmethod
+    def _walk_files(dirname):
+        """
+        Recursively list all regular files below dirname, like
+        `find dirname -type f` does. Symlinks are neither followed nor listed.
+
+        :param dirname: the directory to walk
+        :return: A list of tuples. Each tuple contains:
+            - path of the file relative to dirname
+            - the os.stat_result of the file
+        """
+        files = []
+        # Keep track of the relative path of each directory, instead of
+        # calling os.path.relpath for every single file.
+        stack = [(dirname, '')]
+        while stack:
+            current, prefix = stack.pop()
+            for entry in os.scandir(current):
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, prefix + entry.name + os.sep))
+                elif entry.is_file(follow_symlinks=False):
+                    files.append((prefix + entry.name,
+                                  entry.stat(follow_symlinks=False)))
+        return files
+
+    @staticmethod
+    def _scan_file(path):
+        """
+        Extract both the YAML metadata block and the link targets of a 
+        Zettel file (see zettels.links for the kinds of links).
+
+        The metadata block is the same one grep finds with the patterns in
+        resources/zettels-grep-patterns: The block starts at the first 
+        line ending with '---' and stops before the first line ending with 
+        '...' or the next one ending with '---'.
+        
+        Files larger than _CHUNK_SIZE aren't read into memory as a whole, 
+        see Zettelparser._read_front_matter() and Zettelparser._scan_links().
+
+        :param path: path to the Zettel file
+        :return: A tuple containing:
+            - the YAML block as a string or None, if the file has none
+            - a list of link targets in the order of their appearance
+        """
+        extension = os.path.splitext(path)[1]
+        with Zettelparser._open(path) as f:
+            size = os.fstat(f.fileno()).st_size
+            Zettelparser.stats.count('bytes read', size)
+            if size <= _CHUNK_SIZE:
+                # Small enough to be read at once, which is faster.
+                return Zettelparser._scan_text(f.read(), extension)
+            y = Zettelparser._read_front_matter(f)
+            f.seek(0)
+            return y, Zettelparser._scan_links(f, extension)
+    
+    @staticmethod
+    def _open(path):
+        return open(path, 'rt', encoding='utf-8', errors='replace')
+    
+    @staticmethod
+    def _read_file(path):
+        with Zettelparser._open(path) as f:
+            Zettelparser.stats.count('bytes read', os.fstat(f.fileno()).st_size)
+            return f.read()
+    
+    @staticmethod
+    def _read_front_matter(f):
+        """
+        Read the YAML metadata block (see Zettelparser._scan_file()) line by
+        line, and nothing after it. Only a file without a complete block is 
+        read to the end.
+        
+        :param f: a Zettel file, opened as text
+        :return: the YAML block as a string or None, if the file has none
+        """
+        block = None
+        # A line ending with '...' before the first one ending with '---' 
+        # ends the block before it starts.
+        stopped = False
+        for line in f:
+            end = line[-4:].rstrip('\n')
+            if block is None:
+                if end.endswith('---'):
+                    if stopped:
+                        return ''
+                    block = [line]
+                elif end.endswith('...'):
+                    stopped = True
+            elif end.endswith(('---', '...')):
+                return ''.join(block)
+            else:
+                block.append(line)
+        # Either no block at all or one that doesn't end.
+        return None
+    
+    @staticmethod
+    def _scan_links(f, extension=''):
+        """
+        Get the link targets of a Zettel file. The file is read in chunks, 
+        which are cut after their last line break, since links don't span 
+        lines.
+        
+        :param f: a Zettel file, opened as text
+        :param extension: the Zettel's extension, for wikilinks
+        :return: a list of link targets in the order of their appearance
+        """
+        # The link patterns take a while to compile, and queries of the 
+        # index don't need them.
+        from zettels.links import LinkExtractor
+        extractor = LinkExtractor(extension)
+        rest = ''
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                extractor.feed(rest)
+                return extractor.targets()
+            chunk = rest + chunk
+            cut = chunk.rfind('\n') + 1
+            if cut:
+                extractor.feed(chunk[:cut])
+            rest = chunk[cut:]
+    
+    @staticmethod
+    def _scan_text(text, extension=''):
+        # Like Zettelparser._scan_file(), for a text that's in memory 
+        # anyway. Neither links nor delimiters span lines, so both can be 
+        # found in the whole text at once.
+        from zettels.links import extract as extract_links
+        targets = extract_links(text, extension)
+        
+        start = None
+        stop = None
+        for match in _DELIMITER_PATTERN.finditer(text):
+            if match.group() == '---':
+                if start is None:
+                    start = match.start()
+                elif stop is None:
+                    stop = match.start()
+            elif stop is None:
+                stop = match.start()
+            if start is not None and stop is not None:
+                break
+        
+        if start is None or stop is None:
+            # Either no block at all or one that doesn't end.
+            return None, targets
+        if stop < start:
+            # Ended before it started, so it's empty.
+            return '', targets
+        # The block contains the complete lines from the start line up to,
+        # but not including the stop line.
+        start = text.rfind('\n', 0, start) + 1
+        stop = text.rfind('\n', 0, stop) + 1
+        return text[start:stop], targets
+
+    @staticmethod
+    def _apply_metadata(entry, y):
+        """
+        Parse a YAML block and write its entries to an index entry. Simple 
+        blocks are parsed by zettels.frontmatter, anything else by PyYAML.
+        """
+        logger.debug("y: %s", y)
+        start = time.perf_counter()
+        metadata = frontmatter.load(y)
+        Zettelparser.stats.add('yaml', time.perf_counter() - start)
+        # An empty block (or something that isn't a mapping at all)
+        # doesn't contain any metadata for us.
+        if not isinstance(metadata, dict):
+            return
+        #write the metadata to the index.
+        for item in metadata:
+            entry[item] = metadata[item]
+
+    @staticmethod
+    def _new_entry():
+        # The entry of a Zettel without any metadata
+        return dict(title="untitled", targets=[], tags=[], followups=[])
+
+    @staticmethod
+    def _parse_zettel(rootdir, f, fulltext=None, record=None):
+        """
+        Parse a single Zettel file with the scanner.
+
+        :param rootdir: the directory containing the Zettel files.
+        :param f: path of the Zettel relative to rootdir
+        :param fulltext: a zettels.fulltext.FulltextIndex to add the 
+            Zettel's text to, while we're at it
+        :param record: the Zettel's manifest record, for the full-text index
+        :return: the Zettel's index entry
+        """
+        logger.debug("Scanning: %s", f)
+        entry = Zettelparser._new_entry()
+        path = os.path.join(rootdir, f)
+        if fulltext is not None:
+            # The full-text index needs the whole text anyway.
+            text = Zettelparser._read_file(path)
+            fulltext.add(f, text, record)
+            y, targets = Zettelparser._scan_text(text, os.path.splitext(f)[1])
+        else:
+            y, targets = Zettelparser._scan_file(path)
+        entry['targets'] = targets
+        if y is not None:
+            Zettelparser._apply_metadata(entry, y)
+        return entry
+
+    @staticmethod
+    def _parse_grep_output(rootdir, grepoutput, index):
+        """
+        Take the output of Zettelparser._grep_files() apart: Write the link 
+        targets to the index and collect the line numbers of the YAML 
+        blocks.
+        
+        :return: A dictionary containing the 'start' and 'stop' line of 
+            the YAML block of each file.
+        """
+        #A temporary dict for in which information is 
+        #stored that are needed to parse the metadata
+        for_yaml = dict()
+        for line in grepoutput.splitlines():
+            #because grepoutput is in bytestring format, 
+            #decode it before taking it apart.
+            line = bytes.decode(line)
+            logger.debug("current line of grep output: %s", line)
+        
+            #In the first partition, we get the filepath
+            #of the occurrence file
+            f, _, rest = line.partition(':')
+            logger.debug("the rest looks like this: %s", rest)
+            
             # Make the path to the file relative to the root directory
-            #f = os.path.relpath(f, rootdir)
+            f = os.path.relpath(f, rootdir)
+            
+            logger.debug("Current file: %s", f)
+            #In the second partition, we get the line
+            #number and the pattern that is responsible 
+            #for this line
+            ln, _, pat = rest.partition(':')
             
-            logger.debug("Current file:")
-            logger.debug(f)
-            #only if there is more than the backbone.
-            if for_yaml[f]['start'] != '':
-                logger.debug("start: " + for_yaml[f]['start'])
-                logger.debug("stop: " + for_yaml[f]['stop'])
-                y = ''
-                for i in range(
-                    int(for_yaml[f]['start']), 
-                    int(for_yaml[f]['stop'])
-                    ):
-                    y = y + linecache.getline(f, i)
+            # First occurence for that file? Create an empty
+            # entry
+            if not f in for_yaml:
+                for_yaml[f] = dict(start='', stop='')
             
-                logger.debug("y: " + str(y))
+            if pat == "---":
+            # get the line number currently stored for the
+            # pattern
+                current_ln = for_yaml[f]['start']
+                # current_ln might be an empty string
+                if current_ln:
+                    # we want to store the smallest linenumber
+                    # where this pattern occurs
+                    if int(current_ln) > int(ln):
+                        logger.debug("Storing start: %s", ln)
+                        for_yaml[f]['start'] = ln
+                    else:
+                        # we might have a YAML block that ends with
+                        # '---' instead of '...'
+                        current_ln = for_yaml[f]['stop']
+                        # same game
+                        if current_ln:
+                            if int(current_ln) > int(ln):
+                                logger.debug("Storing stop: %s", ln)
+                                for_yaml[f]['stop'] = ln
+                        else:
+                            logger.debug("Storing stop: %s", ln)
+                            for_yaml[f]['stop'] = ln
+                else:
+                    # Yay, our value is new and shiny! Let's store it!
+                    logger.debug("Storing start: %s", ln)
+                    for_yaml[f]['start'] = ln                    
+            elif pat == "...":
+            # get the line number currently stored for the
+            # pattern
+                current_ln = for_yaml[f]['stop']
+                # current_ln might be an empty string
+                if current_ln:
+                    # we want to store the smallest linenumber
+                    # where this pattern occurs
+                    # or the second smallest where '---' occurs, which 
+                    # is handled above
+                    if int(current_ln) > int(ln):
+                        logger.debug("Storing stop: %s", ln)
+                        for_yaml[f]['stop'] = ln
+                else:
+                    # Yay, our value is new and shiny! Let's store it!
+                    logger.debug("Storing stop: %s", ln)
+                    for_yaml[f]['stop'] = ln
+            #Other patterns are hyperlinks. Write the targets 
+            #of those to the index
+            else:
+                logger.debug("MD inline link found: %s", pat)
+                # We still have the complete inline link, e.g.
+                # [Pipes](https://en.wikipedia.org/Pipelines_(Unix))
+                # We only want the URL-part. The target.
+                #only the target in parentheses
+                pat = pat.split("]")[1]
+                #strip away the front parenthesis
+                pat = pat.strip("(")
+                #and the end parenthesis
+                target = pat.rsplit(")", 1)[0]                    
                 
-                metadata = yaml.safe_load(y)
-                #write the metadata to the index.
-                for item in metadata:
-                    index['files'][f][item] = metadata[item]
-        
-        linecache.clearcache()
-        os.chdir(origcwd)
+                if not target in index['files'][f]['targets']:
+                    index['files'][f]['targets'].append(target)
+        return for_yaml
+    
+    @staticmethod
+    def _parse_metadata(rootdir, for_yaml, index):
+        logger.debug("Parsing metadata:")
+        for f in for_yaml:
+            logger.debug("Current file: %s", f)
+            start = for_yaml[f]['start']
+            stop = for_yaml[f]['stop']
+            #only if there is more than the backbone, and the block ends.
+            if start != '' and stop != '':
+                logger.debug("start: %s", start)
+                logger.debug("stop: %s", stop)
+                # Read the lines from start up to, but not including stop 
+                # (numbered from 1), and nothing after them.
+                with Zettelparser._open(os.path.join(rootdir, f)) as lines:
+                    y = ''.join(itertools.islice(lines, int(start) - 1, 
+                                                 max(int(start), int(stop)) - 1))
+                Zettelparser._apply_metadata(index['files'][f], y)
+
         logger.debug("Parsing metadata: Done.")
         return index
     
     @staticmethod
-    def _prune_index(rootdir, index):
+    def _prune_index(index, to_prune):
+        # to_prune: entries of files that were deleted or are ignored now,
+        # as found by Zettelparser._detect_changes()
         logger.debug("Pruning index...")
-        to_prune = []
-        try:
-            files = index['files']
-            # Make a list of all files in the root directory
-            cmd = ['find', rootdir, '-type', 'f']
-            found_files = subprocess.check_output(cmd).splitlines()
-
-            for entry in files:
-                to_be_compared = os.path.join(rootdir, entry).encode(encoding='UTF-8')
-                logger.debug("Current entry:")
-                logger.debug(to_be_compared)
-                if not to_be_compared in found_files:
-                    logger.error("Current entry is not in found_files. Well be pruned.")
-                    # The file listed in the index doesn't exist anymore.
-                    # Let's remove the entry
-                    to_prune.append(entry)                    
-        except TypeError as e:
-            logger.error("Failed pruning the index. No valid index.", e)
-        except KeyError as e:
-            logger.error("Failed pruning the index. It doesn't contain a "
-                         + "field 'files'", e)
-        
         for entry in to_prune:
+            logger.debug("Pruning: %s", entry)
             del index['files'][entry]
-        
-        logger.debug("After pruning: index looks like this:")
-        logger.debug(index)
+        Zettelparser.stats.count('entries pruned', len(to_prune))
         
         logger.debug("Pruning index: Done")
 
         return index
+    
+    @staticmethod
+    def _resolve_target(zetdir, target):
+        """
+        Resolve a link target, which is relative to the linking Zettel.
+        
+        :param zetdir: directory of the linking Zettel, relative to the 
+            root directory
+        :param target: the link target as written
+        :return: the path of the linked file, normalized and relative to 
+            the root directory, without the fragment (e.g. '#heading') and
+            with percent-encoded characters decoded. None for targets that 
+            don't point to other Zettels (URLs, absolute paths, anchors).
+        """
+        if _EXTERNAL_PATTERN.match(target):
+            return None
+        path = target.split('#', 1)[0].split('?', 1)[0]
+        if '%' in path:
+            import urllib.parse
+            path = urllib.parse.unquote(path)
+        return os.path.normpath(os.path.join(zetdir, path))
+    
+    @staticmethod
+    def _resolve_edges(zettel, entry):
+        """
+        Resolve the link targets and followups of a Zettel, which are 
+        relative to the Zettel itself, to paths relative to the root 
+        directory.
+        
+        :param zettel: path of the Zettel relative to the root directory
+        :param entry: the Zettel's entry in the index
+        :return: A tuple containing:
+            - internal link targets, normalized and relative to root dir
+            - external link targets (URLs and the like), as they are
+            - followups, normalized and relative to root dir
+        """
+        zetdir = os.path.dirname(zettel)
+        internal = []
+        external = []
+        for target in Zettelparser._as_list(entry.get('targets')):
+            target = str(target)
+            resolved = Zettelparser._resolve_target(zetdir, target)
+            if resolved is None:
+                external.append(target)
+            elif not resolved in internal:
+                internal.append(resolved)
+        
+        followups = []
+        for followup in Zettelparser._as_list(entry.get('followups')):
+            followup = os.path.normpath(os.path.join(zetdir, str(followup)))
+            if not followup in followups:
+                followups.append(followup)
+        
+        return internal, external, followups
+    
+    @staticmethod
+    def _resolve_tags(entry):
+        # Tags are keys of the inverted index and compared to tags given as
+        # strings in queries, so tags YAML parsed as numbers or dates are 
+        # turned into strings.
+        tags = []
+        for tag in Zettelparser._as_list(entry.get('tags')):
+            tag = str(tag)
+            if not tag in tags:
+                tags.append(tag)
+        return tags
+    
+    @staticmethod
+    def _as_list(value):
+        # Metadata is written by hand. Be lenient about single values where 
+        # lists are expected.
+        if isinstance(value, (list, tuple)):
+            return value
+        if value is None:
+            return []
+        return [value]
+    
+    @staticmethod
+    def _update_graph(index, changed, removed=()):
+        """
+        Incrementally update the link graph of the index.
+        
+        The forward edges (and tags) of every changed or removed Zettel are 
+        taken out of the reverse maps first. Then the forward and reverse 
+        edges of the changed Zettels are added again, according to their new 
+        entries.
+        
+        :param index: An index containing a graph.
+        :param changed: paths of Zettels that were (re)parsed
+        :param removed: paths of Zettels that were removed from the index
+        """
+        graph = index['graph']
+        for zettel in list(changed) + list(removed):
+            links = graph['links'].pop(zettel, None)
+            if links:
+                for target in links['internal']:
+                    Zettelparser._remove_edge(graph['incoming'], target, zettel)
+            for followup in graph['followups'].pop(zettel, []):
+                Zettelparser._remove_edge(graph['followup-of'], followup, zettel)
+            for tag in graph['tags'].pop(zettel, []):
+                Zettelparser._remove_edge(graph['tagged'], tag, zettel)
+        
+        for zettel in changed:
+            if not zettel in index['files']:
+                continue
+            internal, external, followups = Zettelparser._resolve_edges(
+                zettel, index['files'][zettel])
+            graph['links'][zettel] = dict(internal=internal, external=external)
+            graph['followups'][zettel] = followups
+            for target in internal:
+                Zettelparser._add_edge(graph['incoming'], target, zettel)
+            for followup in followups:
+                Zettelparser._add_edge(graph['followup-of'], followup, zettel)
+            tags = Zettelparser._resolve_tags(index['files'][zettel])
+            graph['tags'][zettel] = tags
+            for tag in tags:
+                Zettelparser._add_edge(graph['tagged'], tag, zettel)
+        
+        return index
+    
+    @staticmethod
+    def _add_edge(reverse, target, source):
+        sources = reverse.setdefault(target, [])
+        if not source in sources:
+            sources.append(source)
+    
+    @staticmethod
+    def _remove_edge(reverse, target, source):
+        sources = reverse.get(target)
+        if sources and source in sources:
+            sources.remove(source)
+            if not sources:
+                del reverse[target]
+    
+    @staticmethod
+    def has_graph(index):
+        """
+        Check whether an index contains a complete graph. Indexes written 
+        by older versions of Zettels contain none or one without tags.
+        """
+        return 'graph' in index and 'tagged' in index['graph']
+    
+    @staticmethod
+    def build_graph(index):
+        """
+        (Re)build the link graph of an index from scratch.
+        
+        The graph is stored as index['graph'], a dictionary containing
+        - 'links': for each Zettel, its 'internal' and 'external' link 
+          targets, internal ones normalized and relative to the root dir
+        - 'followups': for each Zettel, its followups, normalized and 
+          relative to the root dir
+        - 'incoming': for each link target, the Zettels linking to it
+        - 'followup-of': for each followup, the Zettels naming it as followup
+        - 'tags': for each Zettel, its tags as strings
+        - 'tagged': for each tag, the Zettels tagged with it (the tag 
+          inverted index)
         
+        All keys are paths relative to the root directory. 
+        Zettelparser.update_index() keeps the graph up to date.
+        
+        :param index: An index (without graph or with an outdated one)
+        :return: The index, containing a fresh graph.
+        """
+        index['graph'] = {'links': {}, 'followups': {}, 
+                          'incoming': {}, 'followup-of': {},
+                          'tags': {}, 'tagged': {}}
+        return Zettelparser._update_graph(index, list(index['files']))
+    
     @staticmethod
-    def update_index(rootdir, index=None, ignore_patterns=None):
+    def update_index(rootdir, index=None, ignore_patterns=None, engine='python',
+                     hash_content=False, fulltext=None):
         """
         Update/build an index for the specified directory.
         
-        If an index is already available, only files with modification dates
-        newer then the timestampt of the index are parsed.
+        If an index is already available, only files that changed according
+        to the index' manifest are parsed (see 
+        Zettelparser._detect_changes()).
         
         If no index is specified, a new index will be built.
         
-        The function uses grep to parse the YAML-Metadata and the Markdown
-        links in the Zettel files. It won't work on a system without grep.
+        By default, the YAML-Metadata and the Markdown links in the Zettel 
+        files are parsed in pure Python, reading each file once. With 
+        engine='grep', the function uses find and grep instead, like older 
+        versions did. That won't work on a system without find and grep.
 
         :param rootdir: the directory containing the Zettel files.
         :param index: An existing index, if available.
         :param ignore_patterns: a list of gitignore-style patterns to be ignored by grep
-        :return: The index in dictionary format. 
+        :param engine: 'python' (default) or 'grep'
+        :param hash_content: compare content hashes of files, too, so 
+            files that were only touched aren't parsed again.
+        :param fulltext: a zettels.fulltext.FulltextIndex to update along 
+            with the index, if any
+        :return: The index in dictionary format. It contains the link graph
+            as described in Zettelparser.build_graph().
         """
+        if engine not in ('python', 'grep'):
+            raise ValueError("Unknown engine: " + str(engine))
+        
         logger.debug("Updating index:")
         
         # Generate a empty index, if necessary
@@ -262,165 +888,393 @@ class Zettelparser:
             built_index_from_scratch = True
             index = dict(files=dict())
         
-        logger.debug("Before calling grep, the index looked like this:")
+        # Dumping the whole index to the log would take longer than the 
+        # update itself. Log its size only.
+        logger.debug("Before the update, the index contains " 
+                     + str(len(index['files'])) + " entries.")
         if built_index_from_scratch:
             logger.debug("--Oh, by the way, we built it from scratch.")
-        logger.debug(index)
         
+        stats = Zettelparser.stats
+        
+        # Walk the tree once. Updated and removed files are derived from 
+        # that snapshot.
+        with stats.phase('walk'):
+            snapshot = Zettelparser._snapshot(rootdir, ignore_patterns)
+        with stats.phase('detect changes'):
+            files, removed, manifest = Zettelparser._detect_changes(
+                rootdir, snapshot, index, hash_content)
+        stats.count('files walked', len(snapshot['stats']))
+        stats.count('files indexable', len(snapshot['indexable']))
+        stats.count('files to parse', len(files))
+        stats.count('files removed', len(removed))
+        logger.debug("The walk found " + str(len(files)) + " files to parse "
+                     + "and " + str(len(removed)) + " to remove.")
         
-        # get the list of updated files and the grep output
-        files, grepoutput = Zettelparser._grep_files(rootdir, index, ignore_patterns)
-        logger.debug("Here's what find and grep returned:")
-        logger.debug("files:")
-        logger.debug(files)
-        logger.debug("grepoutput:")
-        logger.debug(grepoutput)
+        if engine == 'grep':
+            # get the grep output
+            with stats.phase('grep'):
+                grepoutput = Zettelparser._grep_files(
+                    rootdir, [os.path.join(rootdir, f) for f in files])
+            stats.count('bytes read', sum(snapshot['stats'][f].st_size 
+                                          for f in files))
+            logger.debug("grep returned " + str(len(grepoutput)) + " bytes.")
+        else:
+            grepoutput = ""
         
-        # generate an empty entry for each updated file, if necessary
+        # generate an empty entry for each updated file. Entries of files
+        # that were indexed before are replaced, too. Otherwise, links and
+        # metadata removed from a file would linger in the index.
         for f in files:
-            # Make the path to the file relative to the root directory
-            f = os.path.relpath(f, rootdir)
-            if not f in index['files']:
-                index['files'][f] = dict(title="untitled", 
-                                         targets=[], 
-                                         tags=[], 
-                                         followups=[])
+            index['files'][f] = Zettelparser._new_entry()
         
-        if built_index_from_scratch:
-            logger.debug("The empty index looks like this:")
-        else:
-            logger.debug("index should be untouched by grep")
-        logger.debug(index)
-
         if grepoutput:
-            #A temporary dict for in which information is 
-            #stored that are needed to parse the metadata
-            for_yaml = dict()
-            for line in grepoutput.splitlines():
-                #because grepoutput is in bytestring format, 
-                #decode it before taking it apart.
-                line = bytes.decode(line)
-                logger.debug("current line of grep output: " + line)
-            
-                #In the first partition, we get the filepath
-                #of the occurrence file
-                f, _, rest = line.partition(':')
-                logger.debug("the rest looks like this: " + rest)
-                
-                # Make the path to the file relative to the root directory
-                f = os.path.relpath(f, rootdir)
-                
-                logger.debug("Current file: " + f)
-                #In the second partition, we get the line
-                #number and the pattern that is responsible 
-                #for this line
-                ln, _, pat = rest.partition(':')
-                
-                # First occurence for that file? Create an empty
-                # entry
-                if not f in for_yaml:
-                    for_yaml[f] = dict(start='', stop='')
-                
-                if pat == "---":
-                # get the line number currently stored for the
-                # pattern
-                    current_ln = for_yaml[f]['start']
-                    # current_ln might be an empty string
-                    if current_ln:
-                        # we want to store the smallest linenumber
-                        # where this pattern occurs
-                        if int(current_ln) > int(ln):
-                            logger.debug("Storing start: " + ln)
-                            for_yaml[f]['start'] = ln
-                        else:
-                            # we might have a YAML block that ends with
-                            # '---' instead of '...'
-                            current_ln = for_yaml[f]['stop']
-                            # same game
-                            if current_ln:
-                                if int(current_ln) > int(ln):
-                                    logger.debug("Storing stop: " + ln)
-                                    for_yaml[f]['stop'] = ln
-                            else:
-                                logger.debug("Storing stop: " + ln)
-                                for_yaml[f]['stop'] = ln
-                    else:
-                        # Yay, our value is new and shiny! Let's store it!
-                        logger.debug("Storing start: " + ln)
-                        for_yaml[f]['start'] = ln                    
-                elif pat == "...":
-                # get the line number currently stored for the
-                # pattern
-                    current_ln = for_yaml[f]['stop']
-                    # current_ln might be an empty string
-                    if current_ln:
-                        # we want to store the smallest linenumber
-                        # where this pattern occurs
-                        # or the second smallest where '---' occurs, which 
-                        # is handled above
-                        if int(current_ln) > int(ln):
-                            logger.debug("Storing stop: " + ln)
-                            for_yaml[f]['stop'] = ln
-                    else:
-                        # Yay, our value is new and shiny! Let's store it!
-                        logger.debug("Storing stop: " + ln)
-                        for_yaml[f]['stop'] = ln
-                #Other patterns are hyperlinks. Write the targets 
-                #of those to the index
-                else:
-                    logger.debug("MD inline link found: " + pat)
-                    # We still have the complete inline link, e.g.
-                    # [Pipes](https://en.wikipedia.org/Pipelines_(Unix))
-                    # We only want the URL-part. The target.
-                    #only the target in parentheses
-                    pat = pat.split("]")[1]
-                    #strip away the front parenthesis
-                    pat = pat.strip("(")
-                    #and the end parenthesis
-                    target = pat.rsplit(")", 1)[0]                    
-                    
-                    if not target in index['files'][f]['targets']:
-                        index['files'][f]['targets'].append(target)
-        
-            logger.debug("Before parsing, for_yaml looks like this:")
-            logger.debug(for_yaml)
+            with stats.phase('grep output'):
+                for_yaml = Zettelparser._parse_grep_output(rootdir, 
+                                                           grepoutput, index)
+            logger.debug("Before parsing, for_yaml contains " 
+                         + str(len(for_yaml)) + " files.")
             
             logger.debug("Parsing metadata...")
             # Parse the metadata contained in for_yaml and write it to index
-            index = Zettelparser._parse_metadata(rootdir, for_yaml, index)
+            with stats.phase('parse metadata'):
+                index = Zettelparser._parse_metadata(rootdir, for_yaml, index)
             logger.debug("Parsing metadata...")
         
+        if engine == 'python':
+            # The scanner delivers metadata and link targets of a file
+            # in one go.
+            with stats.phase('scan'):
+                for f in files:
+                    index['files'][f] = Zettelparser._parse_zettel(rootdir, f, 
+                        fulltext, manifest[f])
+        
         if not built_index_from_scratch:
             # prune the index
-            index = Zettelparser._prune_index(rootdir, index)
+            with stats.phase('prune'):
+                index = Zettelparser._prune_index(index, removed)
+        
+        # Update the link graph for the files that changed
+        with stats.phase('graph'):
+            if built_index_from_scratch or not Zettelparser.has_graph(index):
+                Zettelparser.build_graph(index)
+            else:
+                Zettelparser._update_graph(index, files, removed)
             
-        # write the timestamp and return the completed index
+        # write the manifest and the timestamp and return the completed index
+        index['manifest'] = manifest
         index['timestamp'] = time.time()
+        
+        if fulltext is not None:
+            # Catches up on removed files and files the full-text index 
+            # missed (e.g. because it's new or the grep engine was used).
+            with stats.phase('full-text'):
+                fulltext.sync(rootdir, manifest)
+        stats.count('Zettels in index', len(index['files']))
                 
         logger.debug("Updating index: Done.")
         return index
     
+    @staticmethod
+    def update_store(rootdir, store, ignore_patterns=None, hash_content=False,
+                     fulltext=None):
+        """
+        Update/build an index kept in a store, one Zettel at a time.
+        
+        Unlike Zettelparser.update_index(), this doesn't need the whole 
+        index in memory. Instead, every updated Zettel is upserted into the 
+        store, and every Zettel that doesn't exist anymore is deleted from it.
+        
+        :param rootdir: the directory containing the Zettel files.
+        :param store: the index store, e.g. a zettels.sqliteindex.SQLiteIndex
+        :param ignore_patterns: a list of gitignore-style patterns to be ignored
+        :param hash_content: compare content hashes of files, too, see
+            Zettelparser.update_index()
+        :param fulltext: a zettels.fulltext.FulltextIndex to update along 
+            with the store, if any
+        """
+        logger.debug("Updating index store:")
+        stats = Zettelparser.stats
+        with stats.phase('read manifest'):
+            known = store.paths()
+            old_manifest = store.manifest()
+        with stats.phase('walk'):
+            snapshot = Zettelparser._snapshot(rootdir, ignore_patterns)
+        with stats.phase('detect changes'):
+            files, removed, manifest = Zettelparser._detect_changes(rootdir, 
+                snapshot,
+                dict(files=known, manifest=old_manifest, 
+                     timestamp=store.timestamp),
+                hash_content)
+        stats.count('files walked', len(snapshot['stats']))
+        stats.count('files indexable', len(snapshot['indexable']))
+        stats.count('files to parse', len(files))
+        stats.count('files removed', len(removed))
+        
+        with stats.phase('scan and upsert'):
+            for f in files:
+                store.upsert(f, Zettelparser._parse_zettel(rootdir, f, fulltext, 
+                    manifest[f]), manifest[f])
+        
+        # Files that were only touched keep their entry, but get a new 
+        # manifest record.
+        with stats.phase('update manifest'):
+            for f in (known & snapshot['indexable']) - files:
+                if old_manifest.get(f) != manifest[f]:
+                    store.set_manifest(f, manifest[f])
+        
+        with stats.phase('prune'):
+            for f in removed:
+                logger.debug("Pruning: %s", f)
+                store.delete(f)
+        stats.count('entries pruned', len(removed))
+        
+        store.timestamp = time.time()
+        if fulltext is not None:
+            with stats.phase('full-text'):
+                fulltext.sync(rootdir, manifest)
+        logger.debug("Updating index store: Done.")
+    
+    @staticmethod
+    def update_paths(rootdir, index, paths, ignore_patterns=None, 
+                     hash_content=False, fulltext=None):
+        """
+        Update an index for some files only, without walking the whole tree.
+        
+        This is meant for callers that know which files changed, like 
+        zettels.watcher. Paths that don't exist anymore or are ignored are 
+        removed from the index. Files whose manifest record didn't change 
+        are skipped.
+        
+        :param rootdir: the directory containing the Zettel files.
+        :param index: an index, as returned by Zettelparser.update_index()
+        :param paths: paths of files relative to rootdir
+        :param ignore_patterns: a list of gitignore-style patterns to be ignored
+        :param hash_content: compare content hashes of files, too, see
+            Zettelparser.update_index()
+        :param fulltext: a zettels.fulltext.FulltextIndex to update along 
+            with the index, if any
+        :return: A tuple containing the set of files that were (re)parsed 
+            and the set of files that were removed from the index.
+        """
+        stats = Zettelparser.stats
+        manifest = index.setdefault('manifest', dict())
+        with stats.phase('detect changes'):
+            updated, removed, records = Zettelparser._classify_paths(rootdir, 
+                paths, Zettelparser._ignore_spec(ignore_patterns), 
+                index['files'], manifest, hash_content)
+        manifest.update(records)
+        
+        with stats.phase('scan'):
+            for f in list(updated):
+                try:
+                    index['files'][f] = Zettelparser._parse_zettel(rootdir, f, 
+                        fulltext, manifest[f])
+                except FileNotFoundError:
+                    # Gone before we got to read it.
+                    updated.discard(f)
+                    manifest.pop(f, None)
+                    if f in index['files']:
+                        removed.add(f)
+        
+        with stats.phase('prune'):
+            Zettelparser._prune_index(index, removed)
+            for f in removed:
+                manifest.pop(f, None)
+                if fulltext is not None:
+                    fulltext.remove(f)
+        
+        with stats.phase('graph'):
+            if Zettelparser.has_graph(index):
+                Zettelparser._update_graph(index, updated, removed)
+            else:
+                Zettelparser.build_graph(index)
+        
+        if updated or removed:
+            index['timestamp'] = time.time()
+        return updated, removed
+    
+    @staticmethod
+    def update_store_paths(rootdir, store, paths, ignore_patterns=None, 
+                           hash_content=False, fulltext=None):
+        """
+        Like Zettelparser.update_paths(), but for an index kept in a store 
+        (see Zettelparser.update_store()).
+        
+        :return: A tuple containing the set of files that were (re)parsed 
+            and the set of files that were removed from the store.
+        """
+        manifest = store.manifest()
+        updated, removed, records = Zettelparser._classify_paths(rootdir, 
+            paths, Zettelparser._ignore_spec(ignore_patterns), 
+            store.paths(), manifest, hash_content)
+        
+        for f in records:
+            if f in updated:
+                try:
+                    entry = Zettelparser._parse_zettel(rootdir, f, fulltext, 
+                                                       records[f])
+                except FileNotFoundError:
+                    updated.discard(f)
+                    removed.add(f)
+                    continue
+                store.upsert(f, entry, records[f])
+            else:
+                store.set_manifest(f, records[f])
+        
+        for f in removed:
+            logger.debug("Pruning: " + f)
+            store.delete(f)
+            if fulltext is not None:
+                fulltext.remove(f)
+        
+        if updated or removed:
+            store.timestamp = time.time()
+        return updated, removed
+    
     @staticmethod
     def read_index(filename="index.yaml"):
         """
         Read index from file
         
-        :param filename: path to the index file (YAML)
+        The format of the file (see zettels.indexformats) is detected 
+        automatically. If there's a journal of later changes (see 
+        zettels.journal), it is replayed on top.
+        
+        Reading needs no lock: The index file is only ever replaced as a 
+        whole (see zettels.indexlock), and the version that was opened is 
+        read. Only if it was replaced before its journal was read, it's 
+        read again.
+        
+        :param filename: path to the index file
         :return: The index in dictionary format. 
         """
-        f = open(filename, 'rt')
-        index = yaml.safe_load(f.read())
-        f.close()
+        for attempt in range(_READ_ATTEMPTS):
+            with Zettelparser.stats.phase('read index'):
+                with open(filename, 'rb') as f:
+                    st = os.fstat(f.fileno())
+                    fmt = indexformats.format_of(f.read(16))
+                    f.seek(0)
+                    logger.debug("Reading index in format " + fmt.name)
+                    index = fmt.load(f)
+            with Zettelparser.stats.phase('replay journal'):
+                records = journal.IndexJournal(filename).records(st)
+                if records:
+                    return Zettelparser._replay_journal(index, records)
+            if Zettelparser._is_current(filename, st):
+                # Normal for a moment after a new snapshot was written, 
+                # until write_index() removes the journal. A journal left 
+                # by a crash is replaced by the next update.
+                if records is None:
+                    logger.debug("Ignoring stale journal of " + filename)
+                return index
+            logger.debug("The index file was replaced while reading it.")
+        return index
+    
+    @staticmethod
+    def _is_current(filename, st):
+        # Whether filename is still the file st was taken of
+        try:
+            current = os.stat(filename)
+        except FileNotFoundError:
+            return False
+        return ((current.st_ino, current.st_size, current.st_mtime_ns)
+                == (st.st_ino, st.st_size, st.st_mtime_ns))
+    
+    @staticmethod
+    def _replay_journal(index, records):
+        """
+        Apply the records of a journal to an index, see zettels.journal.
+        """
+        files = index['files']
+        manifest = index.setdefault('manifest', dict())
+        changed = set()
+        removed = set()
+        for record in records:
+            if record[0] == 'upsert':
+                _, path, entry, manifest_record = record
+                if entry is not None:
+                    files[path] = entry
+                    changed.add(path)
+                    removed.discard(path)
+                if manifest_record is not None:
+                    manifest[path] = manifest_record
+            elif record[0] == 'delete':
+                path = record[1]
+                files.pop(path, None)
+                manifest.pop(path, None)
+                removed.add(path)
+                changed.discard(path)
+            elif record[0] == 'timestamp':
+                index['timestamp'] = record[1]
+        Zettelparser.stats.count('journal records replayed', len(records))
+        if Zettelparser.has_graph(index):
+            Zettelparser._update_graph(index, changed, removed)
+        else:
+            Zettelparser.build_graph(index)
         return index
     
     @staticmethod
-    def write_index(index, filename="index.yaml"):
+    def write_index(index, filename="index.yaml", indexformat=None, 
+                    baseline=None):
         """
         Write index to file
         
         :param index: dictionary containing the index
-        :param filename: path to the index file (YAML) to be written
+        :param filename: path to the index file to be written
+        :param indexformat: name of the format to write the index in, 
+            see zettels.indexformats. If omitted, an existing index file 
+            keeps its format and a new one is written as YAML.
+        :param baseline: a zettels.journal.Baseline of the index, for 
+            journal mode: Only the changes since the baseline are appended 
+            to the journal of the index file, unless it's time to write a 
+            new snapshot. The baseline is reset afterwards.
+        """
+        fmt = indexformats.format_for_writing(filename, indexformat)
+        if baseline is not None and Zettelparser._append_journal(index, 
+                filename, fmt, baseline):
+            baseline.reset(index)
+            return
+        logger.debug("Writing index in format " + fmt.name)
+        # Never write the index file in place: Readers may be reading it 
+        # or, like indexformats.MappedIndexFormat, may even have read it 
+        # lazily. And a crash would leave a broken index.
+        with Zettelparser.stats.phase('write index'):
+            with indexlock.atomic_write(filename) as f:
+                fmt.dump(indexformats.materialize(index), f)
+            # The new snapshot contains everything the journal did.
+            journal.IndexJournal(filename).remove()
+        if baseline is not None:
+            baseline.reset(index)
+    
+    @staticmethod
+    def _append_journal(index, filename, fmt, baseline):
+        """
+        Append the changes since baseline to the journal of the index 
+        file. 
+        
+        :return: False, if a new snapshot has to be written instead: There 
+            is none yet or it's in another format, the index isn't the one 
+            the baseline was taken of or the journal is due for compaction.
         """
-        f = open(filename, 'wt')
-        yaml.dump(index, f)
-        f.close()
+        if not os.path.exists(filename):
+            return False
+        if indexformats.detect_format(filename) is not fmt:
+            return False
+        records = baseline.records(index)
+        if records is None:
+            return False
+        if not records:
+            logger.debug("Nothing to write to the journal")
+            return True
+        with Zettelparser.stats.phase('write journal'):
+            indexjournal = journal.IndexJournal(filename)
+            data = indexjournal.encode(records)
+            if indexjournal.needs_compaction(len(data)):
+                logger.debug("Compacting the journal")
+                return False
+            logger.debug("Appending " + str(len(records)) 
+                         + " records to the journal")
+            indexjournal.append(data)
+            Zettelparser.stats.count('journal records written', len(records))
+        return True
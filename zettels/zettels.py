@@ -27,20 +27,21 @@ __author__  = 'Stefan Thesing'
 
 # Libraries
 import argparse
+import collections
 import collections.abc
 import logging
 import os
 import sys
-import xdg.BaseDirectory
-import yaml
 
-# local imports
+# local imports. Modules only some commands need (SQLite, full-text search,
+# tag queries, rankings, export, ...) are imported where they're used, to 
+# keep the startup fast.
+from zettels import frontmatter, indexformats
+from zettels.indexlock import IndexLock
 from zettels.zettelparser import Zettelparser
 from zettels.zettelkasten import Zettelkasten
-import zettels.zettels_setup as setup
 
 # Module variables
-settings_base_dir = xdg.BaseDirectory.save_config_path('Zettels')
 logger = logging.getLogger('Zettels')
 
 
@@ -61,11 +62,21 @@ def _connect_dev_arguments(parser):
     group_dev.add_argument('-s', '--settings',  help='relative or absolute \
         path to a settings file. Useful if you have several distinct \
         collections of Zettels (e.g. one for testing the program and one \
-        you actually use.). Default is "' + settings_base_dir + '/zettels.cfg.yaml"',
-        default= settings_base_dir + '/zettels.cfg.yaml')
+        you actually use.). Default is "zettels.cfg.yaml" in the directory \
+        "Zettels" of the XDG config directory (usually ~/.config).')
     group_dev.add_argument('-v', '--verbose', help='Output verbose logging \
         messages to stdout. VERY verbose messages.',
         action="store_true")
+    group_dev.add_argument('--stats', action="store_true", help='Output the \
+        time spent in each phase of the run (walking the directory, \
+        scanning, parsing YAML, pruning, reading and writing the index, ...) \
+        and counters (files scanned, bytes read, entries pruned, ...) to \
+        stderr, when done.')
+    group_dev.add_argument('--stats-file', metavar='FILE', help='Write the \
+        timers and counters of --stats to FILE, as JSON.')
+    group_dev.add_argument('--profile', metavar='FILE', help='Run under \
+        cProfile and write the profile to FILE, to be inspected with the \
+        pstats module.')
 
 def _setup_logging(verbose=False):
     logger = logging.getLogger('Zettels')
@@ -89,10 +100,34 @@ def _setup_logging(verbose=False):
     
     return logger
 
+def _check_choice(parser, option, value, choices):
+    # Like the choices of argparse, for options whose choices come from 
+    # modules that are imported only if the option is used.
+    if not value in choices:
+        parser.error("argument " + option + ": invalid choice: " + repr(value)
+                     + " (choose from " + ", ".join(repr(c) for c in choices)
+                     + ")")
+
+def _flag(settings, key):
+    # An optional setting that's true or false, false if it's not set. 
+    # Anything else is an error: bool() would make a quoted 'false' true.
+    value = settings.get(key)
+    if value is None:
+        return False
+    if not isinstance(value, bool):
+        logger.error("There seems to be a problem with your settings file. "
+            + "The setting " + key + " must be true or false, not "
+            + repr(value) + ".")
+        logger.error("Exiting")
+        exit()
+    return value
+
 def _read_settings(f):
     try:
         f = open(f, 'r')
-        settings = yaml.safe_load(f.read())
+        # Settings files are simple enough to be parsed without PyYAML 
+        # (which is only imported if needed), see zettels.frontmatter
+        settings = frontmatter.load_document(f.read())
         f.close()
         # We should have received a Dictionary or other mapping type
         if isinstance(settings, collections.abc.Mapping):
@@ -111,7 +146,12 @@ def _read_settings(f):
             outputformat    = settings['outputformat']
             prettyformat    = settings['prettyformat']
             ignore_patterns = settings['ignore']
-            return rootdir, indexfile, outputformat, prettyformat, ignore_patterns
+            # Optional settings, with their defaults
+            options = dict(indexformat=settings.get('indexformat'),
+                           hashcontent=_flag(settings, 'hashcontent'),
+                           fulltext=_flag(settings, 'fulltext'),
+                           journal=_flag(settings, 'journal'))
+            return rootdir, indexfile, outputformat, prettyformat, ignore_patterns, options
         else:
             print("There seems to be a problem with your settings \
                 file. Zettels expected to receive a dictionary or other \
@@ -123,7 +163,7 @@ def _read_settings(f):
         logger.error("Settings file not found. Please specify a correct one or run \
             Zettels with the --setup parameter to generate one.")
         exit()
-    except yaml.YAMLError:
+    except ValueError:
         logger.error("There seems to be a problem with your settings file. Is it \
             valid YAML?")
         logger.error(sys.exc_info()[1])
@@ -133,39 +173,151 @@ def _read_settings(f):
             one required setting is missing:" , str(sys.exc_info()[1]))
         exit()
     
+def _uses_sqlite(indexfile, options):
+    from zettels.sqliteindex import SQLiteIndex
+    # Existing index files are recognized by their content. For new ones,
+    # the setting "indexformat" or the file extension decide.
+    if os.path.exists(indexfile):
+        return SQLiteIndex.is_sqlite(indexfile)
+    return (options['indexformat'] == 'sqlite' 
+            or SQLiteIndex.is_sqlite(indexfile))
+
+def _write_format(options):
+    # The format to write a (non-SQLite) index file in. An existing index 
+    # file that isn't an SQLite database keeps its format, even if the 
+    # settings ask for SQLite. That takes --convert-index sqlite.
+    if options['indexformat'] == 'sqlite':
+        return None
+    return options['indexformat']
+
+def _baseline(index, options):
+    # In journal mode, updates are appended to the journal of the index 
+    # file, see zettels.journal.
+    if options['journal']:
+        from zettels import journal
+        return journal.Baseline(index)
+    return None
+
+def _manifest_of(index):
+    # Indexes written before manifests existed have none. Without a record
+    # to compare to, files are only read into the full-text index once.
+    return index.get('manifest') or dict.fromkeys(index['files'])
+
+def _save_fulltext(fulltext, indexfile):
+    if fulltext is not None and fulltext.changed:
+        from zettels.fulltext import filename_for as fulltext_filename_for
+        logger.debug("Writing full-text index")
+        fulltext.save(fulltext_filename_for(indexfile))
+
+def _index_not_found(indexfile):
+    logger.error("Index file not found: " + indexfile)
+    logger.error("If you run Zettels with these settings for the "
+        + "first time, please run it once without any arguments, "
+        + "first. Or set the --update flag.")
+    logger.error("Otherwise, please check your settings or run " 
+        + "Zettels with the --setup parameter to generate new settings.")
+    logger.error("Exiting")
+    exit()
+
 def _query(args):
     logger.debug(args)
     
     # Next, let's read the settings file. _read_settings(settings) does the
     # error handling
-    rootdir, indexfile, outputformat, prettyformat, ignore_patterns = _read_settings(args.settings)
+    rootdir, indexfile, outputformat, prettyformat, ignore_patterns, options = _read_settings(args.settings)
     # If we're still running, we have valid settings.
     logger.debug("Root dir: " + rootdir)
     logger.debug("Index file: " + indexfile)
     
-    logger.debug("Reading index...")
+    # Updates and searches may write the full-text index. They hold the 
+    # lock from loading it until it's saved, so they can't overwrite each
+    # other's changes. Other queries read the index without locking. 
+    # Updates are serialized, see zettels.indexlock.
+    lock = IndexLock(indexfile)
+    if args.update or args.search:
+        lock.acquire()
     try:
-        index = Zettelparser.read_index(indexfile)
-    except FileNotFoundError:
-        logger.error(sys.exc_info()[1])
-        logger.error("If you run Zettels with these settings for the "
-            + "first time, please run it once without any arguments, "
-            + "first. Or set the --update flag.")
-        logger.error("Otherwise, please check your settings or run " 
-            + "Zettels with the --setup parameter to generate new settings.")
-        logger.error("Exiting")
-        exit()
-    logger.debug("Done")
+        # The full-text index is only needed if it's kept up to date on 
+        # every update or we're going to search it.
+        fulltext = None
+        if options['fulltext'] or args.search:
+            from zettels.fulltext import (FulltextIndex, 
+                                          filename_for as fulltext_filename_for)
+            fulltext = FulltextIndex.load(fulltext_filename_for(indexfile))
+        
+        if _uses_sqlite(indexfile, options):
+            from zettels.sqliteindex import SQLiteIndex, SQLiteZettelkasten
+            logger.debug("Opening SQLite index...")
+            if not os.path.exists(indexfile) and not args.update:
+                _index_not_found(indexfile)
+            store = SQLiteIndex(indexfile)
+            if args.update:
+                Zettelparser.update_store(rootdir, store, ignore_patterns=ignore_patterns,
+                                          hash_content=options['hashcontent'],
+                                          fulltext=fulltext)
+            elif args.search:
+                fulltext.sync(rootdir, store.manifest())
+            logger.debug("Done")
+            # Initialize a Zettelkasten
+            zk = SQLiteZettelkasten(store, rootdir, fulltext)
+        else:
+            logger.debug("Reading index...")
+            try:
+                index = Zettelparser.read_index(indexfile)
+            except FileNotFoundError:
+                _index_not_found(indexfile)
+            logger.debug("Done")
+            
+            if args.update:
+                baseline = _baseline(index, options)
+                index = Zettelparser.update_index(rootdir, index, ignore_patterns=ignore_patterns,
+                                                  hash_content=options['hashcontent'],
+                                                  fulltext=fulltext)
+                logger.debug("Writing index to file " + indexfile)
+                Zettelparser.write_index(index, indexfile, _write_format(options),
+                                         baseline)
+                logger.debug("Done")
+            elif args.search:
+                # A new full-text index or one that missed updates catches
+                # up with the index.
+                fulltext.sync(rootdir, _manifest_of(index))
+            
+            # Initialize a Zettelkasten. A batch may run for a long time, 
+            # so a fully loaded index is compacted and the dictionary 
+            # dropped. A memory-mapped index is left as it is: it loads 
+            # entries on demand only.
+            if args.batch and not isinstance(index['files'], indexformats.LazySection):
+                from zettels.compactindex import CompactZettelkasten
+                zk = CompactZettelkasten(index, rootdir, fulltext)
+                del index
+            else:
+                zk = Zettelkasten(index, rootdir, fulltext)
+        _save_fulltext(fulltext, indexfile)
+    finally:
+        lock.release()
+    # Now, let's do what we're told:
     
-    if args.update:
-        index = Zettelparser.update_index(rootdir, index, ignore_patterns=ignore_patterns)
-        logger.debug("Writing index to file " + indexfile)
-        Zettelparser.write_index(index, indexfile)
-        logger.debug("Done")
+    if args.batch:
+        _batch(zk, args)
+        return
     
-    # Initialize a Zettelkasten
-    zk = Zettelkasten(index, rootdir)
-    # Now, let's do what we're told:
+    if args.export:
+        _export(zk, args)
+        return
+    
+    if args.check:
+        _check(zk, args.check)
+        return
+    
+    if args.tags:
+        _tag_query(zk, args, prettyformat)
+        return
+    
+    if args.search:
+        for entry in zk.search(args.search, as_output=True,
+                               outputformat=args.output or prettyformat):
+            print(entry)
+        return
     
     if not args.Zettel:
     # When no Zettel argument is given, this implies the pretty flag, 
@@ -188,10 +340,19 @@ def _query(args):
     #Has the pretty flag been set (explicitly or implicitly)?
     elif args.pretty:
         outputformat = prettyformat
+    
+    if args.rank:
+        _rank_query(zk, args, outputformat)
+        return
+    
+    if args.neighborhood is not None and args.Zettel:
+        _neighborhood_query(zk, args, outputformat)
+        return
       
     if not args.Zettel:
-        for entry in zk.get_list_of_zettels(as_output=True, 
-                                        outputformat=outputformat):
+        for entry in zk.iter_zettels(args.offset, args.limit, 
+                                     sort=not args.unsorted, as_output=True,
+                                     outputformat=outputformat):
             print(entry)
     else:
         # In case our zettel arguments came from a pipe via stdin,
@@ -228,22 +389,310 @@ def _query(args):
                                                 outputformat=outputformat):
                     print(entry)
 
+def _rank_query(zk, args, outputformat):
+    # The query output options select the kinds of edges to count (links,
+    # followups or both).
+    if not args.followups and not args.links:
+        args.followups = True
+        args.links = True
+    for entry in zk.get_ranking(args.rank, args.top, links=args.links, 
+                                followups=args.followups, as_output=True,
+                                outputformat=outputformat):
+        print(entry)
+
+def _neighborhood_query(zk, args, outputformat):
+    # The query output options select the kinds of edges to follow. 
+    # With --pretty, the Zettels are grouped by their distance.
+    zettel_args = list(args.Zettel)
+    for zettel_arg in zettel_args:
+        # Arguments from a pipe end with a line break.
+        zettel_arg = zettel_arg.rstrip()
+        if not zettel_arg:
+            continue
+        if len(zettel_args) > 1: print("[", zettel_arg, "]")
+        current = None
+        for entry in zk.get_neighborhood_of(zettel_arg, args.neighborhood, 
+                                            links=args.links,
+                                            followups=args.followups,
+                                            incoming=args.incoming):
+            if args.pretty and entry[2] != current:
+                current = entry[2]
+                print("[", "- Distance " + str(current) + ":", "]")
+            print(outputformat.format(entry))
+
+def _tag_query(zk, args, prettyformat):
+    # List the Zettels matching a tag expression, like the list of all 
+    # Zettels when no ZETTEL argument is given.
+    from zettels import tagquery
+    outputformat = args.output or prettyformat
+    try:
+        matches = zk.get_zettels_matching(args.tags, as_output=True,
+                                          outputformat=outputformat)
+    except tagquery.TagExpressionError as e:
+        logger.error(e)
+        logger.error("Exiting")
+        exit()
+    for entry in matches:
+        print(entry)
+
+def _check(zk, reportformat):
+    # Output the integrity report of the Zettelkasten
+    report = zk.get_integrity_report()
+    if reportformat == 'json':
+        import json
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+    print("[", "Zettels: " + str(report['zettels']), "]")
+    print("[", "Dangling links: " + str(len(report['dangling links'])), "]")
+    for source, target in report['dangling links']:
+        print(source + " -> " + target)
+    print("[", "Orphans: " + str(len(report['orphans'])), "]")
+    for zettel in report['orphans']:
+        print(zettel)
+    print("[", "Broken followups: " + str(len(report['broken followups'])), 
+          "]")
+    for source, followup in report['broken followups']:
+        print(source + " -> " + followup)
+    print("[", "Followup cycles: " + str(len(report['followup cycles'])), "]")
+    for cycle in report['followup cycles']:
+        print(" <-> ".join(cycle))
+
+def _export(zk, args):
+    # Write the graph to stdout or a file, filtered by the tag expression 
+    # and the directory given, if any.
+    from zettels import tagquery
+    out = sys.stdout
+    if args.export_file:
+        try:
+            out = open(args.export_file, 'w', encoding='utf-8', newline='')
+        except OSError as e:
+            logger.error("Can't write to " + args.export_file + ": " + str(e))
+            logger.error("Exiting")
+            exit()
+    try:
+        zk.export_graph(out, args.export, expression=args.tags, 
+                        subdir=args.subdir)
+    except tagquery.TagExpressionError as e:
+        logger.error(e)
+        logger.error("Exiting")
+        exit()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+def _batch(zk, args):
+    # Batch mode: Resolve each ZETTEL argument once, look up all requested
+    # relations at once, and write one JSON record per line as soon as 
+    # it's ready. Arguments from a pipe are streamed, not read up front.
+    import json
+    if not args.followups and not args.links and not args.incoming:
+        args.followups = True
+        args.links = True
+        args.incoming = True
+    
+    zettel_args = args.Zettel or []
+    if hasattr(zettel_args, 'readline'):
+        zettel_args = iter(zettel_args.readline, '')
+    
+    for zettel_arg in zettel_args:
+        # In case our zettel arguments came from a pipe via stdin,
+        # they each end with a line break. We have to strip those away.
+        zettel_arg = zettel_arg.rstrip()
+        if not zettel_arg:
+            continue
+        record = collections.OrderedDict(zettel=zettel_arg)
+        try:
+            relations = zk.get_relations_of(zettel_arg, 
+                                            followups=args.followups,
+                                            targets=args.links,
+                                            incoming=args.incoming)
+        except KeyError as e:
+            record['error'] = "Not in the index: " + str(e)
+        else:
+            record['path'] = relations['path']
+            record['title'] = relations['title']
+            for field, relation in (('followups', 'followups'), 
+                                    ('links', 'targets'), 
+                                    ('incoming', 'incoming')):
+                if relation in relations:
+                    record[field] = [dict(title=title, path=path) 
+                                     for title, path in relations[relation]]
+        print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+
 def _parse(args):
     logger.debug(args)
     
     # Read the settings file. _read_settings(settings) does the
     # error handling
-    rootdir, indexfile, _, _, ignore_patterns = _read_settings(args.settings)
+    rootdir, indexfile, _, _, ignore_patterns, options = _read_settings(args.settings)
     # If we're still running, we have valid settings.
     logger.debug("Root dir: " + rootdir)
     logger.debug("Index file: " + indexfile)
-    index = Zettelparser.read_index(indexfile)
     
-    index = Zettelparser.update_index(rootdir, index, ignore_patterns=ignore_patterns)
-    logger.debug("Writing index to file " + indexfile)
-    Zettelparser.write_index(index, indexfile)
+    # SQLite serializes the updates of the index itself. The lock is still
+    # needed for the full-text index.
+    with IndexLock(indexfile):
+        fulltext = None
+        if options['fulltext']:
+            from zettels.fulltext import (FulltextIndex, 
+                                          filename_for as fulltext_filename_for)
+            fulltext = FulltextIndex.load(fulltext_filename_for(indexfile))
+        if _uses_sqlite(indexfile, options):
+            from zettels.sqliteindex import SQLiteIndex
+            store = SQLiteIndex(indexfile)
+            Zettelparser.update_store(rootdir, store, ignore_patterns=ignore_patterns,
+                                      hash_content=options['hashcontent'],
+                                      fulltext=fulltext)
+            store.close()
+            _save_fulltext(fulltext, indexfile)
+            logger.debug("Done")
+            return
+        
+        index = Zettelparser.read_index(indexfile)
+        baseline = _baseline(index, options)
+        
+        index = Zettelparser.update_index(rootdir, index, ignore_patterns=ignore_patterns,
+                                          hash_content=options['hashcontent'],
+                                          fulltext=fulltext)
+        logger.debug("Writing index to file " + indexfile)
+        Zettelparser.write_index(index, indexfile, _write_format(options), baseline)
+        _save_fulltext(fulltext, indexfile)
     logger.debug("Done")
 
+def _watch(args):
+    logger.debug(args)
+    
+    # Read the settings file. _read_settings(settings) does the
+    # error handling
+    rootdir, indexfile, _, _, ignore_patterns, options = _read_settings(args.settings)
+    logger.debug("Root dir: " + rootdir)
+    logger.debug("Index file: " + indexfile)
+    # The watcher excludes the full-text index even if it isn't kept.
+    from zettels.fulltext import FulltextIndex, filename_for as fulltext_filename_for
+    fulltext = None
+    if options['fulltext']:
+        fulltext = FulltextIndex.load(fulltext_filename_for(indexfile))
+    
+    # Only --watch needs the watcher, which imports ctypes (and with it 
+    # subprocess).
+    from zettels.watcher import Watcher, WatchError, known_below
+    
+    # Start watching before the initial update, so no change slips through
+    # in between. Writing the index mustn't trigger an update, in case it's 
+    # kept inside the root directory.
+    try:
+        watcher = Watcher(rootdir, ignore_patterns, 
+            exclude=[indexfile, fulltext_filename_for(indexfile)])
+    except WatchError as e:
+        logger.error(e)
+        logger.error("Exiting")
+        exit()
+    
+    if _uses_sqlite(indexfile, options):
+        from zettels.sqliteindex import SQLiteIndex
+        store = SQLiteIndex(indexfile)
+        # SQLite serializes the updates of the index itself. The lock is
+        # still needed for the full-text index.
+        def update_all():
+            with IndexLock(indexfile):
+                Zettelparser.update_store(rootdir, store, 
+                    ignore_patterns=ignore_patterns, 
+                    hash_content=options['hashcontent'], fulltext=fulltext)
+                _save_fulltext(fulltext, indexfile)
+        def update_some(changed, gone):
+            paths = changed | known_below(store.paths(), gone)
+            with IndexLock(indexfile):
+                updated, removed = Zettelparser.update_store_paths(rootdir, 
+                    store, paths, ignore_patterns=ignore_patterns, 
+                    hash_content=options['hashcontent'], fulltext=fulltext)
+                _save_fulltext(fulltext, indexfile)
+            return updated, removed
+    else:
+        store = None
+        try:
+            index = Zettelparser.read_index(indexfile)
+        except FileNotFoundError:
+            index = None
+        baseline = _baseline(index, options)
+        # The lock is held per batch only, so other updates can run while
+        # we're waiting for changes.
+        def update_all():
+            nonlocal index
+            with IndexLock(indexfile):
+                index = Zettelparser.update_index(rootdir, index, 
+                    ignore_patterns=ignore_patterns, 
+                    hash_content=options['hashcontent'], fulltext=fulltext)
+                Zettelparser.write_index(index, indexfile, 
+                                         _write_format(options), baseline)
+                _save_fulltext(fulltext, indexfile)
+        def update_some(changed, gone):
+            paths = changed | known_below(index['files'], gone)
+            with IndexLock(indexfile):
+                updated, removed = Zettelparser.update_paths(rootdir, index, 
+                    paths, ignore_patterns=ignore_patterns, 
+                    hash_content=options['hashcontent'], fulltext=fulltext)
+                # Persist once per batch, and only if anything changed.
+                if updated or removed:
+                    Zettelparser.write_index(index, indexfile, 
+                                             _write_format(options), baseline)
+                _save_fulltext(fulltext, indexfile)
+            return updated, removed
+    
+    update_all()
+    logger.info("Watching " + rootdir + " for changes. Stop with Ctrl+C.")
+    try:
+        for changed, gone in watcher.batches():
+            if changed is None:
+                logger.info("Lost track of changes. Updating the whole index.")
+                update_all()
+                continue
+            updated, removed = update_some(changed, gone)
+            if updated or removed:
+                logger.info("Index updated: " + str(len(updated)) 
+                            + " parsed, " + str(len(removed)) + " removed.")
+    except KeyboardInterrupt:
+        logger.debug("Stopped watching.")
+    finally:
+        watcher.close()
+        if store is not None:
+            store.close()
+
+def _convert(args):
+    logger.debug(args)
+    
+    # Read the settings file. _read_settings(settings) does the
+    # error handling
+    _, indexfile, _, _, _, _ = _read_settings(args.settings)
+    logger.debug("Index file: " + indexfile)
+    from zettels import journal
+    from zettels.sqliteindex import SQLiteIndex
+    # Other updates have to wait until the index is converted.
+    with IndexLock(indexfile):
+        if SQLiteIndex.is_sqlite(indexfile):
+            store = SQLiteIndex(indexfile)
+            index = store.to_index()
+            store.close()
+        else:
+            index = Zettelparser.read_index(indexfile)
+    
+        logger.debug("Converting index file " + indexfile + " to " 
+                     + args.convert_index)
+        # Write the converted index next to the old one first, so the old one 
+        # stays intact if anything goes wrong.
+        tmpfile = indexfile + '.converting'
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        if args.convert_index == 'sqlite':
+            store = SQLiteIndex(tmpfile)
+            store.from_index(index)
+            store.close()
+        else:
+            Zettelparser.write_index(index, tmpfile, args.convert_index)
+        os.replace(tmpfile, indexfile)
+        # The converted index contains the changes in the journal.
+        journal.IndexJournal(indexfile).remove()
+        logger.debug("Done")
+
 #################################
 # Main function                 #
 #################################
@@ -260,9 +709,6 @@ def main():
     # Define command line arguments                 #
     #################################################
     
-    # Standard settings dir:
-    settings_base_dir = xdg.BaseDirectory.save_config_path('Zettels')
-    
     # Define the parser
     parser = argparse.ArgumentParser(description=
         "Zettels is an implementation of Niklas Luhmann's system of a \
@@ -275,6 +721,16 @@ def main():
         action="store_true")
     parser.add_argument('-su', '--silentupdate', action="store_true",
         help='Silently build or update the index and exit.')
+    parser.add_argument('--watch', action="store_true",
+        help='Keep running and keep the index up to date: Build or update \
+        the index, then watch the root directory for changes (Linux only) \
+        and update the index for the changed files. Stop with Ctrl+C.')
+    parser.add_argument('--convert-index', metavar='FORMAT', 
+        choices=indexformats.format_names() + ['sqlite'],
+        help='Convert the index file to FORMAT (one of: ' 
+        + ', '.join(indexformats.format_names() + ['sqlite']) + ') and \
+        exit. The format of an index file is detected when reading it, and \
+        updates keep it, unless the setting "indexformat" says otherwise.')
     
     group_query = parser.add_argument_group('Query options')
     # One (optional) postional argument, which is a Zettel
@@ -298,6 +754,63 @@ def main():
                         (implying the --pretty flag).')
     group_query.add_argument('-u', '--update', action="store_true",
         help='Update the index before the query.')
+    group_query.add_argument('-N', '--neighborhood', metavar='DEPTH', 
+        type=int, help='Output all Zettels within DEPTH hops of the \
+        specified Zettel(s), nearest first. The query output options \
+        select which edges to follow (default: all). Besides title and \
+        path, the output format can access the distance as "{0[2]}".')
+    group_query.add_argument('-t', '--tags', metavar='EXPRESSION',
+        help='List the Zettels whose tags match EXPRESSION, e.g. \
+        \'python AND (zettel OR "data science") AND NOT draft\'. Tags \
+        following each other without operator are combined with AND. \
+        ZETTEL arguments are ignored.')
+    group_query.add_argument('--search', metavar='QUERY',
+        help='Search the text of the Zettels for the words in QUERY and \
+        list the Zettels containing any of them, best match first. Uses \
+        a full-text index kept next to the index file, which is built on \
+        first use. Set "fulltext: true" in the settings to update it with \
+        every update of the index. ZETTEL arguments are ignored.')
+    group_query.add_argument('-b', '--batch', action="store_true",
+        help='Batch mode for many ZETTEL arguments, e.g. piped from other \
+        tools: Output one JSON record per ZETTEL and line (NDJSON), \
+        containing its path, title and the relations selected by the \
+        query output options. Records are written as soon as they are \
+        ready. Output format options are ignored.')
+    group_query.add_argument('--check', metavar='FORMAT', nargs='?',
+        const='text', choices=['text', 'json'],
+        help='Check the integrity of the Zettelkasten and report links to \
+        missing files, orphans (Zettels no other Zettel links to), \
+        followups that aren\'t in the index and cycles of followups. \
+        FORMAT is "text" (default) or "json". ZETTEL arguments are \
+        ignored.')
+    
+    group_query.add_argument('--rank', metavar='MEASURE', 
+        help='List the most central Zettels by MEASURE (pagerank, \
+        authority, hub, in-degree, out-degree), highest score first. \
+        -l and -f select whether links between Zettels, followups or both \
+        (default) count as edges. Besides title and path, the output \
+        format can access the score as "{0[2]}". Uses NumPy, if \
+        installed. ZETTEL arguments are ignored.')
+    group_query.add_argument('--top', metavar='N', type=int, default=10,
+        help='With --rank, list the top N Zettels (default: 10).')
+    group_query.add_argument('--export', metavar='FORMAT', 
+        help='Export the graph of the Zettelkasten (Zettels with title and \
+        tags, links between them and followups) in FORMAT (dot, graphml, \
+        tsv, csv). tsv and csv are edge lists. Use --tags and --subdir to export a part of it. ZETTEL \
+        arguments are ignored.')
+    group_query.add_argument('--export-file', metavar='FILE',
+        help='Write the export to FILE instead of the standard output.')
+    group_query.add_argument('--subdir', metavar='DIR',
+        help='Only export the Zettels in DIR and its subdirectories.')
+    group_query.add_argument('--limit', metavar='N', type=int,
+        help='When listing all Zettels (no ZETTEL argument), output at most \
+        N of them.')
+    group_query.add_argument('--offset', metavar='N', type=int, default=0,
+        help='When listing all Zettels, skip the first N of them. Together \
+        with --limit, this pages through the list.')
+    group_query.add_argument('--unsorted', action="store_true",
+        help='When listing all Zettels, output them in the order of the \
+        index instead of sorting them, as soon as they are read.')
     
     # Output arguments
     group_output = parser.add_argument_group('Query output options', 'Flags to \
@@ -343,13 +856,34 @@ def main():
     
     args = parser.parse_args()
     
+    # The defaults and choices that need other modules are filled in and 
+    # checked here, so those modules are only imported if needed.
+    if args.settings is None:
+        # The standard settings dir. It's created by --setup, queries 
+        # don't need it to exist.
+        import xdg.BaseDirectory
+        args.settings = os.path.join(xdg.BaseDirectory.xdg_config_home, 
+                                     'Zettels', 'zettels.cfg.yaml')
+    if args.rank is not None:
+        from zettels import centrality
+        _check_choice(parser, '--rank', args.rank, centrality.MEASURES)
+    if args.export is not None:
+        from zettels import graphexport
+        _check_choice(parser, '--export', args.export, 
+                      graphexport.format_names())
+    
     # First check the --setup argument, because it overrides everything else
     if args.setup:
+        import zettels.zettels_setup as setup
         setup.generate_settings()
     
     # Next, see if we're supposed to parse only or query, too.
     if args.silentupdate:
         args.func = _parse # default is _query, set in the argparser options.
+    if args.convert_index:
+        args.func = _convert
+    if args.watch:
+        args.func = _watch
     
     # Perpare the logger
     logger = _setup_logging(args.verbose)
@@ -357,7 +891,28 @@ def main():
     # Call the respective function for each subcommand
     # That is _parse(args) for the main command and _query(args) for the query 
     # subcommand
-    args.func(args)
+    try:
+        with Zettelparser.stats.phase('total'):
+            if args.profile:
+                import cProfile
+                profiler = cProfile.Profile()
+                try:
+                    profiler.runcall(args.func, args)
+                finally:
+                    profiler.dump_stats(args.profile)
+                    logger.debug("Profile written to " + args.profile)
+            else:
+                args.func(args)
+    finally:
+        _report_stats(args)
+
+def _report_stats(args):
+    if args.stats:
+        print(Zettelparser.stats.format(), file=sys.stderr)
+    if args.stats_file:
+        import json
+        with open(args.stats_file, 'w') as f:
+            json.dump(Zettelparser.stats.report(), f, indent=1)
         
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -69,6 +69,19 @@ def _generate_settings():
         f.write("# see https://github.com/sthesing/Zettels\n")
         f.write('rootdir: ' + rootdir + '\n')
         f.write('indexfile: ' + indexfile + '\n')
+        f.write('# Format of the index file: yaml, binary, binary-zlib,\n')
+        f.write('# mmap or sqlite. If not set, an existing index file keeps its\n')
+        f.write('# format. Index files ending with .sqlite or .db are\n')
+        f.write('# SQLite databases.\n')
+        f.write('#indexformat: binary\n')
+        f.write('# Compare content hashes on updates, so files that were\n')
+        f.write('# only touched are not parsed again.\n')
+        f.write('#hashcontent: true\n')
+        f.write('# Keep a full-text index of the Zettels next to the index\n')
+        f.write('# file, for --search.\n')
+        f.write('#fulltext: true\n')
+        f.write('# Append updates to a journal instead of rewriting the index.\n')
+        f.write('#journal: true\n')
         f.write('outputformat: \'' + outputformat + '\'\n')
         f.write('prettyformat: \'' + prettyformat + '\'\n')
         f.write('ignore: {\n')